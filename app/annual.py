@@ -0,0 +1,303 @@
+"""Annual glare autonomy of views without rendering every hour of the year.
+
+The vertical eye illuminance of each view is estimated for all the daylit hours of an
+EPW at once from its direct and diffuse illuminance and two coefficients per view, and
+the simplified daylight glare probability (DGPs) follows from the illuminance. The
+hours with the highest DGPs are rendered as usual. Their images give the full DGP for
+those hours and their vertical illuminance calibrates the coefficients of each view.
+"""
+from __future__ import annotations
+
+import csv
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from sky import EpwColumns, daylit_hours, sun_vectors
+
+if TYPE_CHECKING:
+    from honeybee_radiance.view import View
+
+
+# an hour is glare free if its DGP is below this. Same as perceptible glare or better
+GLARE_THRESHOLD = 0.4
+# number of hours with the highest DGPs of each view to render
+WORST_HOURS = 3
+# reflectance of the ground for the ground reflected illuminance
+GROUND_REFLECTANCE = 0.2
+
+
+@dataclass
+class ViewCoefficients:
+    """Illuminance coefficients of a view.
+
+    args:
+        name: Name of the view.
+        direction: Unit vector of the view direction in model coordinates.
+        sun: Fraction of the direct illuminance on a plane facing the view direction
+            that reaches the eye.
+        sky: Fraction of the diffuse sky and ground illuminance on a plane facing the
+            view direction that reaches the eye.
+    """
+    name: str
+    direction: Tuple[float, float, float]
+    sun: float
+    sky: float
+
+
+@dataclass
+class AnnualGlare:
+    """Hourly daylight glare probability of views.
+
+    args:
+        views: Names of the views.
+        hours: An array of the hours of the year of the columns of the matrices.
+        dgp: A float array of shape (views, hours) with the DGPs of each view and
+            hour, or the full DGP for the hours that were rendered.
+        vertical_illuminance: A float array of shape (views, hours) with the vertical
+            eye illuminance in lux.
+        evaluated: A boolean array of shape (views, hours) that is True where dgp is
+            the full DGP of a rendered image.
+        coefficients: The ViewCoefficients of the views.
+        threshold: Hours with a DGP below this are glare free.
+    """
+    views: List[str]
+    hours: np.ndarray
+    dgp: np.ndarray
+    vertical_illuminance: np.ndarray
+    evaluated: np.ndarray
+    coefficients: List[ViewCoefficients]
+    threshold: float = GLARE_THRESHOLD
+
+    @property
+    def autonomy(self) -> np.ndarray:
+        """Percentage of the hours that are glare free for each view."""
+        if not self.hours.size:
+            return np.full(len(self.views), 100.0)
+        return (self.dgp < self.threshold).mean(axis=1) * 100
+
+    def worst_views(self, count: int = WORST_HOURS) -> Dict[int, List[str]]:
+        """Get the hours with the highest DGP of each view.
+
+        args:
+            count: Number of hours for each view.
+
+        returns:
+            A dictionary of hour of the year to the names of the views that have the
+            hour among their worst hours, in chronological order.
+        """
+        count = min(count, self.hours.size)
+        if not count:
+            return {}
+        worst = np.argpartition(-self.dgp, count - 1, axis=1)[:, :count]
+        views: Dict[int, List[str]] = {}
+        for view, hours in zip(self.views, self.hours[worst].tolist()):
+            for hour in hours:
+                views.setdefault(hour, []).append(view)
+        return dict(sorted(views.items()))
+
+
+def view_coefficients(views: Sequence[View],
+                      transmittance: float) -> List[ViewCoefficients]:
+    """Get the coefficients of views that look through unobstructed glass.
+
+    These are the coefficients before they are calibrated against rendered images.
+
+    args:
+        views: A list of Honeybee Radiance views. Usually from helper.get_views.
+        transmittance: Transmittance of the glass.
+
+    returns:
+        A list of ViewCoefficients.
+    """
+    coefficients = []
+    for view in views:
+        direction = np.asarray(view.direction, dtype=np.float64)
+        direction /= np.linalg.norm(direction)
+        coefficients.append(ViewCoefficients(
+            view.identifier, tuple(direction.tolist()), transmittance, transmittance))
+    return coefficients
+
+
+def illuminance_components(columns: EpwColumns, hours: Sequence[int],
+                           directions: Sequence[Tuple[float, float, float]],
+                           north_angle: float = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the direct and the diffuse illuminance on planes facing view directions.
+
+    args:
+        columns: An EpwColumns object.
+        hours: A list of hours of the year.
+        directions: Unit vectors of the view directions.
+        north_angle: Counter clockwise rotation of the North vector in degrees.
+
+    returns:
+        A tuple with the direct and the diffuse illuminance in lux. Both are arrays
+        of shape (len(directions), len(hours)).
+    """
+    hours = np.asarray(hours, dtype=np.int64)
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    sun = sun_vectors(columns, hours, north_angle)
+
+    cosine = np.clip(directions @ sun.T, 0, None) * (sun[:, 2] > 0)
+    direct = cosine * columns['direct_normal_illuminance'][hours]
+
+    # view factors of the sky and the ground for a plane tilted by the view direction
+    tilt = directions[:, 2:3]
+    diffuse = (1 + tilt) / 2 * columns['diffuse_horizontal_illuminance'][hours] + \
+        GROUND_REFLECTANCE * (1 - tilt) / 2 * \
+        columns['global_horizontal_illuminance'][hours]
+    return direct, diffuse
+
+
+def simplified_dgp(vertical_illuminance: np.ndarray) -> np.ndarray:
+    """Get the simplified daylight glare probability from the vertical eye illuminance.
+
+    DGPs does not see the contrast of bright sources, such as the sun in the field of
+    view, so the worst hours should be checked with the full DGP.
+    """
+    return np.minimum(6.22e-5 * vertical_illuminance + 0.184, 1.0)
+
+
+def annual_glare(columns: EpwColumns, coefficients: List[ViewCoefficients],
+                 north_angle: float = 0, hours: Sequence[int] = None,
+                 threshold: float = GLARE_THRESHOLD) -> AnnualGlare:
+    """Get the DGPs of views for many hours of the year in a single pass.
+
+    args:
+        columns: An EpwColumns object.
+        coefficients: A list of ViewCoefficients.
+        north_angle: Counter clockwise rotation of the North vector in degrees.
+        hours: Optional hours of the year. Defaults to the daylit hours of the EPW.
+        threshold: Hours with a DGP below this are glare free.
+
+    returns:
+        An AnnualGlare.
+    """
+    hours = daylit_hours(columns) if hours is None else \
+        np.asarray(hours, dtype=np.int64)
+    direct, diffuse = illuminance_components(
+        columns, hours, [view.direction for view in coefficients], north_angle)
+    sun = np.array([view.sun for view in coefficients], dtype=np.float64)
+    sky = np.array([view.sky for view in coefficients], dtype=np.float64)
+    vertical_illuminance = sun.reshape(-1, 1) * direct + sky.reshape(-1, 1) * diffuse
+
+    return AnnualGlare(
+        [view.name for view in coefficients], hours,
+        simplified_dgp(vertical_illuminance).astype(np.float32),
+        vertical_illuminance.astype(np.float32),
+        np.zeros(vertical_illuminance.shape, dtype=bool), coefficients, threshold)
+
+
+def calibrate(coefficients: List[ViewCoefficients], columns: EpwColumns,
+              measurements: Dict[str, Dict[int, float]],
+              north_angle: float = 0) -> List[ViewCoefficients]:
+    """Fit the coefficients of views to the vertical illuminance of rendered images.
+
+    With measurements at two or more hours the sun and sky coefficients are fitted
+    by least squares. If there is a single measurement or the fit is not physical,
+    both coefficients are scaled by the same factor instead.
+
+    args:
+        coefficients: A list of ViewCoefficients.
+        columns: An EpwColumns object.
+        measurements: A dictionary of view name to a dictionary of hour of the year
+            to vertical eye illuminance in lux. Views without measurements keep
+            their coefficients.
+        north_angle: Counter clockwise rotation of the North vector in degrees.
+
+    returns:
+        A list of ViewCoefficients.
+    """
+    calibrated = []
+    for view in coefficients:
+        measured = measurements.get(view.name)
+        if not measured:
+            calibrated.append(view)
+            continue
+
+        hours = sorted(measured)
+        values = np.array([measured[hour] for hour in hours], dtype=np.float64)
+        direct, diffuse = illuminance_components(columns, hours, [view.direction],
+                                                 north_angle)
+        basis = np.stack([direct[0], diffuse[0]], axis=-1)
+
+        solution = None
+        if len(hours) > 1 and np.linalg.matrix_rank(basis) == 2:
+            solution = np.linalg.lstsq(basis, values, rcond=None)[0]
+        if solution is None or (solution < 0).any():
+            modelled = float((basis @ [view.sun, view.sky]).sum())
+            scale = float(values.sum()) / modelled if modelled > 0 else 1.0
+            solution = (view.sun * scale, view.sky * scale)
+        calibrated.append(ViewCoefficients(
+            view.name, view.direction, float(solution[0]), float(solution[1])))
+    return calibrated
+
+
+def refine(annual: AnnualGlare, columns: EpwColumns,
+           evaluations: Dict[int, Dict[str, Tuple[float, float]]],
+           north_angle: float = 0) -> AnnualGlare:
+    """Update annual results with the evaluations of rendered images.
+
+    The coefficients are calibrated with the vertical illuminance of the images, the
+    DGPs of all the hours is calculated again and the rendered hours get their full
+    DGP.
+
+    args:
+        annual: An AnnualGlare from annual_glare.
+        columns: The EpwColumns of the annual results.
+        evaluations: A dictionary of hour of the year to a dictionary of view name to
+            a tuple of the DGP and the vertical eye illuminance of the image.
+        north_angle: Counter clockwise rotation of the North vector in degrees.
+
+    returns:
+        A new AnnualGlare.
+    """
+    measurements: Dict[str, Dict[int, float]] = {}
+    for hour, views in evaluations.items():
+        for name, (_, illuminance) in views.items():
+            measurements.setdefault(name, {})[hour] = illuminance
+
+    coefficients = calibrate(annual.coefficients, columns, measurements, north_angle)
+    refined = annual_glare(columns, coefficients, north_angle, annual.hours,
+                           annual.threshold)
+
+    columns_of_hours = {hour: index for index, hour in enumerate(refined.hours.tolist())}
+    rows_of_views = {name: index for index, name in enumerate(refined.views)}
+    for hour, views in evaluations.items():
+        column = columns_of_hours.get(hour)
+        if column is None:
+            continue
+        for name, (dgp, illuminance) in views.items():
+            row = rows_of_views.get(name)
+            if row is None:
+                continue
+            refined.dgp[row, column] = dgp
+            refined.vertical_illuminance[row, column] = illuminance
+            refined.evaluated[row, column] = True
+    return refined
+
+
+def write_annual_glare(annual: AnnualGlare, columns: EpwColumns,
+                       target_file: Path) -> Path:
+    """Write the hourly DGP of the views as a CSV file with a column for each view.
+
+    args:
+        annual: An AnnualGlare.
+        columns: The EpwColumns of the annual results.
+        target_file: Path to the CSV file.
+
+    returns:
+        Path to the CSV file.
+    """
+    hours = annual.hours
+    with open(target_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['hour_of_year', 'month', 'day', 'hour'] + annual.views)
+        rows = np.column_stack([
+            hours, columns['month'][hours], columns['day'][hours], hours % 24])
+        for row, dgp in zip(rows.tolist(), annual.dgp.T.astype(np.float64).round(4).tolist()):
+            writer.writerow(row + dgp)
+    return target_file
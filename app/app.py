@@ -1,30 +1,129 @@
-"""Estidama-daylight app."""
+"""Estidama-daylight app.
+
+Modules with heavy dependencies, such as the viewer and the Pollination clients, are
+imported in the stage that first needs them so a new server draws the first page
+quickly. warmup.py loads them in the background after the first page.
+"""
 
-import tempfile
 import streamlit as st
-import rhino3dm
 import time
+import uuid
 
-from PIL import Image
 from pathlib import Path
-
-from ladybug.epw import EPW
-
-from honeybee_3dm.model import import_3dm
-from honeybee_radiance_command.ra_gif import Ra_GIF
-from honeybee_radiance.config import folders as rad_folders
+from typing import Dict, Tuple
 
 from pollination_streamlit_io import get_host
 
-from viewer import show_model
-from helper import write_config, get_sky, get_views, load_css, rhino_3dm_to_hbjson
-from process_hdr import eval_hdr, hdr_to_gif
-from simulation import create_job, recreate_job, request_status, SimStatus,\
-    download_output
+from annual import AnnualGlare, refine, write_annual_glare
+from helper import load_css, rhino_3dm_to_artifact, save_upload
+from pipeline import config_pipeline
+from process_hdr import post_process_results, ViewResult
+from executor import TASKS, SessionExecutor
+from tracing import set_session, span
+from warmup import warm_up
+from workspace import WORKSPACES, format_size
+
+# seconds that Refresh waits for a fresh status of the job
+REFRESH_TIMEOUT = 10
 
 # TODO: add docstring to all the functions
 
 
+def show_view_result(view_result: ViewResult) -> None:
+    if view_result.error:
+        st.error(f'Failed to process {view_result.name}: {view_result.error}')
+        return
+    st.markdown(f'{view_result.name}: {int(view_result.dgp*100)}% probability of'
+                f' {view_result.category} glare')
+    st.image(view_result.preview)
+
+
+def show_annual_glare(annual: AnnualGlare, csv_path: Path) -> None:
+    st.markdown(f'Glare autonomy over {annual.hours.size} daylit hours. An hour is'
+                f' glare free if its daylight glare probability is below'
+                f' {annual.threshold}.')
+    highest = annual.dgp.max(axis=1).round(2).tolist() if annual.hours.size else \
+        [None] * len(annual.views)
+    st.table({
+        'View': annual.views,
+        'Glare autonomy (%)': annual.autonomy.round(1).tolist(),
+        'Highest DGP': highest
+    })
+    st.download_button('Download hourly DGP', csv_path.read_bytes(),
+                       file_name=csv_path.name, mime='text/csv')
+
+
+def evaluate_annual_runs(backend, job_url: str, runs: list, target_folder: Path,
+                         executor: SessionExecutor
+                         ) -> Dict[int, Dict[str, Tuple[float, float]]]:
+    """Evaluate the images of each run of an annual job.
+
+    The runs are (hour, view filter) tuples from the annual_runs node of the pipeline
+    in the order they were submitted. The output of each run is found by its
+    arguments, see simulation.job_run. The check images are written next to the
+    folders of the runs because the folder of a run only keeps the files of its
+    output.
+
+    returns:
+        A dictionary of hour of the year to a dictionary of view name to a tuple of
+        the DGP and the vertical eye illuminance.
+    """
+    from backend import stream_backend_output
+
+    evaluations = {}
+    for run_index, (hour, _) in enumerate(runs):
+        folder_name = f'results_{run_index}'
+        run_folder = target_folder.joinpath(folder_name)
+        check_folder = target_folder.joinpath(f'checks_{run_index}')
+        check_folder.mkdir(parents=True, exist_ok=True)
+        hdr_files = (
+            file for file in stream_backend_output(
+                backend, job_url, target_folder, folder_name, 'results', run_index)
+            if file.suffix.lower() == '.hdr'
+        )
+        try:
+            for view_result in post_process_results(run_folder, check_folder,
+                                                    hdr_files=hdr_files,
+                                                    executor=executor):
+                if view_result.error:
+                    st.error(f'Failed to process {view_result.name} at hour {hour}: '
+                             f'{view_result.error}')
+                    continue
+                evaluations.setdefault(hour, {})[view_result.name] = (
+                    view_result.dgp, view_result.vertical_illuminance)
+        except ValueError as error:
+            # the run is missing from the results of the job, usually because it
+            # failed. The other hours still calibrate the views
+            st.error(f'Failed to download the images of hour {hour}: {error}')
+    return evaluations
+
+
+def run_arguments(model, sky: str, view_filter: str = None) -> dict:
+    """Get the recipe arguments of a run that renders one or all the views."""
+    arguments = {'model': model, 'sky': sky}
+    if view_filter:
+        arguments['view-filter'] = view_filter
+    return arguments
+
+
+def translation_progress(executor: SessionExecutor):
+    """Get a callback that shows the progress of a translation on the page."""
+    bar = st.progress(0.0)
+    text = st.empty()
+
+    def update(done: int, total: int) -> None:
+        progress = executor.progress()
+        bar.progress(done / total)
+        text.caption(f'Translated {done} of {total} groups of layers. '
+                     f'{progress.queued} tasks are waiting for a free worker.')
+        if done == total:
+            bar.empty()
+            text.empty()
+            executor.reset_progress()
+
+    return update
+
+
 def main():
 
     st.set_page_config(
@@ -34,6 +133,11 @@ def main():
     )
     load_css()
 
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    set_session(st.session_state.session_id)
+    executor = TASKS.session(st.session_state.session_id)
+
     st.header('Vizan')
     st.markdown('Upload a Rhino file that you would use to generate visualization in a'
                 ' a rendering engine such as Enscape, or V-ray.')
@@ -42,25 +146,44 @@ def main():
     if not st.session_state.host:
         st.session_state.host = 'web'
 
-    if 'temp_folder' not in st.session_state:
-        st.session_state.temp_folder = Path(
-            tempfile.mkdtemp(prefix=f'viz_analytics_{st.session_state.host}_'))
-
-    target_folder = st.session_state.temp_folder
+    target_folder = WORKSPACES.acquire(st.session_state.session_id)
+    if 'rhino_file' in st.session_state and \
+            not st.session_state.rhino_file.exists():
+        # the files of this session were removed while it was idle
+        for key in ('rhino_file', 'rhino_hash', 'epw', 'epw_hash', 'model_artifact',
+                    'hbjson', 'hbjson_hash', 'view_results'):
+            st.session_state.pop(key, None)
+        # the nodes wrote files such as the config to the removed folder
+        if 'pipeline' in st.session_state:
+            st.session_state.pipeline.invalidate()
+        st.warning('Your files were removed after a period of inactivity. '
+                   'Upload them again to continue.')
+
+    stats = WORKSPACES.stats()
+    st.sidebar.caption(f'{stats.sessions} sessions use {format_size(stats.bytes)} of '
+                       f'{format_size(stats.quota)} on disk.')
 
     if 'rhino_file' not in st.session_state:
         rhino_data = st.file_uploader('Upload Rhino file')
         if rhino_data:
             rhino_file = target_folder.joinpath('sample.3dm')
-            rhino_file.write_bytes(rhino_data.read())
+            st.session_state.rhino_hash = save_upload(rhino_data, rhino_file)
+            WORKSPACES.dedupe(rhino_file, st.session_state.rhino_hash)
             st.session_state.rhino_file = rhino_file
 
+    # the configuration stages only run again when one of their inputs changes
+    if 'pipeline' not in st.session_state:
+        st.session_state.pipeline = config_pipeline()
+    pipeline = st.session_state.pipeline
+
     # process rhino file
     if 'rhino_file' in st.session_state:
-        rhino3dm_file = rhino3dm.File3dm.Read(st.session_state.rhino_file.as_posix())
+        pipeline.set(rhino_file=st.session_state.rhino_file,
+                     rhino_hash=st.session_state.rhino_hash)
+        model_index = pipeline.get('model_index')
 
         # select the layer for glass
-        layer_names = [layer.Name for layer in rhino3dm_file.Layers]
+        layer_names = model_index.layer_names
 
         glass_layers = st.multiselect('Select the layers that represent transparent'
                                       ' surfaces in the model.', layer_names)
@@ -78,28 +201,49 @@ def main():
                                       ' . A value between 0 and 360', value=0,
                                       min_value=0, max_value=360)
 
+        annual_mode = st.checkbox(
+            'Annual glare autonomy. Only the hours with the highest glare are'
+            ' simulated and the other daylit hours are estimated from the EPW.')
+
         if 'epw' not in st.session_state or not st.session_state.epw:
             epw_data = st.file_uploader('Upload EPW', type='epw')
 
             if epw_data:
                 epw_file = target_folder.joinpath('sample.epw')
-                epw_file.write_bytes(epw_data.read())
+                st.session_state.epw_hash = save_upload(epw_data, epw_file)
+                WORKSPACES.dedupe(epw_file, st.session_state.epw_hash)
                 st.session_state.epw = epw_file
 
-        if 'epw' in st.session_state and st.session_state.epw:
-            epw = EPW(st.session_state.epw)
+        pipeline.set(glass_layers=glass_layers, ignore_layers=ignore_layers,
+                     transmittance=transmittance, north_angle=north_angle,
+                     target_folder=target_folder, max_workers=TASKS.max_workers)
+        if st.session_state.get('epw'):
+            pipeline.set(epw_file=st.session_state.epw,
+                         epw_hash=st.session_state.epw_hash)
 
-        config, config_path = write_config(glass_layers, ignore_layers,
-                                           transmittance, target_folder)
-
-        views = get_views(rhino3dm_file)
+        views = model_index.views
 
         translate = st.button('Translate to HBJSON')
         if translate:
-            st.session_state.hbjson = rhino_3dm_to_hbjson(rhino3dm_file, config,
-                                                          config_path, views, target_folder)
+            config, config_path = pipeline.get('config')
+            layer_indices = pipeline.get('layer_indices')
+            partitions = pipeline.get('partitions')
+            with WORKSPACES.busy(st.session_state.session_id):
+                artifact = rhino_3dm_to_artifact(
+                    st.session_state.rhino_file, config, config_path, views,
+                    target_folder, st.session_state.rhino_hash, layer_indices,
+                    partitions, executor=executor,
+                    progress=translation_progress(executor),
+                    object_layers=model_index.object_layers)
+            st.session_state.model_artifact = artifact
+            st.session_state.hbjson = artifact.hbjson_path
+            st.session_state.hbjson_hash = artifact.sha256
         if 'hbjson' in st.session_state:
-            show_model(st.session_state.hbjson, target_folder)
+            from viewer import show_model, LOD_TRIANGLE_BUDGET
+            with WORKSPACES.busy(st.session_state.session_id):
+                show_model(st.session_state.hbjson, target_folder,
+                           hbjson_hash=st.session_state.get('hbjson_hash'),
+                           triangle_budget=LOD_TRIANGLE_BUDGET, executor=executor)
 
         with st.form('pollination-credentials'):
             project_owner = st.text_input('Project owner', value='aec-tech-hack-2022')
@@ -114,63 +258,107 @@ def main():
 
             submit = st.form_submit_button('Submit')
             if submit:
-                if not all([project_owner, api_key]):
+                from backend import get_backend, use_local_backend
+                if not project_owner or not (api_key or use_local_backend()):
                     st.error('Fill all inputs')
                     return
                 if 'epw' not in st.session_state:
                     st.error('Upload EPW.')
                     return
 
-                sky = get_sky(EPW(st.session_state.epw), north_angle)
-
-                job = create_job(
-                    {'model': st.session_state.hbjson,
-                     'sky': sky},
-                    project_owner,
-                    project_name,
-                    simulation_name,
-                    simulation_description,
-                    'point-in-time-view',
-                    'latest',
-                    'ladybug-tools',
-                    api_key)
-
-                running_job = job.create()
+                if annual_mode:
+                    runs, skies = pipeline.get('annual_runs')
+                    st.session_state.annual_job = (
+                        runs, pipeline.get('annual'), pipeline.get('epw'), north_angle)
+                else:
+                    runs, skies = [(None, None)], [pipeline.get('sky')]
+                    st.session_state.pop('annual_job', None)
+                for key in ('view_results', 'annual_result'):
+                    st.session_state.pop(key, None)
+
+                backend = get_backend(api_key)
+                with span('submit', backend=type(backend).__name__,
+                          bytes_in=st.session_state.model_artifact.hbjson_path,
+                          runs=len(skies)):
+                    st.session_state.study_url = backend.submit(
+                        [run_arguments(st.session_state.model_artifact, sky, view_filter)
+                         for (_, view_filter), sky in zip(runs, skies)],
+                        project_owner,
+                        project_name,
+                        simulation_name,
+                        simulation_description,
+                        'point-in-time-view',
+                        'latest',
+                        'ladybug-tools')
                 time.sleep(2)
-                st.session_state.study_url = f'https://app.pollination.cloud/{running_job.owner}/projects/{running_job.project}/studies/{running_job.id}'
                 st.success('Simulation successfully submitted to Pollination. Running '
                            ' simulation can be viewed'
                            f' [here]({st.session_state.study_url})')
 
     if 'study_url' in st.session_state and st.session_state.study_url:
-
-        job = recreate_job(st.session_state.study_url, st.session_state.api_key)
-
-        if request_status(job) != SimStatus.COMPLETE:
+        from backend import get_backend, stream_backend_output
+        from simulation import FINAL_STATUSES, SimStatus, JOB_POLLER
+
+        if 'job_statuses' not in st.session_state:
+            st.session_state.job_statuses = {}
+        backend = get_backend(st.session_state.api_key, st.session_state.study_url)
+        status = st.session_state.job_statuses.get(
+            st.session_state.study_url, SimStatus.NOTSTARTED)
+        if status not in FINAL_STATUSES:
+            # the poller forgets the job once it delivers the final status
+            JOB_POLLER.track(st.session_state.study_url, st.session_state.api_key,
+                             st.session_state.job_statuses, backend)
+            status = st.session_state.job_statuses.get(
+                st.session_state.study_url, SimStatus.NOTSTARTED)
+
+        if status != SimStatus.COMPLETE:
             clicked = st.button('Refresh to download results')
             if clicked:
-                status = request_status(job)
+                status = JOB_POLLER.poll_now(st.session_state.study_url,
+                                             timeout=REFRESH_TIMEOUT)
                 st.warning(f'Simulation is {status.name}. You can monitor the progress'
                            f' [here]({st.session_state.study_url})')
+        elif 'annual_job' in st.session_state:
+            csv_path = target_folder.joinpath('annual_dgp.csv')
+            if 'annual_result' not in st.session_state or not csv_path.exists():
+                runs, annual, epw, north_angle = st.session_state.annual_job
+                with WORKSPACES.busy(st.session_state.session_id), \
+                        span('results', views=len(annual.views), runs=len(runs)):
+                    evaluations = evaluate_annual_runs(
+                        backend, st.session_state.study_url, runs, target_folder,
+                        executor)
+                    annual = refine(annual, epw, evaluations, north_angle)
+                    write_annual_glare(annual, epw, csv_path)
+                executor.reset_progress()
+                st.session_state.annual_result = annual
+            show_annual_glare(st.session_state.annual_result, csv_path)
         else:
-            result_folder = download_output(job, target_folder,
-                                            'results', 'results')
-            if result_folder.exists():
-                # testing hdr to gif workflow
-                for file in result_folder.iterdir():
-                    if file.suffix == '.HDR':
-                        print(file)
-                        evalglare_path = Path(r'assets\evalglare\evalglare.exe')
-                        eval_hdr_path, dgp, category = eval_hdr(
-                            file, target_folder, evalglare_path)
-
-                        gif_path = hdr_to_gif(eval_hdr_path, target_folder)
-                        print(gif_path)
-                        image = Image.open(gif_path)
-                        st.markdown(
-                            f'{int(dgp*100)}% probability of {category} glare')
-                        st.image(image)
+            if 'view_results' in st.session_state:
+                for view_result in st.session_state.view_results:
+                    show_view_result(view_result)
+            else:
+                result_folder = target_folder.joinpath('results')
+                # post-process each image as soon as it is extracted
+                hdr_files = (
+                    file for file in stream_backend_output(
+                        backend, st.session_state.study_url, target_folder,
+                        'results', 'results')
+                    if file.suffix.lower() == '.hdr'
+                )
+                view_results = []
+                with WORKSPACES.busy(st.session_state.session_id), \
+                        span('results', views=0) as results:
+                    for view_result in post_process_results(
+                            result_folder, target_folder, hdr_files=hdr_files,
+                            executor=executor):
+                        show_view_result(view_result)
+                        view_results.append(view_result)
+                    results.set(views=len(view_results))
+                executor.reset_progress()
+                st.session_state.view_results = sorted(
+                    view_results, key=lambda result: result.name)
 
 
 if __name__ == '__main__':
     main()
+    warm_up()
@@ -0,0 +1,143 @@
+"""Write Honeybee models as HBJSON artifacts in a single pass."""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable
+
+from cache import hash_file
+
+if TYPE_CHECKING:
+    from honeybee.model import Model
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass
+class ModelArtifact:
+    """A Honeybee model written as HBJSON.
+
+    args:
+        hbjson_path: Path to the HBJSON.
+        sha256: SHA-256 hash of the HBJSON.
+    """
+    hbjson_path: Path
+    sha256: str
+
+
+def _encode(data: dict) -> Iterable[bytes]:
+    """Encode a dictionary as compact JSON with orjson if it is installed."""
+    if orjson is not None:
+        yield orjson.dumps(data)
+        return
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    for chunk in encoder.iterencode(data):
+        yield chunk.encode('utf-8')
+
+
+def write_model(hb_model: Model, target_folder: Path, name: str,
+                metadata: dict = None) -> ModelArtifact:
+    """Serialize a Honeybee model as compact HBJSON and hash it in a single pass.
+
+    The HBJSON is written next to the target and moved in place, so files that are
+    hard linked to an older model, such as cache entries, are never modified. The
+    number of faces of the model is added to its metadata for the viewer.
+
+    args:
+        hb_model: A Honeybee model.
+        target_folder: Path to the folder where the HBJSON will be written.
+        name: Name of the HBJSON without extension.
+        metadata: Optional dictionary to add to the metadata of the HBJSON. Example
+            is the layers of the objects from translation.import_3dm_parallel.
+
+    returns:
+        A ModelArtifact.
+    """
+    target_folder.mkdir(parents=True, exist_ok=True)
+    hbjson_path = target_folder.joinpath(f'{name}.hbjson')
+    temp_path = hbjson_path.with_name(f'{hbjson_path.name}.tmp')
+
+    sha = hashlib.sha256()
+    with open(temp_path, 'wb') as hbjson_file:
+        for chunk in _encode(hb_model.to_dict()):
+            sha.update(chunk)
+            hbjson_file.write(chunk)
+
+    os.replace(temp_path, hbjson_path)
+    artifact = ModelArtifact(hbjson_path, sha.hexdigest())
+    write_metadata(artifact, dict(metadata or {}, faces=face_count(hb_model)))
+    return artifact
+
+
+def face_count(hb_model: Model) -> int:
+    """Number of faces of a model in the same way as viewer.model_face_count.
+
+    The faces of rooms and the orphaned faces, apertures, doors and shades are
+    counted. Apertures and doors of faces are not.
+    """
+    return sum(len(room.faces) for room in hb_model.rooms) + \
+        len(hb_model.orphaned_faces) + len(hb_model.orphaned_apertures) + \
+        len(hb_model.orphaned_doors) + len(hb_model.orphaned_shades)
+
+
+def metadata_path(hbjson_path: Path) -> Path:
+    """Path to the metadata of an HBJSON. Example is sample.meta.json for
+    sample.hbjson."""
+    return hbjson_path.with_suffix('.meta.json')
+
+
+def write_metadata(artifact: ModelArtifact, metadata: dict = None) -> Path:
+    """Write the metadata of an artifact next to its HBJSON.
+
+    The metadata keeps the hash of the HBJSON so a copy or a link of the HBJSON with
+    its metadata is never read again to hash it.
+
+    args:
+        artifact: A ModelArtifact.
+        metadata: Optional dictionary of other values to keep with the hash.
+
+    returns:
+        Path to the metadata file.
+    """
+    meta_path = metadata_path(artifact.hbjson_path)
+    temp_path = meta_path.with_name(f'{meta_path.name}.tmp')
+    temp_path.write_text(json.dumps(dict(metadata or {}, sha256=artifact.sha256)))
+    os.replace(temp_path, meta_path)
+    return meta_path
+
+
+def read_metadata(hbjson_path: Path) -> dict:
+    """Read the metadata of an HBJSON from write_model.
+
+    returns:
+        A dictionary. It is empty if the HBJSON has no metadata.
+    """
+    try:
+        return json.loads(metadata_path(hbjson_path).read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def read_artifact(hbjson_path: Path, sha256: str = None) -> ModelArtifact:
+    """Get a ModelArtifact for an HBJSON from write_model.
+
+    args:
+        hbjson_path: Path to the HBJSON.
+        sha256: Optional SHA-256 hash of the HBJSON. It is read from the metadata
+            next to the HBJSON if not provided and only calculated from the file if
+            there is no metadata.
+
+    returns:
+        A ModelArtifact.
+    """
+    if sha256 is None:
+        sha256 = read_metadata(hbjson_path).get('sha256') or hash_file(hbjson_path)
+    return ModelArtifact(hbjson_path, sha256)
+
@@ -0,0 +1,399 @@
+"""Execution backends that run point-in-time-view jobs on Pollination or locally."""
+import fnmatch
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
+
+from pollination_streamlit.interactors import Job
+
+from honeybee_radiance.lightsource.sky.strutil import string_to_sky
+from honeybee_radiance.view import View
+from honeybee_radiance.writer import model_to_rad
+from honeybee.model import Model
+
+from artifact import ModelArtifact
+from tracing import span
+from simulation import FINAL_STATUSES, SimStatus, RECIPE_DEFAULTS, create_runs_job, \
+    job_run, recreate_job, request_status, download_file, extract_members
+
+
+# URL prefix of the jobs of the local backend
+LOCAL_SCHEME = 'local://'
+LOCAL_JOBS_FOLDER = Path(os.environ.get(
+    'VIZAN_LOCAL_JOBS_FOLDER', Path(tempfile.gettempdir(), 'vizan_local_jobs')))
+# number of jobs that a backend keeps. Older finished jobs are forgotten
+MAX_JOBS = 64
+# image that the local backend returns for every view if Radiance is not available
+SAMPLE_HDR = Path(__file__).parent.joinpath('assets', 'sample.HDR')
+
+
+class Backend:
+    """Interface of an execution backend.
+
+    A backend submits jobs with the same recipe arguments as the point-in-time-view
+    recipe on Pollination, reports their status and writes the output of a run as a
+    zip file with the same content as the zipped output of Pollination.
+    """
+
+    def submit(self, arguments: List[dict], project_owner: str, project_name: str,
+               simulation_name: str, simulation_description: str,
+               recipe_name: str = 'point-in-time-view', recipe_tag: str = 'latest',
+               recipe_owner: str = 'ladybug-tools') -> str:
+        """Submit a job with one run for each dictionary of arguments.
+
+        returns:
+            URL of the job.
+        """
+        raise NotImplementedError()
+
+    def status(self, job_url: str) -> SimStatus:
+        """Get the current status of a job."""
+        raise NotImplementedError()
+
+    def download_output(self, job_url: str, output_name: str, target_file: Path,
+                        run_index: int = 0) -> Path:
+        """Write the zipped output of a run of a finished job to a file.
+
+        returns:
+            Path to the zip file.
+        """
+        raise NotImplementedError()
+
+
+class PollinationBackend(Backend):
+    """A backend that runs jobs on Pollination.
+
+    The Job objects of the most recently used jobs are kept so downloads do not fetch
+    the job again. A kept Job is never refreshed in place. A status request fetches a
+    new Job and replaces the kept one, so downloads that read the old one in other
+    threads are not affected.
+
+    args:
+        api_key: Pollination API key.
+        max_jobs: Maximum number of Job objects to keep.
+    """
+
+    def __init__(self, api_key: str, max_jobs: int = MAX_JOBS) -> None:
+        self.api_key = api_key
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, Job] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _job(self, job_url: str) -> Job:
+        with self._lock:
+            job = self._jobs.get(job_url)
+            if job is not None:
+                self._jobs.move_to_end(job_url)
+                return job
+        return self._keep(job_url, recreate_job(job_url, self.api_key))
+
+    def _keep(self, job_url: str, job: Job) -> Job:
+        with self._lock:
+            self._jobs[job_url] = job
+            self._jobs.move_to_end(job_url)
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        return job
+
+    def submit(self, arguments: List[dict], project_owner: str, project_name: str,
+               simulation_name: str, simulation_description: str,
+               recipe_name: str = 'point-in-time-view', recipe_tag: str = 'latest',
+               recipe_owner: str = 'ladybug-tools') -> str:
+        new_job = create_runs_job(arguments, project_owner, project_name,
+                                  simulation_name, simulation_description, recipe_name,
+                                  recipe_tag, recipe_owner, self.api_key)
+        job = new_job.create()
+        return f'https://app.pollination.cloud/{job.owner}/projects/{job.project}' \
+            f'/studies/{job.id}'
+
+    def status(self, job_url: str) -> SimStatus:
+        job = recreate_job(job_url, self.api_key)
+        job.refresh()
+        self._keep(job_url, job)
+        return request_status(job)
+
+    def download_output(self, job_url: str, output_name: str, target_file: Path,
+                        run_index: int = 0) -> Path:
+        run = job_run(self._job(job_url), run_index)
+        client = run.run_api.client
+        signed_url = client.get(
+            path=f'/projects/{run.owner}/{run.project}/runs/{run.id}/outputs/{output_name}'
+        )
+        return download_file(client.download_session, signed_url, target_file)
+
+
+@dataclass
+class _LocalJob:
+    arguments: List[dict]
+    folder: Path
+    status: SimStatus = SimStatus.INCOMPLETE
+    error: Optional[str] = None
+    outputs: Dict[int, Path] = field(default_factory=dict)
+
+
+def radiance_available() -> bool:
+    """Check if the Radiance commands for local rendering are on the PATH."""
+    return all(shutil.which(command) for command in ('oconv', 'rpict'))
+
+
+def _model_path(model: Union[Path, ModelArtifact]) -> Path:
+    if isinstance(model, ModelArtifact):
+        return model.hbjson_path
+    return Path(model)
+
+
+def render_view(model: Model, view: View, sky: str, hdr_path: Path,
+                resolution: int, radiance_parameters: str) -> Path:
+    """Render a 180 degree fisheye luminance image with Radiance.
+
+    args:
+        model: A Honeybee model.
+        view: A Honeybee Radiance view.
+        sky: A sky string in the format of the recipe.
+        hdr_path: Path to the HDR image.
+        resolution: Resolution of the image in pixels.
+        radiance_parameters: Radiance parameters for rpict.
+
+    returns:
+        Path to the HDR image.
+    """
+    with tempfile.TemporaryDirectory() as temp_folder:
+        model_str, modifier_str = model_to_rad(model, minimal=True)
+        scene = Path(temp_folder, 'scene.rad')
+        scene.write_text('\n'.join(
+            (string_to_sky(sky).to_radiance(), modifier_str, model_str)))
+        octree = Path(temp_folder, 'scene.oct')
+        with open(octree, 'wb') as f:
+            subprocess.run(['oconv', scene.as_posix()], stdout=f, check=True)
+
+        fisheye = view.duplicate()
+        fisheye.type = 'h'
+        fisheye.h_size = 180
+        fisheye.v_size = 180
+        command = ['rpict'] + fisheye.to_radiance().split() + \
+            ['-x', str(resolution), '-y', str(resolution)] + \
+            radiance_parameters.split() + [octree.as_posix()]
+        with open(hdr_path, 'wb') as f:
+            subprocess.run(command, stdout=f, check=True)
+    return hdr_path
+
+
+class LocalBackend(Backend):
+    """A backend that runs jobs on a local worker pool.
+
+    Runs render each view with Radiance if it is available. Otherwise they replay
+    a copy of assets/sample.HDR for each view after an optional delay. Either way the
+    output of a run is a zip file of HDR images named after the views, which is the
+    same as the results output of the point-in-time-view recipe.
+
+    args:
+        max_workers: Maximum number of runs at the same time.
+        delay: Seconds that each replayed run takes.
+        render: Set to False to replay the sample image even if Radiance is
+            available.
+        folder: Path to the folder where the outputs of the jobs are written.
+        max_jobs: Maximum number of jobs to keep. The least recently used finished
+            jobs and their outputs are removed when a new job is submitted.
+    """
+
+    def __init__(self, max_workers: int = 8, delay: float = 0, render: bool = True,
+                 folder: Path = LOCAL_JOBS_FOLDER, max_jobs: int = MAX_JOBS) -> None:
+        self.delay = delay
+        self.render = render and radiance_available()
+        self.folder = Path(folder)
+        self.max_jobs = max_jobs
+        self._jobs: Dict[str, _LocalJob] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='local-backend')
+
+    def submit(self, arguments: List[dict], project_owner: str, project_name: str,
+               simulation_name: str, simulation_description: str,
+               recipe_name: str = 'point-in-time-view', recipe_tag: str = 'latest',
+               recipe_owner: str = 'ladybug-tools') -> str:
+        job_id = uuid.uuid4().hex
+        job_url = f'{LOCAL_SCHEME}{project_owner}/projects/{project_name}' \
+            f'/studies/{job_id}'
+        job = _LocalJob(
+            [dict(RECIPE_DEFAULTS, **run_arguments) for run_arguments in arguments],
+            self.folder.joinpath(job_id))
+        with self._lock:
+            self._jobs[job_url] = job
+            removed = self._evict()
+        for old_job in removed:
+            shutil.rmtree(old_job.folder, ignore_errors=True)
+        self._executor.submit(self._run_job, job)
+        return job_url
+
+    def _evict(self) -> List[_LocalJob]:
+        """Forget the least recently used finished jobs that are over the limit.
+
+        This must be called with the lock held. The folders of the jobs are removed
+        by the caller after the lock is released.
+        """
+        finished = [job_url for job_url, job in self._jobs.items()
+                    if job.status in FINAL_STATUSES]
+        removed = []
+        for job_url in finished[:max(len(self._jobs) - self.max_jobs, 0)]:
+            removed.append(self._jobs.pop(job_url))
+        return removed
+
+    def _job(self, job_url: str) -> _LocalJob:
+        with self._lock:
+            if job_url not in self._jobs:
+                raise ValueError(f'Unknown job: {job_url}')
+            self._jobs.move_to_end(job_url)
+            return self._jobs[job_url]
+
+    def status(self, job_url: str) -> SimStatus:
+        return self._job(job_url).status
+
+    def download_output(self, job_url: str, output_name: str, target_file: Path,
+                        run_index: int = 0) -> Path:
+        job = self._job(job_url)
+        if job.status != SimStatus.COMPLETE:
+            raise ValueError(f'Job is {job.status.name}: {job_url}')
+        shutil.copyfile(job.outputs[run_index], target_file)
+        return target_file
+
+    def _run_job(self, job: _LocalJob) -> None:
+        try:
+            job.folder.mkdir(parents=True, exist_ok=True)
+            for run_index, run_arguments in enumerate(job.arguments):
+                job.outputs[run_index] = self._run(job.folder, run_index, run_arguments)
+            job.status = SimStatus.COMPLETE
+        except Exception as error:
+            job.error = str(error)
+            job.status = SimStatus.FAILED
+
+    def _run(self, folder: Path, run_index: int, run_arguments: dict) -> Path:
+        model_path = _model_path(run_arguments['model'])
+        model_data = json.loads(model_path.read_text())
+        views = model_data['properties']['radiance'].get('views') or []
+        view_filter = run_arguments.get('view-filter', '*')
+        views = [view for view in views
+                 if fnmatch.fnmatch(view['identifier'], view_filter)]
+
+        run_folder = folder.joinpath(f'run_{run_index}')
+        run_folder.mkdir(parents=True, exist_ok=True)
+        if self.render:
+            model = Model.from_dict(model_data)
+            for view in views:
+                render_view(model, View.from_dict(view), run_arguments['sky'],
+                            run_folder.joinpath(f"{view['identifier']}.HDR"),
+                            int(run_arguments['resolution']),
+                            run_arguments['radiance-parameters'])
+        else:
+            time.sleep(self.delay)
+            for view in views:
+                shutil.copyfile(SAMPLE_HDR, run_folder.joinpath(f"{view['identifier']}.HDR"))
+
+        # HDR images are already run-length encoded and deflate holds the GIL for
+        # little gain, so images are stored to keep many concurrent runs cheap
+        zip_path = folder.joinpath(f'run_{run_index}_results.zip')
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED) as zip_file:
+            for hdr_path in sorted(run_folder.iterdir()):
+                zip_file.write(hdr_path, hdr_path.name)
+        shutil.rmtree(run_folder)
+        return zip_path
+
+
+_LOCAL_BACKEND: Optional[LocalBackend] = None
+_POLLINATION_BACKENDS: Dict[str, PollinationBackend] = {}
+_BACKENDS_LOCK = threading.Lock()
+
+
+def local_backend() -> LocalBackend:
+    """Get the process-wide local backend.
+
+    The VIZAN_LOCAL_WORKERS and VIZAN_LOCAL_DELAY environment variables set the
+    number of workers and the seconds that each replayed run takes.
+    VIZAN_LOCAL_JOBS sets the number of jobs to keep.
+    """
+    global _LOCAL_BACKEND
+    with _BACKENDS_LOCK:
+        if _LOCAL_BACKEND is None:
+            _LOCAL_BACKEND = LocalBackend(
+                max_workers=int(os.environ.get('VIZAN_LOCAL_WORKERS', 8)),
+                delay=float(os.environ.get('VIZAN_LOCAL_DELAY', 0)),
+                max_jobs=int(os.environ.get('VIZAN_LOCAL_JOBS', MAX_JOBS)))
+        return _LOCAL_BACKEND
+
+
+def pollination_backend(api_key: str) -> PollinationBackend:
+    """Get the process-wide Pollination backend for an API key."""
+    with _BACKENDS_LOCK:
+        if api_key not in _POLLINATION_BACKENDS:
+            _POLLINATION_BACKENDS[api_key] = PollinationBackend(api_key)
+        return _POLLINATION_BACKENDS[api_key]
+
+
+def use_local_backend() -> bool:
+    """Check if new jobs should run on the local backend.
+
+    Set the VIZAN_BACKEND environment variable to local to run jobs offline.
+    """
+    return os.environ.get('VIZAN_BACKEND', 'pollination').lower() == 'local'
+
+
+def get_backend(api_key: str, job_url: str = None) -> Backend:
+    """Get the backend for a job URL or for new jobs if no URL is provided.
+
+    args:
+        api_key: Pollination API key. Not used by the local backend.
+        job_url: Optional URL of an existing job.
+
+    returns:
+        A Backend.
+    """
+    if job_url is not None:
+        local = job_url.startswith(LOCAL_SCHEME)
+    else:
+        local = use_local_backend()
+    return local_backend() if local else pollination_backend(api_key)
+
+
+def stream_backend_output(backend: Backend, job_url: str, target_folder: Path,
+                          folder_name: str, output_name: str,
+                          run_index: int = 0) -> Iterator[Path]:
+    """Download output of a finished job from a backend one file at a time.
+
+    This is the same as simulation.stream_output for any backend.
+
+    args:
+        backend: The backend that runs the job.
+        job_url: URL of the job.
+        target_folder: Path to the folder where the output will be downloaded.
+        folder_name: Name of the sub folder that will be created inside the target
+            folder.
+        output_name: Name of the output to download.
+        run_index: Index of the arguments of the run in the submitted job. Defaults to
+            the first run.
+
+    returns:
+        An iterator of the paths to the output files as soon as each one is extracted.
+    """
+    job_id = job_url.rstrip('/').split('/')[-1]
+    zip_path = target_folder.joinpath(f'{folder_name}_{job_id}_{run_index}.zip')
+    with span('download', output=output_name, backend=type(backend).__name__) \
+            as download:
+        if zip_path.exists():
+            download.set(cache='hit')
+        else:
+            download.set(cache='miss')
+            backend.download_output(job_url, output_name, zip_path, run_index)
+        download.set(bytes_out=zip_path)
+
+    yield from extract_members(zip_path, target_folder.joinpath(folder_name))
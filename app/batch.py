@@ -0,0 +1,304 @@
+"""Run the whole pipeline for many Rhino files without Streamlit.
+
+Models are translated and their images are post-processed on a bounded process pool
+while submissions, polling and downloads of the other models overlap on threads.
+
+The manifest is a JSON file. Paths are relative to the manifest and each model can
+override any of the defaults.
+
+    {
+        "project_owner": "aec-tech-hack-2022",
+        "project_name": "viz",
+        "defaults": {
+            "epw": "weather.epw",
+            "glass_layers": ["Glass"],
+            "ignore_layers": ["People"],
+            "transmittance": 0.6,
+            "north_angle": 0
+        },
+        "models": [
+            {"name": "option_a", "rhino_file": "option_a.3dm"},
+            {"name": "option_b", "rhino_file": "option_b.3dm", "epw": "other.epw"}
+        ]
+    }
+
+usage:
+    python batch.py manifest.json --output results.csv --folder batch_runs
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from pathlib import Path
+from typing import Callable, List
+
+from artifact import ModelArtifact
+from backend import Backend, get_backend, stream_backend_output
+from cores import available_cores
+from helper import rhino_3dm_to_artifact, write_config
+from model_index import build_model_index
+from process_hdr import post_process_view
+from simulation import FINAL_STATUSES, SimStatus
+from sky import brightest_hours, load_epw, sky_strings
+from tracing import set_session, span, submit_traced, traced_result
+
+
+# columns of the consolidated results
+RESULT_COLUMNS = ['model', 'view', 'dgp', 'category', 'sky', 'job_url', 'error']
+
+
+@dataclass
+class BatchModel:
+    """A model of the manifest with its settings.
+
+    args:
+        name: Unique name of the model. It is used as the name of its folder.
+        rhino_file: Path to the Rhino file.
+        epw: Path to the EPW file.
+        glass_layers: Names of the layers that are glass.
+        ignore_layers: Names of the layers that are not translated.
+        transmittance: Transmittance of the glass.
+        north_angle: Counter clockwise rotation of the North vector in degrees.
+    """
+    name: str
+    rhino_file: Path
+    epw: Path
+    glass_layers: List[str] = field(default_factory=list)
+    ignore_layers: List[str] = field(default_factory=list)
+    transmittance: float = 0.6
+    north_angle: float = 0
+
+
+@dataclass
+class Manifest:
+    """Models of a batch and the Pollination project to run them in.
+
+    args:
+        models: A list of BatchModel objects.
+        project_owner: Owner of the Pollination project.
+        project_name: Name of the Pollination project.
+    """
+    models: List[BatchModel]
+    project_owner: str = 'local'
+    project_name: str = 'batch'
+
+
+def read_manifest(manifest_file: Path) -> Manifest:
+    """Read a manifest JSON file.
+
+    args:
+        manifest_file: Path to the manifest. See the docstring of this module for
+            the format.
+
+    returns:
+        A Manifest.
+    """
+    data = json.loads(Path(manifest_file).read_text())
+    folder = Path(manifest_file).parent
+    defaults = data.get('defaults', {})
+
+    models = []
+    for model in data['models']:
+        settings = dict(defaults, **model)
+        if 'epw' not in settings:
+            raise ValueError(f'Model {settings.get("name")} does not have an EPW.')
+        settings['rhino_file'] = folder.joinpath(settings['rhino_file'])
+        settings['epw'] = folder.joinpath(settings['epw'])
+        settings.setdefault('name', settings['rhino_file'].stem)
+        models.append(BatchModel(**settings))
+
+    names = [model.name for model in models]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f'Model names must be unique. Duplicates: {duplicates}')
+
+    return Manifest(models, data.get('project_owner', 'local'),
+                    data.get('project_name', 'batch'))
+
+
+def translate_model(model: BatchModel, target_folder: Path) -> ModelArtifact:
+    """Write the layer config of a model and translate it to HBJSON.
+
+    This function runs in a worker process.
+    """
+    target_folder.mkdir(parents=True, exist_ok=True)
+    config, config_path = write_config(model.glass_layers, model.ignore_layers,
+                                       model.transmittance, target_folder)
+    model_index = build_model_index(model.rhino_file)
+    return rhino_3dm_to_artifact(
+        model.rhino_file, config, config_path, model_index.views, target_folder,
+        model_index.rhino_hash, model_index.translated_layers(config),
+        object_layers=model_index.object_layers)
+
+
+def model_sky(model: BatchModel) -> str:
+    """Get the sky of the brightest hour of the EPW of a model."""
+    epw = load_epw(model.epw)
+    return sky_strings(epw, brightest_hours(epw), model.north_angle)[0]
+
+
+async def wait_for_job(backend: Backend, job_url: str, io_pool: Executor,
+                       min_interval: float = 2, max_interval: float = 60,
+                       backoff: float = 1.5) -> SimStatus:
+    """Poll a job with exponential backoff until it finishes.
+
+    returns:
+        The final status of the job.
+    """
+    loop = asyncio.get_running_loop()
+    interval = min_interval
+    while True:
+        status = await loop.run_in_executor(io_pool, backend.status, job_url)
+        if status in FINAL_STATUSES:
+            return status
+        await asyncio.sleep(interval)
+        interval = min(interval * backoff, max_interval)
+
+
+async def run_traced(executor: Executor, func: Callable, *args):
+    """Run a function on a process pool without blocking the event loop.
+
+    The spans that the function records in the worker are exported in this process
+    under the current span. See tracing.submit_traced.
+    """
+    future = submit_traced(executor, func, *args)
+    await asyncio.wrap_future(future)
+    return traced_result(future)
+
+
+async def run_model(model: BatchModel, manifest: Manifest, backend: Backend,
+                    folder: Path, cpu_pool: Executor, io_pool: Executor,
+                    jobs: asyncio.Semaphore, poll_interval: float) -> List[dict]:
+    """Run the whole pipeline for one model.
+
+    Errors are returned as a row with the error message so a failing model does not
+    stop the others.
+
+    returns:
+        A list of result rows with one row for each view.
+    """
+    set_session(model.name)
+    loop = asyncio.get_running_loop()
+    model_folder = folder.joinpath(model.name)
+    sky, job_url = None, None
+    try:
+        with span('batch_translate', model=model.name):
+            artifact = await run_traced(cpu_pool, translate_model, model, model_folder)
+            sky = await loop.run_in_executor(io_pool, model_sky, model)
+
+        async with jobs:
+            with span('batch_job', model=model.name):
+                job_url = await loop.run_in_executor(io_pool, partial(
+                    backend.submit, [{'model': artifact, 'sky': sky}],
+                    manifest.project_owner, manifest.project_name,
+                    f'vizan-batch-{model.name}', f'view analysis of {model.name}'))
+                status = await wait_for_job(backend, job_url, io_pool, poll_interval)
+            if status != SimStatus.COMPLETE:
+                raise RuntimeError(f'Job {job_url} finished as {status.name}')
+
+            hdr_files = await loop.run_in_executor(io_pool, lambda: [
+                file for file in stream_backend_output(
+                    backend, job_url, model_folder, 'results', 'results')
+                if file.suffix.lower() == '.hdr'])
+
+        view_results = await asyncio.gather(*[
+            run_traced(cpu_pool, post_process_view, file, model_folder)
+            for file in hdr_files], return_exceptions=True)
+    except Exception as error:
+        return [{'model': model.name, 'sky': sky, 'job_url': job_url,
+                 'error': str(error)}]
+
+    rows = []
+    for file, view_result in zip(hdr_files, view_results):
+        row = {'model': model.name, 'view': file.stem, 'sky': sky, 'job_url': job_url}
+        if isinstance(view_result, Exception):
+            row['error'] = str(view_result)
+        else:
+            row.update(dgp=view_result.dgp, category=view_result.category)
+        rows.append(row)
+    return rows
+
+
+async def run_batch(manifest: Manifest, folder: Path, api_key: str = None,
+                    max_workers: int = None, max_jobs: int = 16,
+                    poll_interval: float = 2) -> List[dict]:
+    """Run the pipeline for every model of a manifest.
+
+    args:
+        manifest: A Manifest.
+        folder: Path to the folder where each model gets a sub folder.
+        api_key: Pollination API key. Not needed for the local backend.
+        max_workers: Number of processes to translate models and evaluate images.
+            Defaults to the number of available cores.
+        max_jobs: Maximum number of jobs that are submitted and not yet downloaded.
+        poll_interval: Seconds between the first polls of a job.
+
+    returns:
+        A list of result rows in the order of the models in the manifest.
+    """
+    backend = get_backend(api_key)
+    jobs = asyncio.Semaphore(max_jobs)
+    with ProcessPoolExecutor(max_workers=max_workers or available_cores()) \
+            as cpu_pool, ThreadPoolExecutor(max_workers=max_jobs) as io_pool:
+        results = await asyncio.gather(*[
+            run_model(model, manifest, backend, folder, cpu_pool, io_pool, jobs,
+                      poll_interval)
+            for model in manifest.models])
+    return [row for rows in results for row in rows]
+
+
+def write_results(rows: List[dict], output_file: Path) -> Path:
+    """Write result rows as a CSV file or as a Parquet file if the suffix is .parquet.
+
+    Writing Parquet files needs pandas and pyarrow.
+    """
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    if output_file.suffix.lower() == '.parquet':
+        try:
+            import pandas as pd
+        except ImportError:
+            raise ImportError('Writing Parquet files needs pandas and pyarrow.')
+        pd.DataFrame(rows, columns=RESULT_COLUMNS).to_parquet(output_file, index=False)
+        return output_file
+
+    with open(output_file, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return output_file
+
+
+def main(args: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('manifest', type=Path, help='Path to the manifest JSON file.')
+    parser.add_argument('--output', type=Path, default=Path('results.csv'),
+                        help='Path to the results. Use .parquet for a Parquet file.')
+    parser.add_argument('--folder', type=Path, default=Path('batch_runs'),
+                        help='Folder where the files of each model are written.')
+    parser.add_argument('--api-key', default=os.environ.get('POLLINATION_API_KEY'),
+                        help='Pollination API key. Defaults to POLLINATION_API_KEY.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes. Defaults to the available cores.')
+    parser.add_argument('--max-jobs', type=int, default=16,
+                        help='Maximum number of jobs in flight.')
+    options = parser.parse_args(args)
+
+    manifest = read_manifest(options.manifest)
+    rows = asyncio.run(run_batch(manifest, options.folder, options.api_key,
+                                 options.workers, options.max_jobs))
+    write_results(rows, options.output)
+
+    failed = [row for row in rows if row.get('error')]
+    print(f'{len(rows) - len(failed)} views succeeded and {len(failed)} failed. '
+          f'Results are written to {options.output}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
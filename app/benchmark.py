@@ -0,0 +1,524 @@
+"""Benchmark the stages of the app headlessly on generated fixtures.
+
+Each stage runs in a fresh process so caches are cold and the peak memory of one stage
+does not leak into the next. Results are compared to a stored baseline and the run
+fails if a stage is slower or uses more memory than the thresholds allow, or if there
+is no baseline for it. Save a baseline first with --save-baseline.
+
+usage:
+    python benchmark.py --sizes 1000 10000 100000 1000000 --save-baseline
+    python benchmark.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import inspect
+import json
+import math
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+import zipfile
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+
+ASSETS_FOLDER = Path(__file__).parent.joinpath('assets')
+SAMPLE_HDR = ASSETS_FOLDER.joinpath('sample.HDR')
+BASELINE_FILE = Path(__file__).parent.joinpath('benchmark_baseline.json')
+# number of faces of the generated Rhino files and models
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+# a stage regresses if it is this much slower or larger than the baseline
+WALL_THRESHOLD = 0.25
+RSS_THRESHOLD = 0.25
+# differences smaller than these are noise and never fail a run
+WALL_SLACK = 0.05
+RSS_SLACK = 32
+# layers and views of the generated Rhino files
+FIXTURE_LAYERS = 10
+FIXTURE_VIEWS = 4
+# views in the generated results output
+FIXTURE_RESULTS = 16
+
+
+@dataclass
+class Fixtures:
+    """Generated input files of the benchmark.
+
+    Files are written once and reused by later runs.
+
+    args:
+        folder: Path to the folder of the fixtures.
+    """
+    folder: Path
+
+    def rhino_file(self, faces: int) -> Path:
+        """Get a Rhino file with a planar mesh grid of about this many faces.
+
+        The faces are split between FIXTURE_LAYERS layers with a mesh on each layer
+        and the file has FIXTURE_VIEWS named views.
+        """
+        rhino_file = self.folder.joinpath(f'grid_{faces}.3dm')
+        if rhino_file.exists():
+            return rhino_file
+
+        import rhino3dm
+
+        rh = rhino3dm.File3dm()
+        rh.Settings.ModelUnitSystem = rhino3dm.UnitSystem.Meters
+        side = max(int(math.sqrt(faces / FIXTURE_LAYERS)), 1)
+        for layer in range(FIXTURE_LAYERS):
+            layer_index = rh.Layers.AddLayer(f'layer_{layer}', (128, 128, 128, 255))
+            mesh = rhino3dm.Mesh()
+            for i in range(side + 1):
+                for j in range(side + 1):
+                    mesh.Vertices.Add(i * 0.1, j * 0.1, layer * 3.0)
+            for i in range(side):
+                for j in range(side):
+                    a = i * (side + 1) + j
+                    mesh.Faces.AddFace(a, a + side + 1, a + side + 2, a + 1)
+            attributes = rhino3dm.ObjectAttributes()
+            attributes.LayerIndex = layer_index
+            rh.Objects.AddMesh(mesh, attributes)
+
+        center = side * 0.05
+        for view in range(FIXTURE_VIEWS):
+            angle = 2 * math.pi * view / FIXTURE_VIEWS
+            view_info = rhino3dm.ViewInfo()
+            view_info.Name = f'view_{view}'
+            viewport = view_info.Viewport
+            viewport.SetCameraLocation(rhino3dm.Point3d(center, center, 1.5))
+            viewport.SetCameraDirection(
+                rhino3dm.Vector3d(math.cos(angle), math.sin(angle), 0))
+            viewport.SetCameraUp(rhino3dm.Vector3d(0, 0, 1))
+            view_info.Viewport = viewport
+            rh.NamedViews.Add(view_info)
+
+        temp_file = rhino_file.with_name(f'{rhino_file.name}.tmp')
+        if not rh.Write(temp_file.as_posix(), 7):
+            raise ValueError(f'Failed to write Rhino file: {rhino_file}')
+        temp_file.replace(rhino_file)
+        return rhino_file
+
+    def hbjson_file(self, faces: int) -> Path:
+        """Get an HBJSON with a planar grid of about this many orphaned faces."""
+        hbjson_file = self.folder.joinpath(f'grid_{faces}.hbjson')
+        if hbjson_file.exists():
+            return hbjson_file
+
+        from ladybug_geometry.geometry3d.pointvector import Point3D
+        from ladybug_geometry.geometry3d.face import Face3D
+        from honeybee.face import Face
+        from honeybee.model import Model
+
+        side = max(int(math.sqrt(faces)), 1)
+        hb_faces = []
+        for i in range(side):
+            for j in range(side):
+                x, y = i * 0.1, j * 0.1
+                geometry = Face3D((Point3D(x, y, 0), Point3D(x + 0.1, y, 0),
+                                   Point3D(x + 0.1, y + 0.1, 0), Point3D(x, y + 0.1, 0)))
+                hb_faces.append(Face(f'face_{i}_{j}', geometry))
+        model = Model(f'grid_{faces}', orphaned_faces=hb_faces, units='Meters')
+
+        temp_file = hbjson_file.with_name(f'{hbjson_file.name}.tmp')
+        temp_file.write_text(json.dumps(model.to_dict()))
+        temp_file.replace(hbjson_file)
+        return hbjson_file
+
+    def epw_file(self) -> Path:
+        """Get an EPW of a synthetic clear-sky year."""
+        epw_file = self.folder.joinpath('synthetic.epw')
+        if epw_file.exists():
+            return epw_file
+
+        from ladybug.epw import EPW
+        from ladybug.location import Location
+        from ladybug.sunpath import Sunpath
+
+        location = Location('Synthetic', latitude=42.4, longitude=-71.1, time_zone=-5,
+                            elevation=10)
+        epw = EPW.from_missing_values()
+        epw.location = location
+        sunpath = Sunpath.from_location(location)
+        sines = [max(math.sin(math.radians(
+            sunpath.calculate_sun_from_hoy(hoy + 0.5).altitude)), 0)
+            for hoy in range(8760)]
+        direct = [900 * sine ** 0.3 if sine > 0 else 0 for sine in sines]
+        diffuse = [120 * sine for sine in sines]
+        epw.direct_normal_radiation.values = direct
+        epw.diffuse_horizontal_radiation.values = diffuse
+        epw.global_horizontal_radiation.values = [
+            dni * sine + dhi for dni, sine, dhi in zip(direct, sines, diffuse)]
+        epw.direct_normal_illuminance.values = [dni * 95 for dni in direct]
+        epw.diffuse_horizontal_illuminance.values = [dhi * 115 for dhi in diffuse]
+        epw.global_horizontal_illuminance.values = [
+            dni * 95 * sine + dhi * 115
+            for dni, sine, dhi in zip(direct, sines, diffuse)]
+        epw.write(epw_file.as_posix())
+        return epw_file
+
+    def results_zip(self) -> Path:
+        """Get a results output with FIXTURE_RESULTS copies of the sample image."""
+        zip_path = self.folder.joinpath('results.zip')
+        if zip_path.exists():
+            return zip_path
+
+        temp_file = zip_path.with_name(f'{zip_path.name}.tmp')
+        with zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for view in range(FIXTURE_RESULTS):
+                zip_file.write(SAMPLE_HDR, f'view_{view}.HDR')
+        temp_file.replace(zip_path)
+        return zip_path
+
+
+# a stage gets the fixtures, the number of faces and an empty folder. It does its
+# setup and returns the function to time, the number of items that it processes and
+# the unit of the items
+Stage = Callable[[Fixtures, int, Path], Tuple[Callable[[], object], float, str]]
+
+
+def _uncached(func: Callable) -> Callable:
+    """Get the function behind the Streamlit cache and the tracing wrapper so every
+    call does the work."""
+    return inspect.unwrap(func)
+
+
+def _cold_caches(folder: Path) -> None:
+    """Point the on-disk caches of the app to an empty folder."""
+    import helper
+    helper.HBJSON_CACHE.folder = folder.joinpath('cache')
+    helper.METADATA_CACHE.folder = folder.joinpath('cache')
+    if 'viewer' in sys.modules:
+        viewer = sys.modules['viewer']
+        viewer.VTKJS_CACHE.folder = folder.joinpath('cache')
+        viewer.CHUNK_CACHE.folder = folder.joinpath('cache')
+
+
+def stage_import_app(fixtures: Fixtures, faces: int, folder: Path):
+    import importlib
+
+    def run():
+        # the worker is a fresh process so this is the cold start of the first page
+        return importlib.import_module('app')
+
+    return run, 1, 'imports'
+
+
+def stage_model_index(fixtures: Fixtures, faces: int, folder: Path):
+    from model_index import build_model_index
+
+    rhino_file = fixtures.rhino_file(faces)
+
+    def run():
+        # the app reads the layers and the views of the Rhino file in one pass
+        return build_model_index(rhino_file)
+
+    return run, faces, 'faces'
+
+
+def stage_write_config(fixtures: Fixtures, faces: int, folder: Path):
+    from helper import write_config
+
+    def run():
+        return write_config(['layer_0'], ['layer_1'], 0.6, folder)
+
+    return run, 1, 'configs'
+
+
+def stage_translate(fixtures: Fixtures, faces: int, folder: Path):
+    from helper import rhino_3dm_to_artifact, write_config
+    from model_index import build_model_index
+    from cores import available_cores
+    from translation import partition_layers
+
+    _cold_caches(folder)
+    rhino_file = fixtures.rhino_file(faces)
+    config, config_path = write_config([], [], 0.6, folder)
+    model_index = build_model_index(rhino_file)
+    views = model_index.views
+    layer_indices = model_index.translated_layers(config)
+    partitions = partition_layers(
+        layer_indices,
+        [model_index.layers[index].object_count for index in layer_indices],
+        available_cores())
+
+    def run():
+        return rhino_3dm_to_artifact(rhino_file, config, config_path, views, folder,
+                                     model_index.rhino_hash, layer_indices, partitions,
+                                     object_layers=model_index.object_layers)
+
+    return run, faces, 'faces'
+
+
+def stage_write_vtkjs(fixtures: Fixtures, faces: int, folder: Path):
+    from viewer import LOD_TRIANGLE_BUDGET, write_vtkjs
+
+    _cold_caches(folder)
+    hbjson_file = fixtures.hbjson_file(faces)
+
+    def run():
+        return write_vtkjs(hbjson_file, folder, triangle_budget=LOD_TRIANGLE_BUDGET)
+
+    return run, faces, 'faces'
+
+
+def stage_get_sky(fixtures: Fixtures, faces: int, folder: Path):
+    from cache import hash_file
+    from sky import brightest_hours, load_epw, sky_strings
+
+    epw_file = fixtures.epw_file()
+    epw_hash = hash_file(epw_file)
+
+    def run():
+        # the same as the epw and sky nodes of the pipeline of the app
+        epw = load_epw(epw_file, epw_hash)
+        return sky_strings(epw, brightest_hours(epw))[0]
+
+    return run, 8760, 'hours'
+
+
+def stage_extract_output(fixtures: Fixtures, faces: int, folder: Path):
+    from simulation import extract_members
+
+    zip_path = fixtures.results_zip()
+    with zipfile.ZipFile(zip_path) as zip_file:
+        size = sum(info.file_size for info in zip_file.infolist())
+
+    def run():
+        return list(extract_members(zip_path, folder.joinpath('results')))
+
+    return run, size / 1024 ** 2, 'MB'
+
+
+def _hdr_pixels() -> float:
+    from rgbe import read_hdr
+
+    data, _ = read_hdr(SAMPLE_HDR)
+    return data.shape[0] * data.shape[1] / 1e6
+
+
+def stage_eval_hdr(fixtures: Fixtures, faces: int, folder: Path):
+    from process_hdr import eval_hdr
+
+    evaluate = _uncached(eval_hdr)
+
+    def run():
+        return evaluate(SAMPLE_HDR, folder)
+
+    # the glare engine is sized in images per second per core
+    return run, 1, 'images'
+
+
+def stage_hdr_to_gif(fixtures: Fixtures, faces: int, folder: Path):
+    from process_hdr import hdr_to_gif
+
+    to_gif = _uncached(hdr_to_gif)
+
+    def run():
+        return to_gif(SAMPLE_HDR, folder)
+
+    return run, _hdr_pixels(), 'megapixels'
+
+
+# stages in the order of the app with the Fixtures method of their input. Stages that
+# depend on the size of the model run once for each size
+STAGES: Dict[str, Tuple[Stage, bool, str]] = {
+    'import_app': (stage_import_app, False, None),
+    'model_index': (stage_model_index, True, 'rhino_file'),
+    'write_config': (stage_write_config, False, None),
+    'translate': (stage_translate, True, 'rhino_file'),
+    'write_vtkjs': (stage_write_vtkjs, True, 'hbjson_file'),
+    'get_sky': (stage_get_sky, False, 'epw_file'),
+    'extract_output': (stage_extract_output, False, 'results_zip'),
+    'eval_hdr': (stage_eval_hdr, False, None),
+    'hdr_to_gif': (stage_hdr_to_gif, False, None),
+}
+
+
+@dataclass
+class Measurement:
+    """Measurement of a stage.
+
+    args:
+        stage: Name of the stage.
+        size: Number of faces of the fixture or 0 if the stage does not depend on it.
+        wall: Wall time in seconds.
+        peak_rss: Peak resident memory of the process in MB.
+        throughput: Items per second.
+        unit: Unit of the items.
+    """
+    stage: str
+    size: int
+    wall: float
+    peak_rss: float
+    throughput: float
+    unit: str
+
+    @property
+    def key(self) -> str:
+        return f'{self.stage}[{self.size}]' if self.size else self.stage
+
+
+def _peak_rss() -> float:
+    """Peak resident memory of this process in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes and Linux reports kilobytes
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def _measure(stage: str, fixtures: Fixtures, size: int) -> Measurement:
+    """Run a stage once. This function runs in a fresh worker process."""
+    func, has_size, _ = STAGES[stage]
+    with tempfile.TemporaryDirectory(prefix='vizan_benchmark_') as temp_folder:
+        run, items, unit = func(fixtures, size, Path(temp_folder))
+        start = time.perf_counter()
+        run()
+        wall = time.perf_counter() - start
+        peak_rss = _peak_rss()
+    return Measurement(stage, size if has_size else 0, wall, peak_rss,
+                       items / wall if wall else math.inf, unit)
+
+
+def run_stage(stage: str, fixtures: Fixtures, size: int,
+              repeat: int = 3) -> Measurement:
+    """Run a stage several times in fresh processes.
+
+    args:
+        stage: Name of the stage in STAGES.
+        fixtures: Fixtures of the benchmark.
+        size: Number of faces of the fixture.
+        repeat: Number of runs. The fastest wall time and the largest peak memory
+            are kept.
+
+    returns:
+        A Measurement.
+    """
+    context = multiprocessing.get_context('spawn')
+    measurements = []
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            measurements.append(executor.submit(_measure, stage, fixtures, size).result())
+    fastest = min(measurements, key=lambda measurement: measurement.wall)
+    fastest.peak_rss = max(measurement.peak_rss for measurement in measurements)
+    return fastest
+
+
+def compare(measurements: List[Measurement], baseline: Dict[str, dict],
+            wall_threshold: float = WALL_THRESHOLD,
+            rss_threshold: float = RSS_THRESHOLD) -> List[str]:
+    """Compare measurements to a baseline.
+
+    args:
+        measurements: A list of measurements.
+        baseline: A dictionary of measurement key to a measurement as a dictionary.
+        wall_threshold: Allowed relative increase of the wall time.
+        rss_threshold: Allowed relative increase of the peak memory.
+
+    returns:
+        A list of regressions as messages. The list is empty if there is none. A
+        measurement without a baseline is a regression too.
+    """
+    regressions = []
+    for measurement in measurements:
+        reference = baseline.get(measurement.key)
+        if not reference:
+            regressions.append(f'{measurement.key}: there is no baseline. Run with '
+                               '--save-baseline to add it')
+            continue
+        wall_limit = max(reference['wall'] * (1 + wall_threshold),
+                         reference['wall'] + WALL_SLACK)
+        if measurement.wall > wall_limit:
+            regressions.append(
+                f'{measurement.key}: {measurement.wall:.3f} s is slower than the '
+                f'baseline of {reference["wall"]:.3f} s')
+        rss_limit = max(reference['peak_rss'] * (1 + rss_threshold),
+                        reference['peak_rss'] + RSS_SLACK)
+        if measurement.peak_rss > rss_limit:
+            regressions.append(
+                f'{measurement.key}: {measurement.peak_rss:.0f} MB is more than the '
+                f'baseline of {reference["peak_rss"]:.0f} MB')
+    return regressions
+
+
+def report(measurements: List[Measurement], baseline: Dict[str, dict]) -> str:
+    """Format measurements as a table with the change from the baseline."""
+    lines = [f'{"stage":<28}{"wall s":>10}{"peak MB":>10}{"throughput":>24}'
+             f'{"vs baseline":>14}']
+    for measurement in measurements:
+        reference = baseline.get(measurement.key)
+        change = f'{measurement.wall / reference["wall"] - 1:+.0%}' \
+            if reference and reference['wall'] else ''
+        throughput = f'{measurement.throughput:,.1f} {measurement.unit}/s'
+        lines.append(f'{measurement.key:<28}{measurement.wall:>10.3f}'
+                     f'{measurement.peak_rss:>10.0f}{throughput:>24}{change:>14}')
+    return '\n'.join(lines)
+
+
+def main(args: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Number of faces of the generated models.')
+    parser.add_argument('--stages', nargs='+', choices=list(STAGES),
+                        default=list(STAGES), help='Stages to run.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of runs of each stage.')
+    parser.add_argument('--fixtures', type=Path,
+                        default=Path(tempfile.gettempdir(), 'vizan_benchmark_fixtures'),
+                        help='Folder of the generated fixtures.')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_FILE,
+                        help='Path to the baseline JSON file.')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Write the measurements to the baseline file.')
+    parser.add_argument('--wall-threshold', type=float, default=WALL_THRESHOLD)
+    parser.add_argument('--rss-threshold', type=float, default=RSS_THRESHOLD)
+    parser.add_argument('--output', type=Path, help='Write measurements as JSON.')
+    options = parser.parse_args(args)
+
+    if not options.save_baseline and not options.baseline.exists():
+        print(f'There is no baseline at {options.baseline}. Run with --save-baseline '
+              'first.')
+        return 1
+
+    options.fixtures.mkdir(parents=True, exist_ok=True)
+    fixtures = Fixtures(options.fixtures)
+
+    # generate the fixtures up front so it is not measured as part of a stage
+    runs = []
+    for stage in options.stages:
+        _, has_size, fixture = STAGES[stage]
+        for size in options.sizes if has_size else [0]:
+            if fixture:
+                getattr(fixtures, fixture)(*([size] if has_size else []))
+            runs.append((stage, size))
+
+    measurements = [run_stage(stage, fixtures, size, options.repeat)
+                    for stage, size in runs]
+
+    baseline = {}
+    if options.baseline.exists():
+        baseline = json.loads(options.baseline.read_text())
+
+    print(report(measurements, baseline))
+    results = {measurement.key: asdict(measurement) for measurement in measurements}
+    if options.output:
+        options.output.write_text(json.dumps(results, indent=2))
+
+    if options.save_baseline:
+        baseline.update(results)
+        options.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True))
+        print(f'Baseline saved to {options.baseline}')
+        return 0
+
+    regressions = compare(measurements, baseline, options.wall_threshold,
+                          options.rss_threshold)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
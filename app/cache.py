@@ -0,0 +1,181 @@
+"""Content-addressed on-disk cache that is shared between sessions."""
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+
+CACHE_FOLDER = Path(os.environ.get(
+    'VIZAN_CACHE_FOLDER', Path(tempfile.gettempdir(), 'vizan_cache')))
+CACHE_QUOTA = int(os.environ.get('VIZAN_CACHE_QUOTA', 10 * 1024 ** 3))
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: Union[str, Path], chunk_size: int = CHUNK_SIZE) -> str:
+    """Get the SHA-256 hash of a file without loading it in memory.
+
+    args:
+        file_path: Path to the file.
+        chunk_size: Number of bytes to read at a time.
+
+    returns:
+        Hex digest of the file content.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def hash_parts(parts: Iterable[Union[str, bytes]]) -> str:
+    """Get a SHA-256 hash of several parts as a cache key.
+
+    Every part is prefixed with its length so different splits of the same bytes
+    produce different keys.
+    """
+    sha = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        sha.update(len(part).to_bytes(8, 'little'))
+        sha.update(part)
+    return sha.hexdigest()
+
+
+def link_file(source: Union[str, Path], target: Path) -> Path:
+    """Hard link a file to a new path or copy it if a link is not possible.
+
+    The target is replaced atomically. Linked files share their content so they must
+    always be replaced and never be modified in place.
+
+    args:
+        source: Path to the existing file.
+        target: Path to the new file.
+
+    returns:
+        Path to the new file.
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = target.with_name(f'{target.name}.{uuid.uuid4().hex}.tmp')
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            # a different file system or a file system without hard links
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return target
+
+
+def folder_entries(folder: Path,
+                   suffix: str = '') -> List[Tuple[float, int, Path]]:
+    """Get the modified time, size and path of the entries in a cache folder.
+
+    args:
+        folder: Path to the cache folder.
+        suffix: Optional file extension of the entries. By default the entries of
+            all the caches that share the folder are returned.
+
+    returns:
+        A list of (modified time, size, path) tuples.
+    """
+    entries = []
+    if not folder.exists():
+        return entries
+    for entry in folder.glob(f'*/*{suffix}'):
+        if entry.suffix == '.tmp':
+            # an entry that is still being written
+            continue
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            # removed by another process
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry))
+    return entries
+
+
+class DiskCache:
+    """A content-addressed cache of files with a size quota and LRU eviction.
+
+    Entries are written to a temporary file and moved in place with an atomic rename
+    so several processes can share the same cache folder. The modified time of an
+    entry is updated on every hit and the least recently used entries are removed
+    when the cache grows beyond its quota.
+
+    Caches with different suffixes can share a folder. The quota is for the whole
+    folder and the least recently used entries are removed regardless of their
+    suffix, so all the caches on the default folder stay within VIZAN_CACHE_QUOTA
+    together.
+
+    args:
+        folder: Path to the cache folder.
+        quota: Maximum size of the cache folder in bytes.
+        suffix: File extension for the entries. Example is .hbjson.
+    """
+
+    def __init__(self, folder: Path = CACHE_FOLDER, quota: int = CACHE_QUOTA,
+                 suffix: str = '') -> None:
+        self.folder = Path(folder)
+        self.quota = quota
+        self.suffix = suffix
+
+    def path(self, key: str) -> Path:
+        """Path to the entry for a key."""
+        return self.folder.joinpath(key[:2], f'{key}{self.suffix}')
+
+    def get(self, key: str) -> Optional[Path]:
+        """Get the path to the entry for a key or None if it is not cached."""
+        entry = self.path(key)
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def put(self, key: str, source: Path) -> Path:
+        """Add a file to the cache and return the path to the entry.
+
+        The file is hard linked into the cache if possible instead of copied.
+        """
+        entry = link_file(source, self.path(key))
+        self.evict(keep=entry)
+        return entry
+
+    def entries(self) -> List[Tuple[float, int, Path]]:
+        """Get the modified time, size and path of all the entries."""
+        return folder_entries(self.folder, self.suffix)
+
+    def size(self) -> int:
+        """Total size of the entries in bytes."""
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep: Path = None) -> None:
+        """Remove the least recently used entries until the folder fits the quota.
+
+        The entries of the other caches in the folder are removed too.
+
+        args:
+            keep: Optional path to an entry that should not be removed.
+        """
+        entries = sorted(folder_entries(self.folder), key=lambda entry: entry[0])
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.quota:
+                break
+            if entry == keep:
+                continue
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
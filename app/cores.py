@@ -0,0 +1,13 @@
+"""CPU cores of the process without importing Streamlit.
+
+The shared task pool and the command line tools import this, so it must stay free of
+the modules that need a running Streamlit app.
+"""
+import os
+
+
+def available_cores() -> int:
+    """Get the number of cores that this process is allowed to use."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
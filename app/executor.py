@@ -0,0 +1,249 @@
+"""A process-wide pool for the CPU-heavy stages of all the sessions.
+
+Sessions submit tasks to their own queue and a free worker always takes the next task
+of the session that was served the longest time ago, so a session with many tasks does
+not hold up the others. Identical work that is already in flight in another session is
+waited for instead of repeated.
+"""
+import os
+import threading
+
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Tuple
+
+from cores import available_cores
+
+
+@dataclass
+class TaskProgress:
+    """Progress of the tasks of a session.
+
+    args:
+        done: Number of finished tasks.
+        running: Number of tasks on a worker.
+        queued: Number of tasks that wait for a worker.
+    """
+    done: int = 0
+    running: int = 0
+    queued: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.done + self.running + self.queued
+
+    @property
+    def fraction(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+
+@dataclass
+class _Task:
+    session: str
+    future: Future
+    func: Callable
+    args: tuple
+    kwargs: dict
+
+
+class TaskExecutor:
+    """Run tasks of many sessions on a shared process pool with a cap.
+
+    args:
+        max_workers: Maximum number of tasks that run at the same time. Defaults to the
+            VIZAN_MAX_TASKS environment variable or the number of available cores.
+    """
+
+    def __init__(self, max_workers: int = None) -> None:
+        self.max_workers = max_workers or \
+            int(os.environ.get('VIZAN_MAX_TASKS', 0)) or available_cores()
+        self._pool = None
+        self._queues: Dict[str, Deque[_Task]] = OrderedDict()
+        self._progress: Dict[str, TaskProgress] = {}
+        self._shared: Dict[str, Future] = {}
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def submit(self, session: str, func: Callable, *args, **kwargs) -> Future:
+        """Queue a function to run in a worker process for a session.
+
+        args:
+            session: ID of the session. Tasks of the same session run in the order
+                they are submitted.
+            func: A picklable function.
+            args: Arguments of the function.
+            kwargs: Keyword arguments of the function.
+
+        returns:
+            A Future for the result of the function.
+        """
+        task = _Task(session, Future(), func, args, kwargs)
+        with self._lock:
+            self._queues.setdefault(session, deque()).append(task)
+            self._progress.setdefault(session, TaskProgress()).queued += 1
+            started = self._dispatch()
+        self._start(started)
+        return task.future
+
+    def session(self, session: str) -> 'SessionExecutor':
+        """Get an Executor that submits to this pool for a session."""
+        return SessionExecutor(self, session)
+
+    def progress(self, session: str) -> TaskProgress:
+        """Get the progress of the tasks that a session has submitted."""
+        with self._lock:
+            progress = self._progress.get(session, TaskProgress())
+            return TaskProgress(progress.done, progress.running, progress.queued)
+
+    def reset_progress(self, session: str) -> None:
+        """Forget the finished tasks of a session so progress starts from zero."""
+        with self._lock:
+            progress = self._progress.get(session)
+            if progress:
+                progress.done = 0
+                if not progress.running and not progress.queued:
+                    del self._progress[session]
+
+    def shared(self, key: str, func: Callable, *args, **kwargs) -> Tuple[object, bool]:
+        """Call a function in this thread unless the same key is already in flight.
+
+        If another thread is running the function for the same key, this waits for
+        it and gets the same result. The function usually writes its result to a
+        shared cache that the other threads read afterwards.
+
+        args:
+            key: Content hash of the work.
+            func: Function to call.
+            args: Arguments of the function.
+            kwargs: Keyword arguments of the function.
+
+        returns:
+            A tuple with the result and True if this thread called the function or
+            False if it waited for another thread.
+        """
+        with self._lock:
+            future = self._shared.get(key)
+            leader = future is None
+            if leader:
+                future = self._shared[key] = Future()
+        if not leader:
+            return future.result(), False
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result, True
+        finally:
+            with self._lock:
+                del self._shared[key]
+
+    def _dispatch(self) -> list:
+        """Take the tasks that can start now in round-robin order of the sessions.
+
+        This must be called with the lock held. The tasks are started outside of the
+        lock with _start.
+        """
+        started = []
+        while self._running < self.max_workers and self._queues:
+            session, queue = next(iter(self._queues.items()))
+            task = queue.popleft()
+            if queue:
+                self._queues.move_to_end(session)
+            else:
+                del self._queues[session]
+            progress = self._progress[session]
+            progress.queued -= 1
+            if not task.future.set_running_or_notify_cancel():
+                continue
+            progress.running += 1
+            self._running += 1
+            started.append(task)
+        return started
+
+    def _start(self, tasks: list) -> None:
+        tasks = deque(tasks)
+        while tasks:
+            task = tasks.popleft()
+            try:
+                pool_future = self._submit(task)
+            except Exception as error:
+                # the slot of a task that never reached a worker is free right away
+                tasks.extend(self._release(task))
+                task.future.set_exception(error)
+                continue
+            pool_future.add_done_callback(
+                lambda pool_future, task=task: self._finish(task, pool_future))
+
+    def _submit(self, task: _Task) -> Future:
+        pool = self._get_pool()
+        try:
+            return pool.submit(task.func, *task.args, **task.kwargs)
+        except BrokenProcessPool:
+            # a worker died. Start a new pool for this and the next tasks
+            return self._get_pool(broken=pool).submit(task.func, *task.args,
+                                                      **task.kwargs)
+
+    def _release(self, task: _Task) -> list:
+        """Free the slot of a finished task and take the tasks that can start now."""
+        with self._lock:
+            self._running -= 1
+            progress = self._progress[task.session]
+            progress.running -= 1
+            progress.done += 1
+            return self._dispatch()
+
+    def _finish(self, task: _Task, pool_future: Future) -> None:
+        self._start(self._release(task))
+
+        error = pool_future.exception()
+        if error is not None:
+            task.future.set_exception(error)
+        else:
+            task.future.set_result(pool_future.result())
+
+    def _get_pool(self, broken: ProcessPoolExecutor = None) -> ProcessPoolExecutor:
+        """Get the process pool and create it if needed.
+
+        args:
+            broken: Optional pool that raised BrokenProcessPool. It is replaced unless
+                another thread has replaced it already.
+        """
+        with self._lock:
+            if self._pool is None or self._pool is broken:
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._pool
+
+
+class SessionExecutor(Executor):
+    """An Executor for the tasks of a session on a shared TaskExecutor.
+
+    It can be passed to any function that takes an Executor. Shutting it down does
+    not stop the shared pool.
+    """
+
+    def __init__(self, tasks: TaskExecutor, session: str) -> None:
+        self.tasks = tasks
+        self.session_id = session
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        return self.tasks.submit(self.session_id, fn, *args, **kwargs)
+
+    def progress(self) -> TaskProgress:
+        return self.tasks.progress(self.session_id)
+
+    def reset_progress(self) -> None:
+        self.tasks.reset_progress(self.session_id)
+
+    def shutdown(self, wait: bool = True) -> None:
+        pass
+
+
+TASKS = TaskExecutor()
@@ -0,0 +1,320 @@
+"""Vectorized glare evaluation of 180 degree hemispherical fisheye images."""
+import math
+
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+from rgbe import HDRHeader, read_hdr
+
+
+# luminous efficacy and RGB weights that Radiance uses to get luminance
+LUMINOUS_EFFICACY = 179
+RGB_WEIGHTS = (0.265, 0.670, 0.065)
+# thresholds up to this value are a factor of the average luminance. Values above this
+# are absolute luminance thresholds in cd/m2. Same as the -b option of evalglare.
+ABSOLUTE_THRESHOLD = 100
+# glare source threshold in cd/m2 when -b is not set, the same as evalglare, which the
+# app ran before this module
+DEFAULT_THRESHOLD = 2000
+# position index is not allowed to grow beyond this value
+MAX_POSITION_INDEX = 16
+# smallest cosine of a pixel direction to avoid infinite solid angles at the edge
+MIN_COSINE = 1e-3
+
+
+@dataclass
+class GlareResult:
+    """Result of a glare evaluation.
+
+    args:
+        dgp: Daylight glare probability.
+        dgi: Daylight glare index.
+        ugr: Unified glare rating.
+        vertical_illuminance: Vertical eye illuminance in lux.
+        average_luminance: Solid angle weighted average luminance in cd/m2.
+        threshold: Luminance threshold that was used to detect glare sources.
+        source_count: Number of detected glare sources.
+        source_solid_angle: Total solid angle of the glare sources in sr.
+        source_map: An int32 array with the shape of the image with the index of the
+            glare source for each pixel and -1 for pixels that are not a source.
+    """
+    dgp: float
+    dgi: float
+    ugr: float
+    vertical_illuminance: float
+    average_luminance: float
+    threshold: float
+    source_count: int
+    source_solid_angle: float
+    source_map: np.ndarray
+
+
+@lru_cache(maxsize=8)
+def fisheye_geometry(height: int, width: int) -> Tuple[np.ndarray, np.ndarray,
+                                                       np.ndarray]:
+    """Get the per pixel geometry of a -vth 180 degree fisheye image.
+
+    The result only depends on the resolution of the image and is cached.
+
+    args:
+        height: Number of rows in the image.
+        width: Number of columns in the image.
+
+    returns:
+        A tuple with three flat float32 arrays. The illuminance weight of each pixel,
+        which is its solid angle times the cosine to the view direction, the solid
+        angle of each pixel and the direction of each pixel as an array of shape
+        (height * width, 3) in a view frame of right, up and view direction. Pixels
+        outside the fisheye circle have zero weight and solid angle.
+    """
+    x = (np.arange(width) + 0.5) / width * 2 - 1
+    y = 1 - (np.arange(height) + 0.5) / height * 2
+    x, y = np.meshgrid(x, y)
+    radius = x * x + y * y
+    inside = radius < 1
+
+    # a hemispherical fisheye is an orthographic projection so the projected area of
+    # a pixel is the solid angle times the cosine
+    z = np.sqrt(np.clip(1 - radius, 0, 1))
+    area = np.where(inside, 4 / (width * height), 0)
+    solid_angle = area / np.maximum(z, MIN_COSINE)
+
+    directions = np.stack([x, y, z], axis=-1).reshape(-1, 3)
+    return area.ravel().astype(np.float32), solid_angle.ravel().astype(np.float32), \
+        directions.astype(np.float32)
+
+
+def position_index(directions: np.ndarray) -> np.ndarray:
+    """Guth position index for directions in the view frame.
+
+    Directions below the line of sight use the Iwata model in the same way as
+    evalglare.
+
+    args:
+        directions: An array of shape (n, 3) with unit vectors in a view frame of
+            right, up and view direction.
+
+    returns:
+        An array of n position indices.
+    """
+    x, y, z = directions[:, 0], directions[:, 1], directions[:, 2]
+    sigma = np.degrees(np.arccos(np.clip(z, -1, 1)))
+    tau = np.degrees(np.arctan2(np.abs(x), y))
+    tau = np.where(tau == 0, 1e-5, tau)
+
+    guth = np.exp(
+        (35.2 - 0.31889 * tau - 1.22 * np.exp(-2 * tau / 9)) / 1000 * sigma
+        + (21 + 0.26667 * tau - 0.002963 * tau * tau) / 100000 * sigma * sigma
+    )
+
+    ratio = np.minimum(np.hypot(x, y) / np.maximum(z, MIN_COSINE), 3)
+    iwata = 1 + np.where(ratio > 0.6, 1.2, 0.8) * ratio
+
+    return np.minimum(np.where(y < 0, iwata, guth), MAX_POSITION_INDEX)
+
+
+def luminance(data: np.ndarray, exposure: float = 1.0) -> np.ndarray:
+    """Get the luminance in cd/m2 from Radiance RGB values.
+
+    args:
+        data: An array of shape (height, width, 3).
+        exposure: Exposure of the picture. Pixel values are divided by this value.
+
+    returns:
+        A float32 array of shape (height, width).
+    """
+    weights = np.array(RGB_WEIGHTS, dtype=np.float32) * \
+        np.float32(LUMINOUS_EFFICACY / exposure)
+    return data @ weights
+
+
+def _label_sources(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Group adjacent masked pixels into sources.
+
+    Each row of the mask is reduced to runs of masked pixels and runs that overlap in
+    adjacent rows are joined with vectorized union-find. Every round links the roots
+    on both sides of an edge and then flattens the trees by pointer jumping.
+
+    returns:
+        A tuple with the flat indices of the masked pixels and the source label of
+        each of them.
+    """
+    height, width = mask.shape
+    padded = np.zeros((height, width + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    # every run has a start and an end edge in the same row
+    stride = width + 1
+    edges = np.flatnonzero(np.diff(padded, axis=1))
+    if not edges.size:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    # keys that sort runs in row-major order so overlaps can be found by bisection
+    start_keys, end_keys = edges[0::2], edges[1::2]
+    run_rows = start_keys // stride
+    run_starts = start_keys - run_rows * stride
+    run_ends = end_keys - run_rows * stride
+    below = np.flatnonzero(run_rows > 0)
+    previous_row = (run_rows[below] - 1) * stride
+    low = np.searchsorted(end_keys, previous_row + run_starts[below], side='right')
+    high = np.searchsorted(start_keys, previous_row + run_ends[below], side='left')
+    counts = np.maximum(high - low, 0)
+    first = np.repeat(below, counts)
+    second = np.repeat(low - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    parent = np.arange(run_rows.size)
+    while first.size:
+        root_1, root_2 = parent[first], parent[second]
+        linked = root_1 != root_2
+        if not linked.any():
+            break
+        root_1, root_2 = root_1[linked], root_2[linked]
+        first, second = first[linked], second[linked]
+        np.minimum.at(parent, np.maximum(root_1, root_2), np.minimum(root_1, root_2))
+        while True:
+            grand_parent = parent[parent]
+            if np.array_equal(grand_parent, parent):
+                break
+            parent = grand_parent
+
+    _, run_labels = np.unique(parent, return_inverse=True)
+    lengths = run_ends - run_starts
+    offsets = np.cumsum(lengths) - lengths
+    pixels = np.repeat(run_rows * width + run_starts - offsets, lengths) + \
+        np.arange(lengths.sum())
+    return pixels, np.repeat(run_labels, lengths)
+
+
+def evaluate_glare(lum: np.ndarray,
+                   threshold: float = DEFAULT_THRESHOLD) -> GlareResult:
+    """Evaluate glare for a luminance image of a -vth 180 degree fisheye view.
+
+    args:
+        lum: An array of shape (height, width) with luminance values in cd/m2.
+        threshold: Glare source threshold. Values up to 100 are a factor of the
+            average luminance of the view. Larger values are an absolute luminance in
+            cd/m2. Defaults to 2000 cd/m2 like evalglare.
+
+    returns:
+        A GlareResult.
+    """
+    height, width = lum.shape
+    area, solid_angle, directions = fisheye_geometry(height, width)
+    flat = lum.ravel().astype(np.float32, copy=False)
+
+    vertical_illuminance = float(flat @ area)
+    average_luminance = float(flat @ solid_angle / solid_angle.sum())
+    if threshold <= ABSOLUTE_THRESHOLD:
+        threshold = threshold * average_luminance
+
+    mask = (flat > threshold) & (solid_angle > 0)
+    pixels, labels = _label_sources(mask.reshape(height, width))
+    source_map = np.full(flat.size, -1, dtype=np.int32)
+    source_map[pixels] = labels
+
+    count = int(labels.max()) + 1 if labels.size else 0
+    pixel_omega = solid_angle[pixels]
+    omega = np.bincount(labels, weights=pixel_omega, minlength=count)
+    lum_s = np.bincount(labels, weights=flat[pixels] * pixel_omega,
+                        minlength=count) / np.maximum(omega, 1e-12)
+    pixel_directions = directions[pixels] * pixel_omega[:, None]
+    centroid = np.stack([
+        np.bincount(labels, weights=pixel_directions[:, axis], minlength=count)
+        for axis in range(3)
+    ], axis=-1).astype(np.float64)
+    centroid /= np.maximum(np.linalg.norm(centroid, axis=-1, keepdims=True), 1e-12)
+    pos = position_index(centroid)
+
+    ev = max(vertical_illuminance, 1e-6)
+    source_illuminance = float(area[pixels] @ flat[pixels])
+    background = max((ev - source_illuminance) / math.pi, 1e-6)
+
+    glare_sum = float(np.sum(lum_s ** 2 * omega / (ev ** 1.87 * pos ** 2)))
+    dgp = 5.87e-5 * ev + 9.18e-2 * math.log10(1 + glare_sum) + 0.16
+    if ev < 1000:
+        # low light correction
+        dgp *= math.exp(0.024 * ev - 4) / (1 + math.exp(0.024 * ev - 4))
+    dgp = min(dgp, 1.0)
+
+    if count:
+        dgi_sum = np.sum(0.478 * lum_s ** 1.6 * (omega / pos ** 2) ** 0.8
+                         / (background + 0.07 * omega ** 0.5 * lum_s))
+        dgi = 10 * math.log10(dgi_sum)
+        ugr = 8 * math.log10(0.25 / background * np.sum(lum_s ** 2 * omega / pos ** 2))
+    else:
+        dgi = ugr = 0.0
+
+    return GlareResult(
+        dgp=dgp, dgi=float(dgi), ugr=float(ugr),
+        vertical_illuminance=vertical_illuminance,
+        average_luminance=average_luminance, threshold=threshold,
+        source_count=count, source_solid_angle=float(omega.sum()),
+        source_map=source_map.reshape(height, width)
+    )
+
+
+def check_view(header: HDRHeader) -> None:
+    """Raise a ValueError if the picture is not a -vth 180 degree fisheye image.
+
+    Pictures without a view are assumed to be -vth 180 degree fisheye images.
+    """
+    if not header.view:
+        return
+    options = header.view.split()
+    if '-vth' not in options:
+        raise ValueError(f'Only -vth fisheye images are supported. Got: {header.view}')
+    for option in ('-vh', '-vv'):
+        if option in options:
+            angle = float(options[options.index(option) + 1])
+            if not math.isclose(angle, 180, abs_tol=1e-3):
+                raise ValueError(
+                    f'Only 180 degree fisheye images are supported. Got: {header.view}')
+
+
+def check_image(data: np.ndarray, result: GlareResult,
+                copy: bool = True) -> np.ndarray:
+    """Color the glare sources of an image the same way evalglare check images do.
+
+    args:
+        data: An array of shape (height, width, 3) with RGB values.
+        result: The GlareResult of the image.
+        copy: Set to False to color the sources of data in place instead of a copy.
+
+    returns:
+        An array with the glare source pixels tinted by source.
+    """
+    colors = np.array([[1, 0, 0], [0, 1, 0], [0, 0, 1], [1, 1, 0], [1, 0, 1],
+                       [0, 1, 1]], dtype=np.float32)
+    check = data.copy() if copy else data
+    # only the source pixels are touched
+    flat = check.reshape(-1, 3)
+    labels = result.source_map.reshape(-1)
+    pixels = np.flatnonzero(labels >= 0)
+    brightness = flat[pixels].mean(axis=-1, keepdims=True)
+    flat[pixels] = brightness * colors[labels[pixels] % len(colors)]
+    return check
+
+
+def evaluate_hdr(hdr_path: Union[str, Path], threshold: float = DEFAULT_THRESHOLD,
+                 data: Optional[np.ndarray] = None,
+                 header: Optional[HDRHeader] = None) -> GlareResult:
+    """Evaluate glare for a -vth 180 degree fisheye HDR image.
+
+    args:
+        hdr_path: Path to the HDR image.
+        threshold: Glare source threshold. See evaluate_glare.
+        data: Optional decoded pixels of the image. The image is read from hdr_path
+            if not provided.
+        header: Optional header of the image. Required if data is provided.
+
+    returns:
+        A GlareResult.
+    """
+    if data is None:
+        data, header = read_hdr(hdr_path)
+    check_view(header)
+    return evaluate_glare(luminance(data, header.exposure), threshold)
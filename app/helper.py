@@ -1,16 +1,34 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
 import streamlit as st
+import numpy as np
+from concurrent.futures import Executor
 from pathlib import Path
-from typing import List, Tuple
+from typing import TYPE_CHECKING, BinaryIO, Callable, Iterable, List, Optional, Tuple
+
+from artifact import ModelArtifact, metadata_path, read_artifact, write_model
+from cache import CHUNK_SIZE, DiskCache, hash_file, hash_parts, link_file
+from executor import TASKS
+from sky import sky_string
+from tracing import annotate, traced
 
-from rhino3dm import File3dm
+# rhino3dm, ladybug and honeybee are imported by the functions that use them so the
+# app can draw its first page before they are loaded. See warmup.py.
+if TYPE_CHECKING:
+    from rhino3dm import File3dm
+    from ladybug.epw import EPW
+    from honeybee_3dm.config import Config
+    from honeybee_radiance.view import View
 
-from ladybug.epw import EPW
-from ladybug.dt import DateTime
 
-from honeybee_3dm.model import import_3dm
-from honeybee_3dm.config import Config, LayerConfig, FaceObject
-from honeybee_radiance.lightsource.sky import ClimateBased
-from honeybee_radiance.view import View
+# bump this when the translation changes so older cached models are not used
+TRANSLATION_VERSION = '4'
+HBJSON_CACHE = DiskCache(suffix='.hbjson')
+# metadata of the cached models with the same name as the HBJSON. See artifact.py
+METADATA_CACHE = DiskCache(suffix='.meta.json')
 
 
 def load_css():
@@ -18,9 +36,45 @@ def load_css():
         st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
 
 
+@traced('upload_write')
+def save_upload(uploaded_file: BinaryIO, target_path: Path,
+                chunk_size: int = CHUNK_SIZE) -> str:
+    """Stream an uploaded file to disk in chunks and hash it on the way.
+
+    The file is copied through a single reusable buffer so peak memory does not grow
+    with the size of the upload. The content is written to a temporary file first and
+    moved in place once it is complete.
+
+    args:
+        uploaded_file: A file-like object such as a Streamlit UploadedFile.
+        target_path: Path to the file on disk.
+        chunk_size: Number of bytes to copy at a time.
+
+    returns:
+        SHA-256 hash of the uploaded file.
+    """
+    sha = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    temp_path = target_path.with_name(f'{target_path.name}.part')
+
+    uploaded_file.seek(0)
+    with open(temp_path, 'wb') as f:
+        while True:
+            size = uploaded_file.readinto(buffer)
+            if not size:
+                break
+            sha.update(view[:size])
+            f.write(view[:size])
+    os.replace(temp_path, target_path)
+    annotate(bytes_out=target_path)
+
+    return sha.hexdigest()
+
+
 def write_mat_file(transmittance: float, target_folder: Path) -> Path:
 
-    ref_material = Path(r'assets\daylight.mat')
+    ref_material = Path(__file__).parent.joinpath('assets', 'daylight.mat')
 
     with open(ref_material.as_posix(), 'r') as ref_file:
         data = ref_file.readlines()
@@ -47,6 +101,7 @@ def write_config(glass_layers: List[str],
                  ignore_layers: List[str],
                  transmittance: float,
                  target_folder: Path) -> Tuple[Config, Path]:
+    from honeybee_3dm.config import Config, LayerConfig, FaceObject
 
     mat_file_path = write_mat_file(transmittance, target_folder)
 
@@ -76,27 +131,21 @@ def write_config(glass_layers: List[str],
 
 def get_brightest_hour(epw: EPW) -> int:
 
-    max_ill = epw.direct_normal_illuminance.max
-    hoy = None
-
-    for count, val in enumerate(epw.direct_normal_illuminance.values):
-        if val == max_ill:
-            hoy = count
-            break
-
-    return hoy
+    return int(np.argmax(epw.direct_normal_illuminance.values))
 
 
 def get_sky(epw: EPW, north_angle: int):
+    from ladybug.dt import DateTime
+    from honeybee_radiance.lightsource.sky import ClimateBased
 
     hoy = get_brightest_hour(epw)
     dt = DateTime.from_hoy(hoy)
     sky = ClimateBased.from_epw(epw, dt.month, dt.day, dt.hour, north_angle)
-    return f'climate-based -alt {sky.altitude} -az {sky.azimuth} -dni {sky.direct_normal_irradiance}'\
-        f' -dhi {sky.diffuse_horizontal_irradiance} -g {sky.ground_reflectance} '
+    return sky_string(sky)
 
 
 def get_views(rh: File3dm) -> List[View]:
+    from honeybee_radiance.view import View
 
     hb_views = []
     views = rh.NamedViews
@@ -115,12 +164,219 @@ def get_views(rh: File3dm) -> List[View]:
     return hb_views
 
 
-@st.cache(hash_funcs={View: lambda v: v.to_dict()})
-def rhino_3dm_to_hbjson(rhino_3dm: File3dm, config: Config,
-                        config_path: Path, views: List[View],
-                        target_folder: Path) -> Path:
-    hb_model = import_3dm(
-        st.session_state.rhino_file.as_posix(), config_path=config_path)
+def translation_key(rhino_hash: str, config: Config, views: List[View]) -> str:
+    """Get the cache key for translating a Rhino file to HBJSON.
+
+    The key uses the content of the radiance material file instead of its path so the
+    same translation is shared between sessions.
+
+    args:
+        rhino_hash: SHA-256 hash of the Rhino file.
+        config: A honeybee-3dm Config object.
+        views: A list of Honeybee Radiance views.
+
+    returns:
+        Cache key as a string.
+    """
+    material = config.sources.get('radiance_material') if config.sources else None
+    material_data = Path(material).read_bytes() if material else b''
+
+    return hash_parts([
+        TRANSLATION_VERSION,
+        rhino_hash,
+        config.json(exclude={'sources'}, sort_keys=True),
+        material_data,
+        json.dumps([view.to_dict() for view in views], sort_keys=True)
+    ])
+
+
+def write_layer_subset(rhino_file: Path, layer_indices: Iterable[int],
+                       target_file: Path) -> Path:
+    """Write a copy of a Rhino file with only the visible objects on some layers.
+
+    The layer table, settings and named views are kept as they are so layer indices
+    and names in the copy match the original file.
+
+    args:
+        rhino_file: Path to the Rhino file.
+        layer_indices: Indices of the layers to keep the objects of.
+        target_file: Path to the new Rhino file.
+
+    returns:
+        Path to the new Rhino file.
+    """
+    from rhino3dm import File3dm
+
+    rh = File3dm.Read(rhino_file.as_posix())
+    if not rh:
+        raise ValueError(f'Failed to read Rhino file: {rhino_file}')
+
+    layer_indices = set(layer_indices)
+    removed = [obj.Attributes.Id for obj in rh.Objects
+               if obj.Attributes.LayerIndex not in layer_indices
+               or not obj.Attributes.Visible]
+    for object_id in removed:
+        rh.Objects.Delete(object_id)
+
+    if not rh.Write(target_file.as_posix(), 0):
+        raise ValueError(f'Failed to write Rhino file: {target_file}')
+    return target_file
+
+
+@traced('translate')
+def rhino_3dm_to_artifact(rhino_file: Path, config: Config,
+                          config_path: Path, views: List[View],
+                          target_folder: Path, rhino_hash: str = None,
+                          layer_indices: Iterable[int] = None,
+                          partitions: List[List[int]] = None,
+                          executor: Executor = None,
+                          progress: Callable[[int, int], None] = None,
+                          object_layers: Iterable[int] = None
+                          ) -> ModelArtifact:
+    """Translate a Rhino file to HBJSON.
+
+    Translated models are kept in an on-disk cache that is shared between sessions
+    and survives restarts. A cache hit links the stored HBJSON to the target folder.
+    If another session is already translating the same content, this waits for it
+    and links its result, or translates again if the result was removed in the
+    meantime.
+
+    args:
+        rhino_file: Path to the Rhino file.
+        config: A honeybee-3dm Config object.
+        config_path: Path to the config file of the Config object.
+        views: A list of Honeybee Radiance views to add to the model.
+        target_folder: Path to the folder where the HBJSON will be written.
+        rhino_hash: Optional SHA-256 hash of the Rhino file. It is calculated from the
+            file if not provided.
+        layer_indices: Optional indices of the layers that will be translated. Usually
+            from ModelIndex.translated_layers. If provided, the objects on the other
+            layers are removed before the file is handed to honeybee-3dm.
+        partitions: Optional groups of contiguous layer indices from
+            translation.partition_layers. If there is more than one group, each group
+            is translated in its own process and the results are merged in order.
+        executor: Optional process Executor to translate the layers on. Usually the
+            executor of a session on the shared task pool. Without it, a single group
+            of layers is translated in this thread.
+        progress: Optional function that is called with the number of translated
+            groups of layers and the total number of groups.
+        object_layers: Optional indices of the layers that have objects. Usually
+            from ModelIndex.object_layers. If all of them are in layer_indices, no
+            object would be removed and the Rhino file is translated as it is.
+
+    returns:
+        A ModelArtifact.
+    """
+    annotate(bytes_in=rhino_file)
+    key = translation_key(rhino_hash or hash_file(rhino_file), config, views)
+
+    translate_args = (key, rhino_file, config_path, views, target_folder,
+                      layer_indices, partitions, executor, progress, object_layers)
+    artifact = _link_translation(target_folder, HBJSON_CACHE.get(key))
+    if artifact is None:
+        artifact, translated = TASKS.shared(key, _translate, *translate_args)
+        if not translated:
+            # the cache entry of the other session can be evicted before it is linked
+            # so its own HBJSON is the next best source
+            artifact = _link_translation(target_folder, HBJSON_CACHE.get(key),
+                                         artifact.hbjson_path)
+            if artifact is None:
+                artifact = _translate(*translate_args)
+                translated = True
+        if translated:
+            annotate(cache='miss', bytes_out=artifact.hbjson_path)
+            return artifact
+
+    annotate(cache='hit', bytes_out=artifact.hbjson_path)
+    return artifact
+
+
+def _link_translation(target_folder: Path,
+                      *sources: Path) -> Optional[ModelArtifact]:
+    """Link the first HBJSON that still exists to the target folder.
+
+    The metadata of the HBJSON is linked with it so its hash is not calculated again.
+
+    args:
+        target_folder: Path to the folder where the HBJSON will be written.
+        sources: Paths to HBJSON files from write_model. None values are skipped.
+
+    returns:
+        A ModelArtifact or None if none of the sources exist anymore.
+    """
+    hbjson_path = target_folder.joinpath('sample.hbjson')
+    for source in sources:
+        if source is None:
+            continue
+        # the metadata of an earlier model must not describe this one
+        try:
+            metadata_path(hbjson_path).unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            link_file(source, hbjson_path)
+        except FileNotFoundError:
+            # evicted or removed since it was found
+            continue
+        try:
+            link_file(metadata_path(source), metadata_path(hbjson_path))
+        except FileNotFoundError:
+            # the hash is calculated from the HBJSON instead
+            pass
+        return read_artifact(hbjson_path)
+    return None
+
+
+def _translate(key: str, rhino_file: Path, config_path: Path, views: List[View],
+               target_folder: Path, layer_indices: Iterable[int],
+               partitions: List[List[int]], executor: Executor,
+               progress: Callable[[int, int], None],
+               object_layers: Iterable[int]) -> ModelArtifact:
+    """Translate a Rhino file and add the HBJSON to the cache."""
+    from honeybee_3dm.model import import_3dm
+    from translation import import_3dm_parallel
+
+    if layer_indices is not None:
+        layer_indices = sorted(layer_indices)
+        if object_layers is not None and set(object_layers) <= set(layer_indices):
+            # honeybee-3dm skips the hidden objects itself so a copy would be the same
+            translated_file = rhino_file
+        else:
+            translated_file = write_layer_subset(
+                rhino_file, layer_indices, target_folder.joinpath('translated.3dm'))
+        # the layers are translated with translation.import_layers, which counts the
+        # objects of each layer for the viewer
+        partitions = partitions or [layer_indices]
+    else:
+        translated_file = rhino_file
+
+    metadata = None
+    if partitions:
+        hb_model, layers = import_3dm_parallel(translated_file, config_path, partitions,
+                                               rhino_file.stem, executor=executor,
+                                               progress=progress)
+        metadata = {'layers': layers}
+    else:
+        hb_model = import_3dm(translated_file.as_posix(), rhino_file.stem,
+                              config_path=config_path)
     hb_model.properties.radiance.add_views(views)
-    hb_model.to_hbjson('sample', target_folder)
-    return target_folder.joinpath('sample.hbjson')
+    artifact = write_model(hb_model, target_folder, 'sample', metadata)
+    METADATA_CACHE.put(key, metadata_path(artifact.hbjson_path))
+    HBJSON_CACHE.put(key, artifact.hbjson_path)
+    return artifact
+
+
+def rhino_3dm_to_hbjson(rhino_file: Path, config: Config,
+                        config_path: Path, views: List[View],
+                        target_folder: Path, rhino_hash: str = None,
+                        layer_indices: Iterable[int] = None,
+                        partitions: List[List[int]] = None) -> Path:
+    """Translate a Rhino file to HBJSON.
+
+    See rhino_3dm_to_artifact for the arguments.
+
+    returns:
+        Path to the HBJSON file.
+    """
+    return rhino_3dm_to_artifact(rhino_file, config, config_path, views, target_folder,
+                                 rhino_hash, layer_indices, partitions).hbjson_path
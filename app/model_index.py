@@ -0,0 +1,235 @@
+"""A lightweight index of a Rhino file that is parsed once per uploaded file."""
+from __future__ import annotations
+
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional, Set, Tuple
+
+from cache import hash_file
+from helper import get_views
+from tracing import annotate, traced
+
+if TYPE_CHECKING:
+    from honeybee_3dm.config import Config
+    from honeybee_radiance.view import View
+
+
+Point = Tuple[float, float, float]
+
+
+@dataclass
+class LayerInfo:
+    """Summary of a layer in a Rhino file.
+
+    args:
+        index: Index of the layer in the Rhino file.
+        name: Name of the layer.
+        full_path: Full path of the layer with parent names separated by "::".
+        visible: A boolean that is True if the layer is on in Rhino.
+        parent: Index of the parent layer or None for top-level layers.
+        children: Indices of the direct child layers.
+        object_count: Number of objects on the layer. Objects on child layers are not
+            counted.
+        bounding_box: Min and max corners of the bounding box of the objects on the
+            layer or None if the layer has no objects.
+    """
+    index: int
+    name: str
+    full_path: str
+    visible: bool
+    parent: Optional[int] = None
+    children: List[int] = field(default_factory=list)
+    object_count: int = 0
+    bounding_box: Optional[Tuple[Point, Point]] = None
+
+
+@dataclass
+class ModelIndex:
+    """Layers and named views of a Rhino file without its geometry.
+
+    args:
+        rhino_hash: SHA-256 hash of the Rhino file.
+        layers: A list of LayerInfo objects in the order of the layer table.
+        views: A list of Honeybee Radiance views for the named views in the file.
+    """
+    rhino_hash: str
+    layers: List[LayerInfo]
+    views: List[View]
+
+    @property
+    def layer_names(self) -> List[str]:
+        return [layer.name for layer in self.layers]
+
+    @property
+    def object_count(self) -> int:
+        return sum(layer.object_count for layer in self.layers)
+
+    @property
+    def object_layers(self) -> List[int]:
+        """Indices of the layers that have objects."""
+        return [layer.index for layer in self.layers if layer.object_count]
+
+    def visible_names(self) -> Set[str]:
+        """Names of the layers that are on with all their parents in the same way as
+        honeybee-3dm."""
+        by_name = {layer.name: layer for layer in self.layers}
+        return {
+            layer.name for layer in self.layers
+            if all(by_name[name].visible for name in layer.full_path.split('::'))
+        }
+
+    def translated_layers(self, config: Config) -> List[int]:
+        """Get the indices of the layers that honeybee-3dm creates geometry from.
+
+        This follows the layer loop of import_3dm. Layers in the config that do not
+        set a face type, a face object, a material or grid settings are read by
+        import_3dm but all their objects are discarded, which is how ignored layers
+        are written by write_config. Hidden layers that are not in the config are
+        skipped.
+
+        args:
+            config: A honeybee-3dm Config object.
+
+        returns:
+            A sorted list of layer indices.
+        """
+        layer_configs = config.dict(exclude_none=True)['layers']
+        visible = self.visible_names()
+        paths = [layer.full_path.split('::') for layer in self.layers]
+
+        names = set()
+        for layer, path in zip(self.layers, paths):
+            layer_config = layer_configs.get(layer.name)
+            if layer_config is None:
+                root = layer_configs.get(path[0])
+                if root and root.get('include_child_layers'):
+                    # objects are imported from the parent layer in the config
+                    continue
+                if layer.name in visible:
+                    names.add(layer.name)
+                continue
+
+            creates_geometry = any(
+                key in layer_config for key in
+                ('honeybee_face_type', 'honeybee_face_object', 'radiance_material')
+            ) or ('grid_settings' in layer_config
+                  and layer_config.get('exclude_from_rad'))
+            if not creates_geometry:
+                continue
+            if layer_config.get('include_child_layers'):
+                for other in paths:
+                    if layer.name in other:
+                        names.update(other)
+            else:
+                names.add(layer.name)
+
+        return [layer.index for layer in self.layers if layer.name in names]
+
+    def descendants(self, index: int) -> List[int]:
+        """Get the indices of all the layers below a layer."""
+        layers = []
+        stack = list(self.layers[index].children)
+        while stack:
+            child = stack.pop()
+            layers.append(child)
+            stack.extend(self.layers[child].children)
+        return layers
+
+
+def _merge_box(box: Optional[Tuple[Point, Point]],
+               other: Tuple[Point, Point]) -> Tuple[Point, Point]:
+    if box is None:
+        return other
+    return (tuple(min(a, b) for a, b in zip(box[0], other[0])),
+            tuple(max(a, b) for a, b in zip(box[1], other[1])))
+
+
+def build_model_index(rhino_file: Path, rhino_hash: str = None) -> ModelIndex:
+    """Read a Rhino file and build its index.
+
+    args:
+        rhino_file: Path to the Rhino file.
+        rhino_hash: Optional SHA-256 hash of the Rhino file. It is calculated from the
+            file if not provided.
+
+    returns:
+        A ModelIndex.
+    """
+    from rhino3dm import File3dm
+
+    rh = File3dm.Read(Path(rhino_file).as_posix())
+    if not rh:
+        raise ValueError(f'Failed to read Rhino file: {rhino_file}')
+
+    layers = [
+        LayerInfo(layer.Index, layer.Name, layer.FullPath, layer.Visible)
+        for layer in rh.Layers
+    ]
+    by_id = {str(layer.Id): info for layer, info in zip(rh.Layers, layers)}
+    for layer, info in zip(rh.Layers, layers):
+        parent = by_id.get(str(layer.ParentLayerId))
+        if parent is not None:
+            info.parent = parent.index
+            parent.children.append(info.index)
+
+    for obj in rh.Objects:
+        info = layers[obj.Attributes.LayerIndex]
+        info.object_count += 1
+        box = obj.Geometry.GetBoundingBox()
+        if box.IsValid:
+            info.bounding_box = _merge_box(
+                info.bounding_box,
+                ((box.Min.X, box.Min.Y, box.Min.Z), (box.Max.X, box.Max.Y, box.Max.Z)))
+
+    return ModelIndex(rhino_hash or hash_file(rhino_file), layers, get_views(rh))
+
+
+class ModelIndexCache:
+    """A process-wide LRU cache of model indices keyed by the hash of the file.
+
+    The same uploaded file is only parsed once for all the reruns and sessions.
+
+    args:
+        max_size: Maximum number of indices to keep in memory.
+    """
+
+    def __init__(self, max_size: int = 32) -> None:
+        self.max_size = max_size
+        self._indices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, rhino_file: Path, rhino_hash: str) -> ModelIndex:
+        with self._lock:
+            if rhino_hash in self._indices:
+                self._indices.move_to_end(rhino_hash)
+                annotate(cache='hit')
+                return self._indices[rhino_hash]
+
+        annotate(cache='miss', bytes_in=rhino_file)
+        index = build_model_index(rhino_file, rhino_hash)
+
+        with self._lock:
+            self._indices[rhino_hash] = index
+            while len(self._indices) > self.max_size:
+                self._indices.popitem(last=False)
+        return index
+
+
+MODEL_INDICES = ModelIndexCache()
+
+
+@traced('3dm_parse')
+def get_model_index(rhino_file: Path, rhino_hash: str) -> ModelIndex:
+    """Get the index of a Rhino file from the cache or build it if needed.
+
+    args:
+        rhino_file: Path to the Rhino file.
+        rhino_hash: SHA-256 hash of the Rhino file.
+
+    returns:
+        A ModelIndex.
+    """
+    return MODEL_INDICES.get(rhino_file, rhino_hash)
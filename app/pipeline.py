@@ -0,0 +1,185 @@
+"""Incremental evaluation of the stages that run on every rerun of the app.
+
+Streamlit runs the whole script again whenever a widget changes. The stages here are
+nodes of a small graph with declared inputs and they are only called again when one of
+their inputs, or a node they depend on, has changed since the last call. A rerun that
+changes none of the inputs of a node does no file I/O and no parsing for it.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+from annual import AnnualGlare, ViewCoefficients, annual_glare, view_coefficients
+from helper import write_config
+from model_index import ModelIndex, get_model_index
+from sky import EpwColumns, brightest_hours, load_epw, sky_strings
+from tracing import span
+from translation import partition_layers
+
+if TYPE_CHECKING:
+    from honeybee_3dm.config import Config
+
+
+@dataclass
+class Node:
+    """A stage of a Pipeline.
+
+    args:
+        name: Name of the node.
+        func: Function that is called with the values of the inputs as keyword
+            arguments in the order of the inputs.
+        inputs: Names of the inputs or of other nodes that the function takes.
+    """
+    name: str
+    func: Callable
+    inputs: Tuple[str, ...]
+
+
+class Pipeline:
+    """Nodes that are memoized on the versions of their inputs.
+
+    Each input has a version that increases when it is set to a different value. A
+    node keeps the versions of its inputs from its last call and it is only called
+    again if one of them has changed. A node that is called again gets a new version
+    so the nodes that depend on it are called again too.
+    """
+
+    def __init__(self) -> None:
+        self._nodes: Dict[str, Node] = {}
+        self._inputs: Dict[str, object] = {}
+        self._versions: Dict[str, int] = {}
+        self._stamps: Dict[str, tuple] = {}
+        self._values: Dict[str, object] = {}
+
+    def add(self, name: str, func: Callable, *inputs: str) -> None:
+        """Add a node.
+
+        args:
+            name: Name of the node.
+            func: Function of the node. See Node.
+            inputs: Names of the inputs or of other nodes that the function takes.
+        """
+        self._nodes[name] = Node(name, func, inputs)
+
+    def set(self, **inputs) -> None:
+        """Set the values of inputs. Values that are equal to the last ones are kept
+        so the nodes that depend on them are not called again."""
+        for name, value in inputs.items():
+            if name in self._inputs and _equal(self._inputs[name], value):
+                continue
+            self._inputs[name] = value
+            self._versions[name] = self._versions.get(name, 0) + 1
+
+    def get(self, name: str):
+        """Get the value of an input or of a node. The node and the nodes that it
+        depends on are called if their inputs have changed."""
+        if name not in self._nodes:
+            try:
+                return self._inputs[name]
+            except KeyError:
+                raise KeyError(f'Input {name} of the pipeline is not set.')
+        self._update(name)
+        return self._values[name]
+
+    def invalidate(self) -> None:
+        """Forget the values of all the nodes. Usually because their files were
+        removed. The inputs are kept so an input that is set to the same value again
+        does not count as a change, but every node is called again."""
+        self._stamps.clear()
+        self._values.clear()
+
+    def _update(self, name: str) -> int:
+        """Call a node if needed and get its version."""
+        if name not in self._nodes:
+            if name not in self._inputs:
+                raise KeyError(f'Input {name} of the pipeline is not set.')
+            return self._versions[name]
+
+        node = self._nodes[name]
+        stamp = tuple(self._update(input_name) for input_name in node.inputs)
+        if self._stamps.get(name) != stamp:
+            kwargs = {input_name: self.get(input_name) for input_name in node.inputs}
+            with span('pipeline', node=name):
+                self._values[name] = node.func(**kwargs)
+            self._stamps[name] = stamp
+            self._versions[name] = self._versions.get(name, 0) + 1
+        return self._versions[name]
+
+
+def _equal(a, b) -> bool:
+    try:
+        return bool(a == b) and type(a) is type(b)
+    except Exception:
+        # values such as arrays do not compare to a single boolean
+        return a is b
+
+
+def _layer_indices(model_index: ModelIndex, config: Tuple[Config, Path]) -> List[int]:
+    return model_index.translated_layers(config[0])
+
+
+def _partitions(model_index: ModelIndex, layer_indices: List[int],
+                max_workers: int) -> List[List[int]]:
+    return partition_layers(
+        layer_indices,
+        [model_index.layers[index].object_count for index in layer_indices],
+        max_workers)
+
+
+def _epw(epw_file: Path, epw_hash: str) -> EpwColumns:
+    return load_epw(epw_file, epw_hash)
+
+
+def _sky(epw: EpwColumns, north_angle: float) -> str:
+    return sky_strings(epw, brightest_hours(epw), north_angle)[0]
+
+
+def _coefficients(model_index: ModelIndex,
+                  transmittance: float) -> List[ViewCoefficients]:
+    return view_coefficients(model_index.views, transmittance)
+
+
+def _annual(epw: EpwColumns, coefficients: List[ViewCoefficients],
+            north_angle: float) -> AnnualGlare:
+    return annual_glare(epw, coefficients, north_angle)
+
+
+def _annual_runs(epw: EpwColumns, annual: AnnualGlare, north_angle: float
+                 ) -> Tuple[List[Tuple[int, Optional[str]]], List[str]]:
+    views = annual.worst_views()
+    hours = list(views)
+    skies = dict(zip(hours, sky_strings(epw, hours, north_angle)))
+    runs, run_skies = [], []
+    for hour, names in views.items():
+        # an hour that is among the worst of every view renders all of them in one run
+        for view_filter in [None] if len(names) == len(annual.views) else names:
+            runs.append((hour, view_filter))
+            run_skies.append(skies[hour])
+    return runs, run_skies
+
+
+def config_pipeline() -> Pipeline:
+    """Get a Pipeline for the configuration stages of the app.
+
+    Inputs are rhino_file, rhino_hash, glass_layers, ignore_layers, transmittance,
+    north_angle, target_folder, max_workers, epw_file and epw_hash. Nodes are
+    model_index, config, layer_indices, partitions, epw, sky, coefficients, annual and
+    annual_runs. annual_runs is a tuple of the runs of an annual job as (hour, view
+    filter) tuples and the sky of each run. A view filter of None means all the
+    views.
+    """
+    pipeline = Pipeline()
+    pipeline.add('model_index', get_model_index, 'rhino_file', 'rhino_hash')
+    pipeline.add('config', write_config, 'glass_layers', 'ignore_layers',
+                 'transmittance', 'target_folder')
+    pipeline.add('layer_indices', _layer_indices, 'model_index', 'config')
+    pipeline.add('partitions', _partitions, 'model_index', 'layer_indices',
+                 'max_workers')
+    pipeline.add('epw', _epw, 'epw_file', 'epw_hash')
+    pipeline.add('sky', _sky, 'epw', 'north_angle')
+    pipeline.add('coefficients', _coefficients, 'model_index', 'transmittance')
+    pipeline.add('annual', _annual, 'epw', 'coefficients', 'north_angle')
+    pipeline.add('annual_runs', _annual_runs, 'epw', 'annual', 'north_angle')
+    return pipeline
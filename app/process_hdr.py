@@ -1,15 +1,42 @@
 import os
 import subprocess
 import streamlit as st
+import numpy as np
 
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ProcessPoolExecutor, \
+    wait
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Tuple
+from typing import Iterable, Iterator, Optional, Tuple
+
+from cores import available_cores
+from glare import GlareResult, check_image, evaluate_hdr
+from rgbe import read_hdr, write_hdr, encode_preview
+from tracing import annotate, submit_traced, traced, traced_result
+
+
+@dataclass
+class ViewResult:
+    """Post-processing result of a single view.
+
+    args:
+        name: Name of the view. This is the stem of the HDR image.
+        check_path: Path to the check image with the glare sources.
+        dgp: Daylight glare probability.
+        category: Glare comfort category.
+        preview: Preview of the check image as bytes.
+        error: Error message if the view failed to process.
+        vertical_illuminance: Vertical eye illuminance in lux.
+    """
+    name: str
+    check_path: Optional[Path] = None
+    dgp: Optional[float] = None
+    category: Optional[str] = None
+    preview: Optional[bytes] = None
+    error: Optional[str] = None
+    vertical_illuminance: Optional[float] = None
 
-from honeybee_radiance.config import folders as rad_folders
-from honeybee_radiance_command.ra_gif import Ra_GIF
 
-
-@st.cache
 def dgp_comfort_category(dgp):
     """Get text for the glare comfort category given a DGP value."""
     if dgp < 0.35:
@@ -22,21 +49,44 @@ def dgp_comfort_category(dgp):
     return 'Intolerable Glare'
 
 
+def _evaluate_view(hdr_path: Path,
+                   checkhdr_path: Path) -> Tuple[GlareResult, np.ndarray]:
+    """Evaluate glare in-process and write the check image."""
+    data, header = read_hdr(hdr_path)
+    result = evaluate_hdr(hdr_path, data=data, header=header)
+    check = check_image(data, result, copy=False)
+    write_hdr(checkhdr_path, check, header)
+    return result, check
+
+
+@traced('evalglare')
 @st.cache
 def eval_hdr(hdr_path, target_folder: Path,
-             evalglare_path: Path) -> Tuple[Path, float, str]:
+             evalglare_path: Path = None) -> Tuple[Path, float, str]:
+    """Evaluate glare for a -vth 180 degree fisheye HDR image.
+
+    args:
+        hdr_path: Path to the HDR image.
+        target_folder: Path to the folder where the check image will be written.
+        evalglare_path: Optional path to the evalglare executable. If not provided,
+            the image is evaluated in-process with the glare module.
+
+    returns:
+        A tuple with the path to the check image, the DGP and the glare category.
+    """
+    # path to the evaluated HDR image
+    checkhdr_path = target_folder.joinpath(f'check_{hdr_path.stem}.hdr')
+
+    if evalglare_path is None:
+        result, _ = _evaluate_view(hdr_path, checkhdr_path)
+        return checkhdr_path, result.dgp, dgp_comfort_category(result.dgp)
 
     # TODO: add them as parameters
     projection = '-vth'
-    width = 800
-    height = 800
 
     # get the path the the evalglare command and setup the check image argument
     evalglare_exe = evalglare_path.absolute().as_posix()
 
-    # path to the evaluated HDR image
-    checkhdr_path = target_folder.joinpath(f'check_{hdr_path.stem}.hdr')
-
     cmds = [evalglare_exe, '-c', checkhdr_path.as_posix()]
     # since pcomp is used to merge images, the input usually doesn't have view information
     # add default view information for hemispheical fish-eye camera
@@ -56,16 +106,116 @@ def eval_hdr(hdr_path, target_folder: Path,
     return checkhdr_path, dgp, category
 
 
+@traced('preview')
+@st.cache
+def hdr_to_preview(hdr_path: Path, image_format: str = 'PNG') -> bytes:
+    """Tone map an HDR image to a preview image in memory.
+
+    args:
+        hdr_path: Path to the HDR image.
+        image_format: Format of the preview image. Example is PNG, WEBP or GIF.
+
+    returns:
+        The preview image as bytes.
+    """
+    data, _ = read_hdr(hdr_path)
+    return encode_preview(data, image_format)
+
+
+@traced('gif')
 @st.cache
 def hdr_to_gif(hdr_path: Path, target_folder: Path) -> Path:
     gif_path = target_folder.joinpath(f'{hdr_path.stem}.gif')
 
-    ra_gif = Ra_GIF(input=hdr_path.as_posix(), output=gif_path.as_posix())
-    env = None
-    if rad_folders.env != {}:
-        env = rad_folders.env
-    env = dict(os.environ, **env) if env else None
-
-    ra_gif.run(env, target_folder.as_posix())
+    data, _ = read_hdr(hdr_path)
+    gif_path.write_bytes(encode_preview(data, 'GIF'))
 
     return gif_path
+
+
+@traced('evalglare')
+def post_process_view(hdr_path: Path, target_folder: Path,
+                      image_format: str = 'PNG') -> ViewResult:
+    """Evaluate glare for a view and create the preview of its check image.
+
+    This function does not use the Streamlit cache so it can run in a worker process.
+
+    args:
+        hdr_path: Path to the HDR image.
+        target_folder: Path to the folder where the check image will be written.
+        image_format: Format of the preview image.
+
+    returns:
+        A ViewResult.
+    """
+    annotate(bytes_in=hdr_path)
+    checkhdr_path = target_folder.joinpath(f'check_{hdr_path.stem}.hdr')
+    result, check = _evaluate_view(hdr_path, checkhdr_path)
+
+    return ViewResult(hdr_path.stem, checkhdr_path, result.dgp,
+                      dgp_comfort_category(result.dgp),
+                      encode_preview(check, image_format),
+                      vertical_illuminance=result.vertical_illuminance)
+
+
+def post_process_results(result_folder: Path, target_folder: Path,
+                         max_workers: int = None,
+                         image_format: str = 'PNG',
+                         hdr_files: Iterable[Path] = None,
+                         executor: Executor = None) -> Iterator[ViewResult]:
+    """Post-process all the HDR images in a folder on a process pool.
+
+    Results are yielded as soon as each view finishes. A view that fails is yielded
+    as a ViewResult with an error message instead of stopping the other views.
+
+    args:
+        result_folder: Path to the folder with the HDR images.
+        target_folder: Path to the folder where the check images will be written.
+        max_workers: Maximum number of worker processes. Defaults to the number of
+            available cores.
+        image_format: Format of the preview images.
+        hdr_files: Optional iterable of HDR images to use instead of the images in
+            the result folder. Each image is submitted as soon as the iterable
+            produces it, so images can be processed while others are still being
+            downloaded.
+        executor: Optional process Executor to use instead of a new process pool.
+            Usually the executor of a session on the shared task pool. It is not
+            shut down.
+
+    returns:
+        An iterator of ViewResult objects in the order they finish.
+    """
+    if hdr_files is None:
+        hdr_files = sorted(file for file in result_folder.iterdir()
+                           if file.suffix.lower() == '.hdr')
+        if not hdr_files:
+            return
+        workers = min(max_workers or available_cores(), len(hdr_files))
+    else:
+        workers = max_workers or available_cores()
+
+    def _result(future: Future, file: Path) -> ViewResult:
+        try:
+            return traced_result(future)
+        except Exception as error:
+            return ViewResult(file.stem, error=str(error))
+
+    if executor is None:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from post_process_results(result_folder, target_folder,
+                                            image_format=image_format,
+                                            hdr_files=hdr_files, executor=pool)
+        return
+
+    pending = {}
+    for file in hdr_files:
+        future = submit_traced(executor, post_process_view, file, target_folder,
+                               image_format)
+        pending[future] = file
+        for done in [future for future in pending if future.done()]:
+            yield _result(done, pending.pop(done))
+
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield _result(future, pending.pop(future))
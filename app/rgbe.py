@@ -0,0 +1,421 @@
+"""Read and write Radiance RGBE (.HDR) images with NumPy."""
+import io
+import re
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+
+# Radiance writes run-length encoded scanlines only for widths in this range
+MIN_RLE_WIDTH = 8
+MAX_RLE_WIDTH = 0x7fff
+# shortest run that is worth encoding and the longest run a single code can hold
+MIN_RUN = 4
+MAX_RUN = 127
+MAX_LITERAL = 128
+
+RGBE_FORMAT = '32-bit_rle_rgbe'
+_CODES = np.arange(256, dtype=np.int64)
+_RESOLUTION = re.compile(rb'^([+-])([XY]) +(\d+) +([+-])([XY]) +(\d+)\s*$')
+
+
+@dataclass
+class HDRHeader:
+    """Information header of a Radiance picture.
+
+    args:
+        lines: Header lines in the order they were found in the file, without the
+            magic line, the FORMAT line and the trailing newlines.
+        exposure: Product of all the EXPOSURE values in the header. Pixel values
+            divided by this number are in watts/sr/m2.
+        view: Value of the last VIEW line in the header. This is the view that the
+            picture was rendered with.
+        primaries: Value of the last PRIMARIES line in the header.
+    """
+    lines: List[str] = field(default_factory=list)
+    exposure: float = 1.0
+    view: Optional[str] = None
+    primaries: Optional[str] = None
+
+    @classmethod
+    def from_lines(cls, lines: List[str]) -> 'HDRHeader':
+        header = cls(lines=lines)
+        for line in lines:
+            # lines that start with a tab are history from the input pictures
+            if line.startswith('EXPOSURE='):
+                header.exposure *= float(line.split('=', 1)[1])
+            elif line.startswith('VIEW='):
+                header.view = line.split('=', 1)[1].strip()
+            elif line.startswith('PRIMARIES='):
+                header.primaries = line.split('=', 1)[1].strip()
+        return header
+
+
+def _parse_header(buf: bytes) -> Tuple[HDRHeader, int]:
+    """Parse the information header and return it with the offset of the pixels."""
+    if not buf.startswith(b'#?'):
+        raise ValueError('Not a Radiance picture. Missing #? magic line.')
+
+    end = buf.find(b'\n\n')
+    if end == -1:
+        raise ValueError('Radiance picture header is not terminated.')
+
+    lines = buf[:end].decode('utf-8', errors='replace').split('\n')[1:]
+    fmt = [line for line in lines if line.startswith('FORMAT=')]
+    if fmt and fmt[-1].split('=', 1)[1].strip() != RGBE_FORMAT:
+        raise ValueError(f'Unsupported picture format: {fmt[-1]}')
+    header = HDRHeader.from_lines([line for line in lines if not line.startswith('FORMAT=')])
+
+    return header, end + 2
+
+
+def _decode_rle(buf: bytes, offset: int, width: int,
+                height: int) -> Tuple[np.ndarray, int]:
+    """Decode new-style run-length encoded scanlines.
+
+    A scanline can only start where its 4 byte header is found, so every position
+    with the header is walked as if it were a scanline. The walks advance together by
+    one run or literal span per step with NumPy. The scanlines of the picture are then
+    chained from the first one through the ends of the walks and the pixels are
+    copied from the buffer with a single vectorized repeat.
+    """
+    data = np.frombuffer(buf, dtype=np.uint8)
+    size = data.size
+    body = data[offset:]
+    header = np.array([2, 2, width >> 8, width & 255], dtype=np.uint8)
+    candidates = np.flatnonzero(
+        (body[:-3] == header[0]) & (body[1:-2] == header[1]) &
+        (body[2:-1] == header[2]) & (body[3:] == header[3])) + offset
+    if not candidates.size or candidates[0] != offset:
+        raise ValueError('Corrupt run-length encoded scanline.')
+
+    # pixels and bytes that a code stands for. A zero code is corrupt and overflows
+    lengths = np.where(_CODES > 128, _CODES - 128, _CODES)
+    lengths[0] = width + 1
+    advances = np.where(_CODES > 128, 2, _CODES + 1)
+
+    walk = np.arange(candidates.size)
+    pos = candidates + 4
+    count = np.zeros(candidates.size, dtype=np.int64)
+    component = np.zeros(candidates.size, dtype=np.int64)
+    # walk and position of every code that was read, and the end of complete walks
+    walks, codes = [], []
+    ends = np.full(candidates.size, -1, dtype=np.int64)
+    while walk.size:
+        code = data.take(pos, mode='clip')
+        walks.append(walk)
+        codes.append(pos)
+        pos = pos + advances[code]
+        count += lengths[code]
+        # scanlines are stored component by component
+        done = count == width
+        component += done
+        count -= width * done
+        active = count < width
+        complete = active & (component == 4)
+        ends[walk[complete]] = pos[complete]
+        active &= ~complete
+        if not active.all():
+            walk, pos, count, component = \
+                walk[active], pos[active], count[active], component[active]
+
+    # follow the scanlines of the picture from the first one
+    walk_of = {start: index for index, start in enumerate(candidates.tolist())}
+    ends = ends.tolist()
+    chain = []
+    current = 0
+    for _ in range(height):
+        if current is None or ends[current] < 0:
+            raise ValueError('Corrupt run-length encoded scanline.')
+        chain.append(current)
+        end = ends[current]
+        current = walk_of.get(end)
+    if end > size:
+        raise ValueError('Unexpected end of picture data.')
+
+    in_chain = np.zeros(candidates.size, dtype=bool)
+    in_chain[chain] = True
+    code_pos = np.concatenate(codes)[in_chain[np.concatenate(walks)]]
+
+    # every byte of the scanlines after a code is copied once, except the value of a
+    # run that is repeated, while the codes and the scanline headers are dropped
+    code = data[code_pos]
+    run = code > 128
+    repeats = np.ones(end - offset, dtype=np.int64)
+    repeats[candidates[chain, None] - offset + np.arange(4)] = 0
+    repeats[code_pos - offset] = 0
+    repeats[code_pos[run] + 1 - offset] = code[run] - 128
+    pixels = np.repeat(data[offset:end], repeats)
+    # scanlines are stored component by component
+    return pixels.reshape(height, 4, width).transpose(0, 2, 1), end
+
+
+def _decode_old(buf: bytes, offset: int, width: int,
+                height: int) -> Tuple[np.ndarray, int]:
+    """Decode flat pixels that may use old-style (1, 1, 1, n) repeat codes."""
+    total = width * height
+    if len(buf) - offset == total * 4:
+        data = np.frombuffer(buf, dtype=np.uint8, count=total * 4, offset=offset)
+        return data.reshape(height, width, 4), offset + total * 4
+
+    pixels = bytearray()
+    last = b'\x00\x00\x00\x00'
+    shift = 0
+    pos = offset
+    while len(pixels) < total * 4:
+        pixel = buf[pos:pos + 4]
+        if len(pixel) < 4:
+            raise ValueError('Unexpected end of picture data.')
+        pos += 4
+        if pixel[:3] == b'\x01\x01\x01':
+            pixels += last * (pixel[3] << shift)
+            shift += 8
+        else:
+            pixels += pixel
+            last = pixel
+            shift = 0
+    data = np.frombuffer(bytes(pixels[:total * 4]), dtype=np.uint8)
+    return data.reshape(height, width, 4), pos
+
+
+def rgbe_to_float(rgbe: np.ndarray) -> np.ndarray:
+    """Convert an array of RGBE pixels into float32 RGB values."""
+    exponent = rgbe[..., 3].astype(np.int32)
+    scale = np.where(exponent > 0, np.ldexp(np.float32(1), exponent - 136), 0)
+    return (rgbe[..., :3] + np.float32(0.5)) * scale[..., None].astype(np.float32)
+
+
+def float_to_rgbe(data: np.ndarray) -> np.ndarray:
+    """Convert an array of RGB values into RGBE pixels."""
+    data = np.asarray(data, dtype=np.float32)
+    brightest = data.max(axis=-1)
+    mantissa, exponent = np.frexp(brightest)
+    valid = brightest > 1e-32
+    scale = np.divide(mantissa * np.float32(256), brightest,
+                      out=np.zeros_like(brightest), where=valid)
+
+    rgbe = np.empty(data.shape[:-1] + (4,), dtype=np.uint8)
+    rgbe[..., :3] = np.clip(data * scale[..., None], 0, 255)
+    rgbe[..., 3] = np.where(valid, exponent + 128, 0)
+    return rgbe
+
+
+def decode_hdr(buf: bytes) -> Tuple[np.ndarray, HDRHeader]:
+    """Decode the content of a Radiance picture.
+
+    args:
+        buf: Content of an .HDR file as bytes.
+
+    returns:
+        A tuple with a float32 array of shape (height, width, 3) with the top row
+        first, and the HDRHeader of the picture.
+    """
+    header, offset = _parse_header(buf)
+
+    eol = buf.find(b'\n', offset)
+    match = _RESOLUTION.match(buf[offset:eol]) if eol != -1 else None
+    if not match:
+        raise ValueError('Missing or invalid resolution string.')
+    sign_1, axis_1, size_1, sign_2, axis_2, size_2 = match.groups()
+    if axis_1 == axis_2:
+        raise ValueError('Invalid resolution string.')
+    outer, inner = int(size_1), int(size_2)
+    offset = eol + 1
+
+    if MIN_RLE_WIDTH <= inner <= MAX_RLE_WIDTH and buf[offset:offset + 2] == b'\x02\x02' \
+            and not buf[offset + 2] & 0x80:
+        rgbe, _ = _decode_rle(buf, offset, inner, outer)
+    else:
+        rgbe, _ = _decode_old(buf, offset, inner, outer)
+
+    # reorient to standard -Y +X with the top row first
+    if axis_1 == b'Y':
+        if sign_1 == b'+':
+            rgbe = rgbe[::-1]
+        if sign_2 == b'-':
+            rgbe = rgbe[:, ::-1]
+    else:
+        if sign_1 == b'-':
+            rgbe = rgbe[::-1]
+        if sign_2 == b'+':
+            rgbe = rgbe[:, ::-1]
+        rgbe = rgbe.transpose(1, 0, 2)
+
+    return rgbe_to_float(rgbe), header
+
+
+def read_hdr(hdr_path: Union[str, Path]) -> Tuple[np.ndarray, HDRHeader]:
+    """Read a Radiance picture.
+
+    args:
+        hdr_path: Path to the .HDR file.
+
+    returns:
+        A tuple with a float32 array of shape (height, width, 3) and the HDRHeader.
+    """
+    return decode_hdr(Path(hdr_path).read_bytes())
+
+
+def _split(starts: np.ndarray, lengths: np.ndarray,
+           limit: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Split spans of bytes into consecutive spans of up to limit bytes."""
+    counts = -(-lengths // limit)
+    first = np.cumsum(counts) - counts
+    chunk = np.arange(counts.sum()) - np.repeat(first, counts)
+    return np.repeat(starts, counts) + chunk * limit, \
+        np.minimum(np.repeat(lengths, counts) - chunk * limit, limit)
+
+
+def _encode_rle(rgbe: np.ndarray) -> bytes:
+    """Encode RGBE pixels with new-style run-length encoded scanlines.
+
+    The runs and the literal spans of all the scanlines are found at once and the
+    codes, run values and literal bytes are scattered into the output with NumPy.
+    """
+    height, width, _ = rgbe.shape
+    flat = np.ascontiguousarray(rgbe.transpose(0, 2, 1)).reshape(-1)
+    size = flat.size
+
+    # find every run of identical bytes in one pass and keep the long ones
+    change = np.empty(size, dtype=bool)
+    change[0] = True
+    change[1:] = flat[1:] != flat[:-1]
+    change[::width] = True
+    run_starts = np.flatnonzero(change)
+    run_lengths = np.diff(np.append(run_starts, size))
+    long_runs = run_lengths >= MIN_RUN
+    # bytes that are not in a long run are literals
+    literal = np.repeat(~long_runs, run_lengths)
+    run_starts, run_lengths = _split(run_starts[long_runs], run_lengths[long_runs],
+                                     MAX_RUN)
+    # leftover bytes of a long run are too short to be worth a run
+    leftover = run_lengths < MIN_RUN
+    for index in range(MIN_RUN - 1):
+        literal[run_starts[leftover & (run_lengths > index)] + index] = True
+    run_starts, run_lengths = run_starts[~leftover], run_lengths[~leftover]
+
+    # literal spans end at the end of a row
+    before = np.zeros(size, dtype=bool)
+    before[1:] = literal[:-1]
+    before[::width] = False
+    after = np.zeros(size, dtype=bool)
+    after[:-1] = literal[1:]
+    after[width - 1::width] = False
+    literal_starts = np.flatnonzero(literal & ~before)
+    literal_starts, literal_lengths = _split(
+        literal_starts, np.flatnonzero(literal & ~after) + 1 - literal_starts,
+        MAX_LITERAL)
+
+    # each scanline starts with a header, then each span with its code in the order of
+    # the bytes they encode
+    header_starts = np.arange(0, size, width * 4)
+    starts = np.concatenate([header_starts, run_starts, literal_starts])
+    kinds = np.repeat([0, 1, 2], [header_starts.size, run_starts.size,
+                                  literal_starts.size])
+    sizes = np.concatenate([np.full(header_starts.size, 4), np.full(run_starts.size, 2),
+                            literal_lengths + 1])
+    order = np.lexsort((kinds, starts))
+    positions = np.empty(order.size, dtype=np.int64)
+    positions[order] = np.cumsum(sizes[order]) - sizes[order]
+    header_pos, run_pos, literal_pos = np.split(
+        positions, [header_starts.size, header_starts.size + run_starts.size])
+
+    out = np.empty(int(sizes.sum()), dtype=np.uint8)
+    payload = np.ones(out.size, dtype=bool)
+    for index, value in enumerate((2, 2, width >> 8, width & 255)):
+        out[header_pos + index] = value
+        payload[header_pos + index] = False
+    out[run_pos] = 128 + run_lengths
+    out[run_pos + 1] = flat[run_starts]
+    out[literal_pos] = literal_lengths
+    payload[run_pos] = payload[run_pos + 1] = payload[literal_pos] = False
+    out[payload] = flat[literal]
+    return out.tobytes()
+
+
+def encode_hdr(data: np.ndarray, header: Optional[HDRHeader] = None) -> bytes:
+    """Encode RGB values as a run-length encoded Radiance picture.
+
+    args:
+        data: An array of shape (height, width, 3) with the top row first.
+        header: Optional HDRHeader. Its lines are written to the new picture.
+
+    returns:
+        Content of an .HDR file as bytes.
+    """
+    height, width = data.shape[:2]
+    lines = header.lines if header else []
+
+    out = bytearray(b'#?RADIANCE\n')
+    for line in lines:
+        out += f'{line}\n'.encode('utf-8')
+    out += f'FORMAT={RGBE_FORMAT}\n\n-Y {height} +X {width}\n'.encode('utf-8')
+
+    rgbe = float_to_rgbe(data)
+    if MIN_RLE_WIDTH <= width <= MAX_RLE_WIDTH:
+        out += _encode_rle(rgbe)
+    else:
+        out += rgbe.tobytes()
+
+    return bytes(out)
+
+
+def write_hdr(hdr_path: Union[str, Path], data: np.ndarray,
+              header: Optional[HDRHeader] = None) -> Path:
+    """Write RGB values to a Radiance picture.
+
+    args:
+        hdr_path: Path to the .HDR file.
+        data: An array of shape (height, width, 3) with the top row first.
+        header: Optional HDRHeader to write with the picture.
+
+    returns:
+        Path to the written file.
+    """
+    hdr_path = Path(hdr_path)
+    hdr_path.write_bytes(encode_hdr(data, header))
+    return hdr_path
+
+
+def tone_map(data: np.ndarray, stops: float = 0, gamma: float = 2.2) -> np.ndarray:
+    """Map RGB values to 8-bit display values the same way ra_gif does.
+
+    args:
+        data: An array of shape (height, width, 3).
+        stops: Exposure adjustment in f-stops. Same as the -e option of ra_gif.
+        gamma: Display gamma. Same as the -g option of ra_gif.
+
+    returns:
+        An uint8 array of shape (height, width, 3).
+    """
+    scaled = np.maximum(data, 0) * np.float32(2 ** stops)
+    display = np.floor(256 * np.power(scaled, np.float32(1 / gamma)))
+    return np.clip(display, 0, 255).astype(np.uint8)
+
+
+def encode_preview(data: np.ndarray, image_format: str = 'PNG', stops: float = 0,
+                   gamma: float = 2.2) -> bytes:
+    """Tone map RGB values and encode them as an image in memory.
+
+    args:
+        data: An array of shape (height, width, 3).
+        image_format: Any image format that Pillow can write. Example is PNG, WEBP
+            or GIF.
+        stops: Exposure adjustment in f-stops.
+        gamma: Display gamma.
+
+    returns:
+        The encoded image as bytes.
+    """
+    from PIL import Image
+
+    image = Image.fromarray(tone_map(data, stops, gamma), 'RGB')
+    if image_format.upper() == 'GIF':
+        image = image.quantize(256, dither=Image.FLOYDSTEINBERG)
+
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format.upper())
+    return buffer.getvalue()
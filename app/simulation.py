@@ -1,17 +1,39 @@
 """Helper functions to schedule runs on Pollination."""
 import streamlit as st
+import os
 import shutil
+import threading
+import time
+import zlib
 
+import requests
+from requests.adapters import HTTPAdapter
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from enum import Enum
+from io import BytesIO
 from zipfile import ZipFile
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Union
 
-from pollination_streamlit.api.client import ApiClient
+from pollination_streamlit.api.client import ApiClient, DEFAULT_HOST
 from pollination_streamlit.interactors import Job
-from pollination_streamlit.api.client import ApiClient
-from pollination_streamlit.interactors import NewJob, Recipe
+from pollination_streamlit.interactors import NewJob, Recipe, Run
 from queenbee.job.job import JobStatusEnum
 
+from artifact import ModelArtifact
+from cache import hash_file
+from tracing import span
+
+
+# recipe arguments that the app uses for every run of point-in-time-view
+RECIPE_DEFAULTS = {
+    'metric': 'luminance',
+    'resolution': 800,
+    'radiance-parameters': '-ab 2 -aa 0.25 -ad 512 -ar 16'
+}
+
 
 class SimStatus(Enum):
     NOTSTARTED = 0
@@ -21,6 +43,91 @@ class SimStatus(Enum):
     CANCELLED = 4
 
 
+# number of bytes to read and write at a time when downloading outputs
+CHUNK_SIZE = 1024 * 1024
+# seconds to wait for the server to respond when downloading outputs
+DOWNLOAD_TIMEOUT = 60
+
+# statuses after which a job does not change anymore
+FINAL_STATUSES = (SimStatus.COMPLETE, SimStatus.FAILED, SimStatus.CANCELLED)
+
+
+class PooledApiClient(ApiClient):
+    """An ApiClient that keeps its HTTP connections open between requests.
+
+    The base ApiClient creates a new requests Session for every request. This client
+    reuses one Session for the API and one for the signed artifact URLs so the TCP and
+    TLS connections are pooled.
+
+    args:
+        host: URL of the Pollination API.
+        api_token: Pollination API key.
+        pool_size: Maximum number of connections to keep open per host.
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, api_token: str = None,
+                 pool_size: int = 16) -> None:
+        super().__init__(host=host, api_token=api_token)
+        self._session = self._pooled_session(pool_size)
+        self._session.headers.update(self.headers)
+        # signed URLs must not receive the API key
+        self._download_session = self._pooled_session(pool_size)
+
+    @staticmethod
+    def _pooled_session(pool_size: int) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        return self._session
+
+    @property
+    def download_session(self) -> requests.Session:
+        return self._download_session
+
+    def download_artifact(self, signed_url: str) -> BytesIO:
+        res = self._download_session.get(signed_url)
+        res.raise_for_status()
+        return BytesIO(res.content)
+
+
+_API_CLIENTS: Dict[str, PooledApiClient] = {}
+_API_CLIENTS_LOCK = threading.Lock()
+
+
+def get_api_client(api_key: str) -> PooledApiClient:
+    """Get the process-wide API client for an API key.
+
+    The same client is shared by all the reruns and sessions that use the same key.
+    """
+    with _API_CLIENTS_LOCK:
+        if api_key not in _API_CLIENTS:
+            _API_CLIENTS[api_key] = PooledApiClient(api_token=api_key)
+        return _API_CLIENTS[api_key]
+
+
+def model_file(model: Union[Path, ModelArtifact]) -> Path:
+    """Get the model file to upload for a recipe."""
+    if isinstance(model, ModelArtifact):
+        return model.hbjson_path
+    return Path(model)
+
+
+def model_folder(model: Union[Path, ModelArtifact]) -> str:
+    """Get the name of the project folder to upload a model to.
+
+    The name is the content hash of the model so jobs that are submitted at the same
+    time to the same project never overwrite each other's model.
+    """
+    if isinstance(model, ModelArtifact):
+        return model.sha256
+    return hash_file(model)
+
+
 def create_job(recipe_args: dict,
                project_owner: str,
                project_name: str,
@@ -35,7 +142,73 @@ def create_job(recipe_args: dict,
 
     Args:
         recipe_args: A dictionary of recipe arguments. Each of this dictionary
-            must match with the recipe arguments.
+            must match with the recipe arguments. The model can be a path to an
+            HBJSON or a ModelArtifact.
+        project_owner: Username on Pollination
+        project_name: Name of the project where this job will be run. Example is "demo"
+        simulation_name: Name of the simulation. This could be anything.
+        simulation_description: Description for the simulation. This could be anything.
+        recipe_name: Name of the recipe from Pollination. This must match exactly with
+            name of the recipe on Pollination.
+        recipe_tag: The version of the recipe you wish to use. Example is "latest".
+        recipe_owner: Owner of the recipe. Example is "ladybug-tools"
+        api_key: Pollination API key.
+
+    Returns:
+        A Job object to run on Pollination.
+    """
+    return create_runs_job([recipe_args], project_owner, project_name,
+                           simulation_name, simulation_description, recipe_name,
+                           recipe_tag, recipe_owner, api_key)
+
+
+def upload_artifacts(new_job: NewJob, artifacts: Dict[str, Path],
+                     max_workers: int = 4) -> Dict[str, str]:
+    """Upload several artifacts to a Pollination project at the same time.
+
+    args:
+        new_job: A NewJob object for the project where the artifacts are uploaded.
+        artifacts: A dictionary of a name to the path of the artifact. Each artifact
+            is uploaded to a folder with this name so files with the same name do not
+            overwrite each other.
+        max_workers: Maximum number of concurrent uploads.
+
+    returns:
+        A dictionary of the same names to the path of the uploaded artifact in the
+        project.
+    """
+    if not artifacts:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(artifacts))) as executor:
+        futures = {
+            name: executor.submit(new_job.upload_artifact, Path(path), name)
+            for name, path in artifacts.items()
+        }
+        return {name: future.result() for name, future in futures.items()}
+
+
+def create_runs_job(runs: List[dict],
+                    project_owner: str,
+                    project_name: str,
+                    simulation_name: str,
+                    simulation_description: str,
+                    recipe_name: str,
+                    recipe_tag: str,
+                    recipe_owner: str,
+                    api_key: str,
+                    max_uploads: int = 4
+                    ) -> NewJob:
+    """Create a single Job with one run for each dictionary of recipe arguments.
+
+    This is the only place where jobs are put together for Pollination. Each model
+    is uploaded once even if several runs use it, all the models are uploaded
+    concurrently and each one goes to the folder from model_folder. Arguments that a
+    run does not set are taken from RECIPE_DEFAULTS.
+
+    Args:
+        runs: A list of dictionaries of recipe arguments. The model of each run can
+            be a path to an HBJSON or a ModelArtifact.
         project_owner: Username on Pollination
         project_name: Name of the project where this job will be run. Example is "demo"
         simulation_name: Name of the simulation. This could be anything.
@@ -44,30 +217,91 @@ def create_job(recipe_args: dict,
             name of the recipe on Pollination.
         recipe_tag: The version of the recipe you wish to use. Example is "latest".
         recipe_owner: Owner of the recipe. Example is "ladybug-tools"
-        api_client: ApiClient object.
+        api_key: Pollination API key.
+        max_uploads: Maximum number of concurrent uploads.
 
     Returns:
         A Job object to run on Pollination.
     """
-    api_client: ApiClient = ApiClient(api_token=api_key)
+    api_client: ApiClient = get_api_client(api_key)
 
     recipe = Recipe(recipe_owner, recipe_name, recipe_tag, api_client)
 
     new_job = NewJob(project_owner, project_name, recipe, [],
                      simulation_name, simulation_description, api_client)
 
-    arguments = {}
-    model_path = new_job.upload_artifact(recipe_args['model'], '.')
-    arguments['model'] = model_path
-    arguments['sky'] = recipe_args['sky']
-    arguments['metric'] = 'luminance'
-    arguments['resolution'] = 800
-    arguments['radiance-parameters'] = '-ab 2 -aa 0.25 -ad 512 -ar 16'
+    folders, models = {}, {}
+    for run_arguments in runs:
+        model = run_arguments['model']
+        if id(model) not in folders:
+            folders[id(model)] = model_folder(model)
+            models[folders[id(model)]] = model_file(model)
+    model_paths = upload_artifacts(new_job, models, max_uploads)
+
+    arguments = []
+    for run_arguments in runs:
+        model_path = model_paths[folders[id(run_arguments['model'])]]
+        arguments.append(dict(RECIPE_DEFAULTS, **dict(run_arguments, model=model_path)))
 
-    new_job.arguments = [arguments]
+    new_job.arguments = arguments
     return new_job
 
 
+def create_batch_job(models: Union[Path, Dict[str, Path]],
+                     skies: List[str],
+                     project_owner: str,
+                     project_name: str,
+                     simulation_name: str,
+                     simulation_description: str,
+                     recipe_name: str,
+                     recipe_tag: str,
+                     recipe_owner: str,
+                     api_key: str,
+                     view_filters: List[str] = None,
+                     max_uploads: int = 4
+                     ) -> NewJob:
+    """Create a single Job that runs every combination of model, sky and views.
+
+    Every combination becomes one set of arguments, and therefore one run, of the
+    same job. See create_runs_job for how the models are uploaded.
+
+    Args:
+        models: Path to the HBJSON model or a dictionary of a design option name to
+            the path of its HBJSON model. Models can also be ModelArtifacts.
+        skies: A list of sky strings. Example is the output of sky.sky_strings.
+        project_owner: Username on Pollination
+        project_name: Name of the project where this job will be run. Example is "demo"
+        simulation_name: Name of the simulation. This could be anything.
+        simulation_description: Description for the simulation. This could be anything.
+        recipe_name: Name of the recipe from Pollination. This must match exactly with
+            name of the recipe on Pollination.
+        recipe_tag: The version of the recipe you wish to use. Example is "latest".
+        recipe_owner: Owner of the recipe. Example is "ladybug-tools"
+        api_key: Pollination API key.
+        view_filters: An optional list of view identifiers or patterns. Each one is
+            used as the view-filter argument of the recipe. Defaults to all the views.
+        max_uploads: Maximum number of concurrent uploads.
+
+    Returns:
+        A Job object to run on Pollination.
+    """
+    if not isinstance(models, dict):
+        models = {'.': models}
+
+    runs = []
+    for model in models.values():
+        for sky in skies:
+            for view_filter in view_filters or [None]:
+                run_arguments = {'model': model, 'sky': sky}
+                if view_filter:
+                    run_arguments['view-filter'] = view_filter
+                runs.append(run_arguments)
+
+    return create_runs_job(runs, project_owner, project_name, simulation_name,
+                           simulation_description, recipe_name, recipe_tag,
+                           recipe_owner, api_key, max_uploads)
+
+
 def request_status(job: Job) -> SimStatus:
     """Request status of a Job on Pollination.
 
@@ -106,7 +340,7 @@ def recreate_job(
     returns:
         A Pollination Job object created using the job_url and ApiClient.
     """
-    api_client: ApiClient = ApiClient(api_token=api_key)
+    api_client: ApiClient = get_api_client(api_key)
 
     url_split = job_url.split('/')
     job_id = url_split[-1]
@@ -116,6 +350,199 @@ def recreate_job(
     return Job(owner, project, job_id, api_client)
 
 
+def download_file(session: requests.Session, url: str, file_path: Path,
+                  chunk_size: int = CHUNK_SIZE) -> Path:
+    """Stream a file from a URL to disk and resume a previous partial download.
+
+    The content is written to a .part file next to the target. If a .part file
+    already exists only the missing bytes are requested. The ETag of the first
+    response is sent back with If-Range so the server sends the whole file again if
+    it has changed in between.
+
+    args:
+        session: A requests Session to download the file with.
+        url: URL of the file. Usually a signed URL.
+        file_path: Path to the file on disk.
+        chunk_size: Number of bytes to read and write at a time.
+
+    returns:
+        Path to the downloaded file.
+    """
+    part_path = file_path.with_name(f'{file_path.name}.part')
+    etag_path = file_path.with_name(f'{file_path.name}.etag')
+
+    headers = {}
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        if etag_path.exists():
+            headers['If-Range'] = etag_path.read_text()
+
+    with session.get(url, headers=headers, stream=True,
+                     timeout=DOWNLOAD_TIMEOUT) as res:
+        if res.status_code == 416:
+            # the partial file does not match the file on the server anymore
+            part_path.unlink()
+            return download_file(session, url, file_path, chunk_size)
+        res.raise_for_status()
+
+        resume = res.status_code == 206
+        if not resume and res.headers.get('ETag'):
+            etag_path.write_text(res.headers['ETag'])
+        with open(part_path, 'ab' if resume else 'wb') as f:
+            for chunk in res.iter_content(chunk_size):
+                f.write(chunk)
+
+    os.replace(part_path, file_path)
+    if etag_path.exists():
+        etag_path.unlink()
+    return file_path
+
+
+def _file_crc(file_path: Path, chunk_size: int = CHUNK_SIZE) -> int:
+    crc = 0
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def extract_members(zip_path: Path, output_folder: Path,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[Path]:
+    """Extract a zip file one member at a time.
+
+    Members that already exist in the output folder with the same size and CRC-32
+    are not extracted again. Files in the output folder that are not in the zip file
+    are removed once all the members are extracted.
+
+    args:
+        zip_path: Path to the zip file.
+        output_folder: Path to the folder where the members are extracted.
+        chunk_size: Number of bytes to read and write at a time.
+
+    returns:
+        An iterator of the paths to the files in the output folder. Each path is
+        yielded as soon as the file is ready.
+    """
+    output_folder.mkdir(parents=True, exist_ok=True)
+    root = output_folder.resolve()
+    members = set()
+
+    with ZipFile(zip_path) as zip_folder:
+        for info in zip_folder.infolist():
+            if info.is_dir():
+                continue
+            member_path = root.joinpath(info.filename).resolve()
+            if root not in member_path.parents:
+                raise ValueError(f'Invalid member in zip file: {info.filename}')
+            members.add(member_path)
+
+            if not member_path.exists() \
+                    or member_path.stat().st_size != info.file_size \
+                    or _file_crc(member_path, chunk_size) != info.CRC:
+                member_path.parent.mkdir(parents=True, exist_ok=True)
+                part_path = member_path.with_name(f'{member_path.name}.part')
+                with zip_folder.open(info) as source, open(part_path, 'wb') as target:
+                    shutil.copyfileobj(source, target, chunk_size)
+                os.replace(part_path, member_path)
+
+            yield member_path
+
+    for file_path in root.rglob('*'):
+        if file_path.is_file() and file_path not in members:
+            file_path.unlink()
+
+
+def job_run(job: Job, run_index: int = 0) -> Run:
+    """Get the run of a job that was submitted with the arguments at an index.
+
+    The runs of a Pollination job are listed by run ID and a failed run can be missing
+    from the list, so a run is found by the values of the parameters that tell the
+    runs of the job apart, such as the sky and the view filter, and never by its
+    position in the list.
+
+    args:
+        job: A Pollination Job object.
+        run_index: Index of the arguments of the run in the submitted job.
+
+    returns:
+        A Pollination Run object.
+    """
+    arguments = [
+        {argument.name: _argument_value(argument) for argument in run_arguments}
+        for run_arguments in job.spec.arguments or [[]]
+    ]
+    names = {name for run_arguments in arguments for name in run_arguments
+             if len({values.get(name) for values in arguments}) > 1}
+    wanted = {name: arguments[run_index].get(name) for name in names}
+
+    table = job.runs_dataframe.dataframe
+    for run_id, row in table.iterrows():
+        if all(_result_value(row, name) == value for name, value in wanted.items()):
+            return Run(job.owner, job.project, job.id, run_id, job.run_api.client)
+    raise ValueError(f'Run {run_index} of {job} is not in the results of the job. '
+                     'It may have failed.')
+
+
+def _argument_value(argument) -> Optional[str]:
+    """Get the value of a submitted argument or the path of an artifact as text."""
+    if hasattr(argument, 'value'):
+        return str(argument.value)
+    path = getattr(argument.source, 'path', None)
+    return None if path is None else str(path)
+
+
+def _result_value(row, name: str) -> Optional[str]:
+    """Get the value of an input of a row of the runs of a job as text."""
+    value = row.get(name)
+    if value is None or value != value:
+        # an input that the run was not submitted with is missing or NaN
+        return None
+    return str(value)
+
+
+def stream_output(job: Job, target_folder: Path, folder_name: str,
+                  output_name: str, run_index: int = 0) -> Iterator[Path]:
+    """Download output from a finished Job on Pollination one file at a time.
+
+    The zipped output is streamed to disk and can resume an interrupted download. A
+    complete download of the same run is not downloaded again and files that are
+    already extracted with the same checksum are not extracted again.
+
+    args:
+        job: A Pollination Job object.
+        target_folder: Path to the folder where the output will be downloaded.
+        folder_name: Name of the sub folder that will be created inside the target
+            folder.
+        output_name: Name of the output to download from a Pollination job. This you
+            find on recipe page on Pollination for the recipe you are using.
+        run_index: Index of the arguments of the run in the submitted job. Defaults to
+            the first run. See job_run.
+
+    returns:
+        An iterator of the paths to the output files as soon as each one is extracted.
+    """
+    run = job_run(job, run_index)
+    zip_path = target_folder.joinpath(f'{folder_name}_{run.id}.zip')
+
+    with span('download', output=output_name) as download:
+        if zip_path.exists():
+            download.set(cache='hit')
+        else:
+            download.set(cache='miss')
+            client = run.run_api.client
+            signed_url = client.get(
+                path=f'/projects/{run.owner}/{run.project}/runs/{run.id}/outputs/'
+                f'{output_name}'
+            )
+            session = client.download_session \
+                if isinstance(client, PooledApiClient) else requests.Session()
+            download_file(session, signed_url, zip_path)
+        download.set(bytes_out=zip_path)
+
+    yield from extract_members(zip_path, target_folder.joinpath(folder_name))
+
+
 @st.cache
 def download_output(job: Job, target_folder: Path, folder_name: str,
                     output_name: str) -> Path:
@@ -132,19 +559,168 @@ def download_output(job: Job, target_folder: Path, folder_name: str,
     returns:
         Path to the folder where the output is downloaded.
     """
+    for _ in stream_output(job, target_folder, folder_name, output_name):
+        pass
+
+    return target_folder.joinpath(folder_name)
+
 
-    output_folder = target_folder.joinpath(folder_name)
+@dataclass
+class _TrackedJob:
+    job: Optional[Job]
+    statuses: List[dict]
+    status: SimStatus = SimStatus.NOTSTARTED
+    interval: float = 0
+    next_poll: float = 0
+    error: Optional[str] = None
+    backend: Optional[object] = None
+    polls: int = 0
 
-    if not output_folder.exists():
-        output_folder.mkdir(parents=True, exist_ok=True)
-    else:
-        shutil.rmtree(output_folder)
-        output_folder.mkdir(parents=True, exist_ok=True)
 
-    run = job.runs[0]
+class JobPoller:
+    """Poll the status of many Pollination jobs on a background thread.
 
-    res = run.download_zipped_output(output_name)
-    with ZipFile(res) as zip_folder:
-        zip_folder.extractall(output_folder)
+    Each job is polled with exponential backoff. The interval is reset to the minimum
+    whenever the status changes. A job is untracked once its final status is written
+    to its statuses dictionaries, or read with status if it has none. Every session
+    that tracks the same job adds its own dictionary. Readers get the last known
+    status without a network call.
+
+    args:
+        min_interval: Seconds between polls right after a job is tracked or changes.
+        max_interval: Longest number of seconds between two polls of a job.
+        backoff: Factor that the interval grows by when the status does not change.
+    """
 
-    return output_folder
+    def __init__(self, min_interval: float = 5, max_interval: float = 120,
+                 backoff: float = 2) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self._jobs: Dict[str, _TrackedJob] = {}
+        self._lock = threading.Lock()
+        self._polled = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._thread = None
+
+    def track(self, job_url: str, api_key: str, statuses: dict = None,
+              backend: object = None) -> None:
+        """Start polling a job.
+
+        args:
+            job_url: Valid URL of a job on Pollination as a string.
+            api_key: Pollination API key.
+            statuses: Optional dictionary, usually kept in the Streamlit session state,
+                where the status of the job is written under job_url every time it
+                changes. The dictionaries of earlier calls for the same job are kept
+                and written to as well.
+            backend: Optional backend.Backend that runs the job. If provided, the
+                status is requested from the backend instead of Pollination.
+        """
+        with self._lock:
+            tracked = self._jobs.get(job_url)
+            if tracked:
+                if statuses is not None:
+                    if not any(other is statuses for other in tracked.statuses):
+                        tracked.statuses.append(statuses)
+                    statuses[job_url] = tracked.status
+                return
+            job = recreate_job(job_url, api_key) if backend is None else None
+            self._jobs[job_url] = _TrackedJob(
+                job, [statuses] if statuses is not None else [],
+                interval=self.min_interval, backend=backend)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='job-poller', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def untrack(self, job_url: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_url, None)
+
+    def status(self, job_url: str) -> SimStatus:
+        """Get the last known status of a job without a network call."""
+        with self._lock:
+            tracked = self._jobs.get(job_url)
+            if not tracked:
+                return SimStatus.NOTSTARTED
+            if tracked.status in FINAL_STATUSES:
+                self._jobs.pop(job_url)
+            return tracked.status
+
+    def poll_now(self, job_url: str, timeout: float = 0) -> SimStatus:
+        """Poll a job on the next cycle of the background thread.
+
+        args:
+            job_url: Valid URL of a tracked job on Pollination as a string.
+            timeout: Seconds to wait for the poll to finish. The default is to not
+                wait.
+
+        returns:
+            The status of the job after the poll, or the last known status if the
+            poll did not finish within the timeout.
+        """
+        with self._lock:
+            tracked = self._jobs.get(job_url)
+            if not tracked:
+                return SimStatus.NOTSTARTED
+            if tracked.status not in FINAL_STATUSES:
+                tracked.next_poll = 0
+                tracked.interval = self.min_interval
+                polls = tracked.polls
+                self._wake.set()
+                self._polled.wait_for(lambda: tracked.polls > polls, timeout)
+            return tracked.status
+
+    def _poll(self, job_url: str, tracked: _TrackedJob) -> None:
+        with span('poll', job=job_url) as poll:
+            try:
+                if tracked.backend is not None:
+                    status = tracked.backend.status(job_url)
+                else:
+                    tracked.job.refresh()
+                    status = request_status(tracked.job)
+                error = None
+            except Exception as e:
+                status, error = tracked.status, str(e)
+            poll.set(status=status.name, error=error)
+
+        with self._lock:
+            tracked.error = error
+            if status != tracked.status:
+                tracked.status = status
+                tracked.interval = self.min_interval
+                for statuses in tracked.statuses:
+                    statuses[job_url] = status
+            else:
+                tracked.interval = min(tracked.interval * self.backoff,
+                                       self.max_interval)
+            tracked.next_poll = time.monotonic() + tracked.interval
+            if status in FINAL_STATUSES and tracked.statuses and \
+                    self._jobs.get(job_url) is tracked:
+                # the final status is delivered and the job is never polled again
+                del self._jobs[job_url]
+            tracked.polls += 1
+            self._polled.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                due = [(url, tracked) for url, tracked in self._jobs.items()
+                       if tracked.status not in FINAL_STATUSES
+                       and tracked.next_poll <= now]
+                waiting = [tracked.next_poll for tracked in self._jobs.values()
+                           if tracked.status not in FINAL_STATUSES]
+
+            for url, tracked in due:
+                self._poll(url, tracked)
+
+            if not due:
+                timeout = max(min(waiting) - now, 0) if waiting else None
+                self._wake.wait(timeout)
+                self._wake.clear()
+
+
+JOB_POLLER = JobPoller()
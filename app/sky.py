@@ -0,0 +1,303 @@
+"""Select hours from an EPW and create climate-based skies for them in bulk."""
+from __future__ import annotations
+
+import threading
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Sequence
+
+import numpy as np
+
+from cache import hash_file
+
+if TYPE_CHECKING:
+    from honeybee_radiance.lightsource.sky import ClimateBased
+
+
+# EPW data columns that are kept in memory
+EPW_COLUMNS = {
+    'month': 1,
+    'day': 2,
+    'hour': 3,
+    'direct_normal_radiation': 14,
+    'diffuse_horizontal_radiation': 15,
+    'global_horizontal_illuminance': 16,
+    'direct_normal_illuminance': 17,
+    'diffuse_horizontal_illuminance': 18,
+}
+# northern hemisphere seasons as months. Winter is December, January and February
+SEASONS = {
+    'winter': (12, 1, 2),
+    'spring': (3, 4, 5),
+    'summer': (6, 7, 8),
+    'fall': (9, 10, 11)
+}
+
+
+@dataclass
+class EpwColumns:
+    """Location and hourly data of an EPW file as NumPy arrays.
+
+    The index of each value is the hour of the year in the same way as the data
+    collections of a Ladybug EPW.
+
+    args:
+        city: Name of the city.
+        latitude: Location latitude.
+        longitude: Location longitude.
+        time_zone: Location time zone.
+        data: A dictionary of column name to array. Keys are the keys of EPW_COLUMNS.
+    """
+    city: str
+    latitude: float
+    longitude: float
+    time_zone: float
+    data: dict
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.data[column]
+
+    def __len__(self) -> int:
+        return len(self.data['month'])
+
+
+def parse_epw(epw_path: Path) -> EpwColumns:
+    """Parse an EPW file into NumPy columns.
+
+    args:
+        epw_path: Path to the EPW file.
+
+    returns:
+        An EpwColumns object.
+    """
+    with open(epw_path, 'r', encoding='utf-8', errors='replace') as f:
+        location = f.readline().strip().split(',')
+        for _ in range(7):
+            f.readline()
+        values = np.loadtxt(f, delimiter=',', usecols=list(EPW_COLUMNS.values()),
+                            ndmin=2)
+
+    # all the kept columns are integer fields that Ladybug rounds on import
+    data = {name: np.rint(values[:, count]).astype(np.int64)
+            for count, name in enumerate(EPW_COLUMNS)}
+
+    return EpwColumns(location[1], float(location[6]), float(location[7]),
+                      float(location[8]), data)
+
+
+class EpwCache:
+    """A process-wide LRU cache of parsed EPW files keyed by the hash of the file.
+
+    args:
+        max_size: Maximum number of EPW files to keep in memory.
+    """
+
+    def __init__(self, max_size: int = 32) -> None:
+        self.max_size = max_size
+        self._columns = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, epw_path: Path, epw_hash: str) -> EpwColumns:
+        with self._lock:
+            if epw_hash in self._columns:
+                self._columns.move_to_end(epw_hash)
+                return self._columns[epw_hash]
+
+        columns = parse_epw(epw_path)
+
+        with self._lock:
+            self._columns[epw_hash] = columns
+            while len(self._columns) > self.max_size:
+                self._columns.popitem(last=False)
+        return columns
+
+
+EPW_CACHE = EpwCache()
+
+
+def load_epw(epw_path: Path, epw_hash: str = None) -> EpwColumns:
+    """Get the parsed columns of an EPW file from the cache or parse it if needed.
+
+    args:
+        epw_path: Path to the EPW file.
+        epw_hash: Optional SHA-256 hash of the EPW file. It is calculated from the file
+            if not provided.
+
+    returns:
+        An EpwColumns object.
+    """
+    return EPW_CACHE.get(epw_path, epw_hash or hash_file(epw_path))
+
+
+def brightest_hours(columns: EpwColumns, count: int = 1,
+                    column: str = 'direct_normal_illuminance') -> np.ndarray:
+    """Get the hours of the year with the highest values.
+
+    args:
+        columns: An EpwColumns object.
+        count: Number of hours to return.
+        column: Name of the column to sort the hours by.
+
+    returns:
+        An array of hours of the year from the highest value to the lowest. Hours with
+        the same value are in chronological order.
+    """
+    values = columns[column]
+    count = min(count, len(values))
+    candidates = np.argpartition(-values, count - 1)[:count]
+    # sort by value and then by hour so ties match a chronological scan
+    return candidates[np.lexsort((candidates, -values[candidates]))]
+
+
+def representative_hours(columns: EpwColumns, period: str = 'month',
+                         column: str = 'direct_normal_illuminance',
+                         statistic: str = 'max') -> np.ndarray:
+    """Get one representative hour for each month or season.
+
+    args:
+        columns: An EpwColumns object.
+        period: Either month or season.
+        column: Name of the column to pick the hours by.
+        statistic: Either max to pick the hour with the highest value in each period
+            or median to pick the daylit hour that is closest to the median of the
+            daylit hours in each period.
+
+    returns:
+        An array of hours of the year with one hour for each period.
+    """
+    months = columns['month']
+    if period == 'month':
+        groups = np.arange(1, 13)[:, None] == months[None, :]
+    elif period == 'season':
+        groups = np.stack([np.isin(months, season) for season in SEASONS.values()])
+    else:
+        raise ValueError(f'period must be month or season. Got: {period}')
+
+    values = columns[column]
+    if statistic == 'max':
+        scores = np.where(groups, values.astype(np.float64), -np.inf)
+    elif statistic == 'median':
+        daylit = groups & (values > 0)
+        masked = np.where(daylit, values, np.nan)
+        with np.errstate(all='ignore'):
+            median = np.nanmedian(masked, axis=1, keepdims=True)
+        scores = np.where(daylit, -np.abs(values - median), -np.inf)
+    else:
+        raise ValueError(f'statistic must be max or median. Got: {statistic}')
+
+    valid = np.isfinite(scores).any(axis=1)
+    return np.argmax(scores, axis=1)[valid]
+
+
+def daylit_hours(columns: EpwColumns, threshold: float = 0,
+                 column: str = 'global_horizontal_illuminance') -> np.ndarray:
+    """Get all the hours of the year with a value above a threshold.
+
+    args:
+        columns: An EpwColumns object.
+        threshold: Hours with values larger than this are returned.
+        column: Name of the column to compare with the threshold.
+
+    returns:
+        An array of hours of the year in chronological order.
+    """
+    return np.flatnonzero(columns[column] > threshold)
+
+
+def sun_vectors(columns: EpwColumns, hours: Sequence[int],
+                north_angle: float = 0) -> np.ndarray:
+    """Get the direction to the sun for many hours of the year in one pass.
+
+    This uses the NOAA approximation of the solar position, which is within a degree
+    of the sun path of Ladybug. Times are local standard time at
+    the start of each hour in the same way as climate_based_skies.
+
+    args:
+        columns: An EpwColumns object.
+        hours: A list of hours of the year.
+        north_angle: Counter clockwise rotation of the North vector in degrees.
+
+    returns:
+        An array of shape (len(hours), 3) with unit vectors from the model to the sun
+        in model coordinates. The z value is negative when the sun is below the
+        horizon.
+    """
+    hours = np.asarray(hours, dtype=np.float64)
+    day = np.floor(hours / 24)
+    hour = hours - day * 24
+    gamma = 2 * np.pi / 365 * (day + (hour - 12) / 24)
+    equation_of_time = 229.18 * (
+        0.000075 + 0.001868 * np.cos(gamma) - 0.032077 * np.sin(gamma)
+        - 0.014615 * np.cos(2 * gamma) - 0.040849 * np.sin(2 * gamma))
+    declination = (
+        0.006918 - 0.399912 * np.cos(gamma) + 0.070257 * np.sin(gamma)
+        - 0.006758 * np.cos(2 * gamma) + 0.000907 * np.sin(2 * gamma)
+        - 0.002697 * np.cos(3 * gamma) + 0.00148 * np.sin(3 * gamma))
+
+    solar_minutes = hour * 60 + equation_of_time + 4 * columns.longitude \
+        - 60 * columns.time_zone
+    hour_angle = np.radians(solar_minutes / 4 - 180)
+    latitude = np.radians(columns.latitude)
+
+    east = -np.cos(declination) * np.sin(hour_angle)
+    north = np.sin(declination) * np.cos(latitude) - \
+        np.cos(declination) * np.sin(latitude) * np.cos(hour_angle)
+    up = np.sin(declination) * np.sin(latitude) + \
+        np.cos(declination) * np.cos(latitude) * np.cos(hour_angle)
+
+    # rotate the North vector counter clockwise from the y axis of the model
+    angle = np.radians(north_angle)
+    x = east * np.cos(angle) - north * np.sin(angle)
+    y = east * np.sin(angle) + north * np.cos(angle)
+    return np.stack([x, y, up], axis=-1)
+
+
+def sky_string(sky: ClimateBased) -> str:
+    """Get the climate-based sky string that the point-in-time-view recipe takes."""
+    return f'climate-based -alt {sky.altitude} -az {sky.azimuth} -dni {sky.direct_normal_irradiance}'\
+        f' -dhi {sky.diffuse_horizontal_irradiance} -g {sky.ground_reflectance} '
+
+
+def climate_based_skies(columns: EpwColumns, hours: Sequence[int],
+                        north_angle: float = 0) -> List[ClimateBased]:
+    """Create a climate-based sky for each hour of the year.
+
+    args:
+        columns: An EpwColumns object.
+        hours: A list of hours of the year.
+        north_angle: Counter clockwise rotation of the North vector in degrees.
+
+    returns:
+        A list of ClimateBased skies.
+    """
+    from ladybug.dt import DateTime
+    from honeybee_radiance.lightsource.sky import ClimateBased
+
+    skies = []
+    for hoy in np.asarray(hours, dtype=np.int64).tolist():
+        dt = DateTime.from_hoy(hoy)
+        skies.append(ClimateBased.from_lat_long(
+            columns.latitude, columns.longitude, columns.time_zone,
+            dt.month, dt.day, dt.hour,
+            int(columns['direct_normal_radiation'][hoy]),
+            int(columns['diffuse_horizontal_radiation'][hoy]),
+            north_angle
+        ))
+    return skies
+
+
+def sky_strings(columns: EpwColumns, hours: Sequence[int],
+                north_angle: float = 0) -> List[str]:
+    """Create climate-based sky strings for many hours of the year.
+
+    args:
+        columns: An EpwColumns object.
+        hours: A list of hours of the year.
+        north_angle: Counter clockwise rotation of the North vector in degrees.
+
+    returns:
+        A list of sky strings in the same format as helper.get_sky.
+    """
+    return [sky_string(sky) for sky in climate_based_skies(columns, hours, north_angle)]
@@ -0,0 +1,6 @@
+"""The modules of the app are imported by name in the same way as the app does."""
+import sys
+
+from pathlib import Path
+
+sys.path.insert(0, Path(__file__).parents[1].as_posix())
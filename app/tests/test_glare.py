@@ -0,0 +1,83 @@
+import math
+
+import numpy as np
+import pytest
+
+from glare import _label_sources, evaluate_glare, fisheye_geometry
+
+
+def reference_labels(mask: np.ndarray) -> np.ndarray:
+    """Label 4-connected pixels with a flood fill in row-major order."""
+    height, width = mask.shape
+    labels = np.full(mask.shape, -1, dtype=np.int64)
+    count = 0
+    for row in range(height):
+        for column in range(width):
+            if not mask[row, column] or labels[row, column] >= 0:
+                continue
+            labels[row, column] = count
+            stack = [(row, column)]
+            while stack:
+                y, x = stack.pop()
+                for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                    if 0 <= ny < height and 0 <= nx < width and mask[ny, nx] and \
+                            labels[ny, nx] < 0:
+                        labels[ny, nx] = count
+                        stack.append((ny, nx))
+            count += 1
+    return labels
+
+
+def label_image(mask: np.ndarray) -> np.ndarray:
+    labels = np.full(mask.size, -1, dtype=np.int64)
+    pixels, pixel_labels = _label_sources(mask)
+    labels[pixels] = pixel_labels
+    return labels.reshape(mask.shape)
+
+
+@pytest.mark.parametrize('seed, density', [(0, 0.3), (1, 0.5), (2, 0.6), (3, 0.9)])
+def test_label_sources_random(seed, density):
+    mask = np.random.default_rng(seed).random((40, 57)) < density
+    np.testing.assert_array_equal(label_image(mask), reference_labels(mask))
+
+
+def test_label_sources_shapes():
+    # a U shape that joins two columns in its last row, a hook, and diagonal pixels
+    # that are separate sources
+    mask = np.array([
+        [1, 0, 1, 0, 1, 1, 1, 1],
+        [1, 0, 1, 0, 1, 0, 0, 1],
+        [1, 1, 1, 0, 1, 0, 1, 1],
+        [0, 0, 0, 0, 1, 0, 0, 0],
+        [1, 0, 1, 0, 1, 1, 1, 1],
+        [0, 1, 0, 1, 0, 0, 0, 0],
+    ], dtype=bool)
+    np.testing.assert_array_equal(label_image(mask), reference_labels(mask))
+    assert label_image(np.zeros((3, 4), dtype=bool)).max() == -1
+
+
+@pytest.mark.parametrize('size', [200, 401])
+def test_uniform_luminance(size):
+    lum = np.full((size, size), 1000, dtype=np.float32)
+    result = evaluate_glare(lum)
+
+    # a uniform sky of luminance L gives an illuminance of pi * L on any plane
+    assert result.vertical_illuminance == pytest.approx(math.pi * 1000, rel=0.01)
+    assert result.average_luminance == pytest.approx(1000, rel=1e-3)
+    assert result.source_count == 0
+
+
+def test_solid_angle_of_hemisphere():
+    _, solid_angle, _ = fisheye_geometry(300, 300)
+    assert solid_angle.sum() == pytest.approx(2 * math.pi, rel=0.01)
+
+
+def test_default_threshold():
+    lum = np.full((200, 200), 1000, dtype=np.float32)
+    lum[90:110, 120:140] = 5000
+
+    result = evaluate_glare(lum)
+    assert result.threshold == 2000
+    assert result.source_count == 1
+    # a factor of the average luminance finds the same source
+    assert evaluate_glare(lum, threshold=3).source_count == 1
@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from rgbe import MAX_LITERAL, MAX_RUN, _decode_rle, _encode_rle, decode_hdr, \
+    encode_hdr, float_to_rgbe, read_hdr, rgbe_to_float
+
+
+SAMPLE_HDR = Path(__file__).parents[1].joinpath('assets', 'sample.HDR')
+
+
+def reference_decode(buf: bytes, width: int, height: int) -> np.ndarray:
+    """Decode new-style run-length encoded scanlines one byte at a time."""
+    rgbe = np.empty((height, width, 4), dtype=np.uint8)
+    pos = 0
+    for row in range(height):
+        assert list(buf[pos:pos + 4]) == [2, 2, width >> 8, width & 255]
+        pos += 4
+        for component in range(4):
+            column = 0
+            while column < width:
+                code = buf[pos]
+                if code > 128:
+                    rgbe[row, column:column + code - 128, component] = buf[pos + 1]
+                    column += code - 128
+                    pos += 2
+                else:
+                    rgbe[row, column:column + code, component] = \
+                        list(buf[pos + 1:pos + 1 + code])
+                    column += code
+                    pos += code + 1
+            assert column == width
+    assert pos == len(buf)
+    return rgbe
+
+
+def scanlines(height: int, width: int, seed: int = 0) -> np.ndarray:
+    """RGBE pixels with noise, long runs, short runs and runs across rows. The
+    height must be at least 6."""
+    rng = np.random.default_rng(seed)
+    rgbe = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    rgbe[0] = 7
+    rgbe[1, :MAX_RUN + 5] = 200
+    rgbe[2, ::2] = 9
+    for length in range(1, 6):
+        rgbe[3 + length % (height - 3), length * 10:length * 11] = length
+    rgbe[-1, :, 3] = 128
+    return rgbe
+
+
+@pytest.mark.parametrize('height, width', [
+    (6, 8), (6, 9), (8, MAX_RUN + MAX_LITERAL + 3), (7, 3 * MAX_LITERAL + 1)
+])
+def test_rle_round_trip(height, width):
+    rgbe = scanlines(height, width)
+    buf = _encode_rle(rgbe)
+
+    np.testing.assert_array_equal(reference_decode(buf, width, height), rgbe)
+    decoded, _ = _decode_rle(buf, 0, width, height)
+    np.testing.assert_array_equal(decoded, rgbe)
+
+
+def test_hdr_round_trip():
+    data, header = read_hdr(SAMPLE_HDR)
+    decoded, decoded_header = decode_hdr(encode_hdr(data, header))
+
+    np.testing.assert_array_equal(decoded, rgbe_to_float(float_to_rgbe(data)))
+    assert decoded_header.exposure == header.exposure
+    assert decoded_header.view == header.view
@@ -0,0 +1,361 @@
+"""Lightweight tracing of the stages of the app.
+
+Tracing is off unless the VIZAN_TRACE_FILE or the VIZAN_METRICS_FILE environment
+variable is set. Spans are written as JSON lines to VIZAN_TRACE_FILE and aggregated
+into a Prometheus text file at VIZAN_METRICS_FILE that a local scraper, such as the
+textfile collector of the node exporter, can read.
+
+When tracing is off a span is a shared object that does nothing and traced functions
+are called after a single check of a flag.
+"""
+import atexit
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+
+from concurrent.futures import Executor, Future
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+
+# upper bounds in seconds of the buckets of the duration histograms
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+# seconds between two writes of the metrics file
+METRICS_INTERVAL = 5
+
+
+class Span:
+    """A timed stage of the app.
+
+    args:
+        name: Name of the stage.
+        attributes: Any other values to record with the span.
+    """
+    __slots__ = ('name', 'span_id', 'parent_id', 'session', 'start', 'duration',
+                 'bytes_in', 'bytes_out', 'cache', 'error', 'attributes', '_token',
+                 '_started')
+
+    def __init__(self, name: str, **attributes) -> None:
+        self.name = name
+        self.span_id = None
+        self.parent_id = None
+        self.session = None
+        self.start = None
+        self.duration = None
+        self.bytes_in = None
+        self.bytes_out = None
+        self.cache = None
+        self.error = None
+        self.attributes = {}
+        self._token = None
+        self._started = None
+        self.set(**attributes)
+
+    def set(self, bytes_in=None, bytes_out=None, cache: str = None,
+            **attributes) -> None:
+        """Record values on the span.
+
+        args:
+            bytes_in: Size of the input in bytes or a path to the input file.
+            bytes_out: Size of the output in bytes or a path to the output file.
+            cache: Cache result of the stage. Usually hit or miss.
+            attributes: Any other values to record with the span.
+        """
+        if bytes_in is not None:
+            self.bytes_in = _size(bytes_in)
+        if bytes_out is not None:
+            self.bytes_out = _size(bytes_out)
+        if cache is not None:
+            self.cache = cache
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> 'Span':
+        parent = _CURRENT_SPAN.get()
+        self.span_id = f'{os.getpid():x}-{next(_SPAN_IDS):x}'
+        self.parent_id = parent.span_id if parent else None
+        self.session = _SESSION.get()
+        self._token = _CURRENT_SPAN.set(self)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.duration = time.perf_counter() - self._started
+        _CURRENT_SPAN.reset(self._token)
+        if exc_value is not None:
+            self.error = f'{exc_type.__name__}: {exc_value}'
+        TRACER.finish(self.to_dict())
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name, 'span_id': self.span_id, 'parent_id': self.parent_id,
+            'session': self.session, 'start': self.start, 'duration': self.duration,
+            'bytes_in': self.bytes_in, 'bytes_out': self.bytes_out,
+            'cache': self.cache, 'error': self.error, 'attributes': self.attributes
+        }
+
+
+class _NoopSpan:
+    """A span that does nothing. It is used when tracing is off."""
+    __slots__ = ()
+
+    def set(self, *args, **kwargs) -> None:
+        pass
+
+    def __enter__(self) -> '_NoopSpan':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_CURRENT_SPAN: ContextVar = ContextVar('vizan_span', default=None)
+_SESSION: ContextVar = ContextVar('vizan_session', default=None)
+_COLLECTED: ContextVar = ContextVar('vizan_collected', default=None)
+_SPAN_IDS = itertools.count(1)
+
+
+def _size(value) -> Optional[int]:
+    if isinstance(value, (str, Path)):
+        try:
+            return os.stat(value).st_size
+        except OSError:
+            return None
+    return int(value)
+
+
+@dataclass
+class _StageMetrics:
+    count: int = 0
+    errors: int = 0
+    duration: float = 0
+    buckets: List[int] = field(default_factory=lambda: [0] * len(DURATION_BUCKETS))
+    bytes_in: int = 0
+    bytes_out: int = 0
+    cache: Dict[str, int] = field(default_factory=dict)
+
+
+class Tracer:
+    """Export finished spans as JSON lines and as Prometheus metrics.
+
+    args:
+        trace_file: Optional path to the JSON lines file. Spans are appended to it.
+        metrics_file: Optional path to the Prometheus text file. It is rewritten at
+            most every METRICS_INTERVAL seconds and when the process exits.
+    """
+
+    def __init__(self, trace_file: Path = None, metrics_file: Path = None) -> None:
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._metrics: Dict[str, _StageMetrics] = {}
+        self._last_write = 0
+        self._trace = None
+        self.configure(trace_file, metrics_file)
+        atexit.register(self.flush)
+
+    def configure(self, trace_file: Path = None, metrics_file: Path = None) -> None:
+        """Set the export files. Tracing is off if neither is provided."""
+        with self._lock:
+            if self._trace:
+                self._trace.close()
+            self.trace_file = Path(trace_file) if trace_file else None
+            self.metrics_file = Path(metrics_file) if metrics_file else None
+            self._trace = open(self.trace_file, 'a', buffering=1) \
+                if self.trace_file else None
+            self.enabled = bool(self.trace_file or self.metrics_file)
+
+    def finish(self, record: dict) -> None:
+        """Export a finished span."""
+        collected = _COLLECTED.get()
+        if collected is not None:
+            collected.append(record)
+            return
+
+        write = False
+        with self._lock:
+            if self._trace:
+                self._trace.write(json.dumps(record, default=str) + '\n')
+            if self.metrics_file:
+                self._aggregate(record)
+                write = time.monotonic() - self._last_write >= METRICS_INTERVAL
+        if write:
+            self.flush()
+
+    def _aggregate(self, record: dict) -> None:
+        metrics = self._metrics.setdefault(record['name'], _StageMetrics())
+        metrics.count += 1
+        metrics.errors += 1 if record['error'] else 0
+        metrics.duration += record['duration']
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if record['duration'] <= bound:
+                metrics.buckets[index] += 1
+        metrics.bytes_in += record['bytes_in'] or 0
+        metrics.bytes_out += record['bytes_out'] or 0
+        if record['cache']:
+            metrics.cache[record['cache']] = metrics.cache.get(record['cache'], 0) + 1
+
+    def metrics_text(self) -> str:
+        """Get the aggregated metrics in the Prometheus text format."""
+        lines = [
+            '# HELP vizan_stage_duration_seconds Duration of the stages of the app.',
+            '# TYPE vizan_stage_duration_seconds histogram'
+        ]
+        with self._lock:
+            metrics = {name: _StageMetrics(
+                stage.count, stage.errors, stage.duration, list(stage.buckets),
+                stage.bytes_in, stage.bytes_out, dict(stage.cache))
+                for name, stage in sorted(self._metrics.items())}
+
+        for name, stage in metrics.items():
+            for bound, count in zip(DURATION_BUCKETS, stage.buckets):
+                lines.append(f'vizan_stage_duration_seconds_bucket{{stage="{name}",'
+                             f'le="{bound}"}} {count}')
+            lines.append(f'vizan_stage_duration_seconds_bucket{{stage="{name}",'
+                         f'le="+Inf"}} {stage.count}')
+            lines.append(f'vizan_stage_duration_seconds_sum{{stage="{name}"}} '
+                         f'{stage.duration}')
+            lines.append(f'vizan_stage_duration_seconds_count{{stage="{name}"}} '
+                         f'{stage.count}')
+
+        for metric, help_text, attribute in (
+                ('vizan_stage_errors_total', 'Stages that raised an error.', 'errors'),
+                ('vizan_stage_bytes_in_total', 'Bytes read by the stages.', 'bytes_in'),
+                ('vizan_stage_bytes_out_total', 'Bytes written by the stages.',
+                 'bytes_out')):
+            lines.extend([f'# HELP {metric} {help_text}', f'# TYPE {metric} counter'])
+            for name, stage in metrics.items():
+                lines.append(f'{metric}{{stage="{name}"}} {getattr(stage, attribute)}')
+
+        lines.extend([
+            '# HELP vizan_stage_cache_total Cache results of the stages.',
+            '# TYPE vizan_stage_cache_total counter'
+        ])
+        for name, stage in metrics.items():
+            for result, count in sorted(stage.cache.items()):
+                lines.append(f'vizan_stage_cache_total{{stage="{name}",'
+                             f'result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self) -> None:
+        """Write the metrics file now."""
+        if not self.metrics_file:
+            return
+        with self._flush_lock:
+            self._last_write = time.monotonic()
+            self.metrics_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.metrics_file.with_name(
+                f'{self.metrics_file.name}.{os.getpid()}.tmp')
+            temp_file.write_text(self.metrics_text())
+            os.replace(temp_file, self.metrics_file)
+
+
+TRACER = Tracer(os.environ.get('VIZAN_TRACE_FILE'),
+                os.environ.get('VIZAN_METRICS_FILE'))
+
+
+def enabled() -> bool:
+    """Check if tracing is on."""
+    return TRACER.enabled
+
+
+def span(name: str, **attributes):
+    """Get a span to use as a context manager around a stage.
+
+    args:
+        name: Name of the stage.
+        attributes: Any other values to record with the span. See Span.set.
+
+    returns:
+        A Span or a span that does nothing if tracing is off.
+    """
+    if not TRACER.enabled:
+        return NOOP_SPAN
+    return Span(name, **attributes)
+
+
+def current_span():
+    """Get the innermost open span or a span that does nothing."""
+    if not TRACER.enabled:
+        return NOOP_SPAN
+    return _CURRENT_SPAN.get() or NOOP_SPAN
+
+
+def annotate(**values) -> None:
+    """Record values on the innermost open span. See Span.set for the values."""
+    if TRACER.enabled:
+        current_span().set(**values)
+
+
+def traced(name: str) -> Callable:
+    """Decorate a function to record each call as a span.
+
+    args:
+        name: Name of the stage.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TRACER.enabled:
+                return func(*args, **kwargs)
+            with Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_session(session_id: str) -> None:
+    """Set the session that the spans of the current thread belong to."""
+    _SESSION.set(session_id)
+
+
+@dataclass
+class _Collected:
+    result: object
+    records: List[dict]
+    error: Optional[BaseException] = None
+
+
+def _collect(func: Callable, *args, **kwargs) -> _Collected:
+    """Call a function in a worker process and keep its spans for the parent."""
+    records = []
+    token = _COLLECTED.set(records)
+    try:
+        return _Collected(func(*args, **kwargs), records)
+    except Exception as error:
+        return _Collected(None, records, error)
+    finally:
+        _COLLECTED.reset(token)
+
+
+def submit_traced(executor: Executor, func: Callable, *args, **kwargs) -> Future:
+    """Submit a function to a process pool and keep the spans that it records.
+
+    Use traced_result to get the result of the future and export the spans in this process.
+    """
+    if not TRACER.enabled:
+        return executor.submit(func, *args, **kwargs)
+    return executor.submit(_collect, func, *args, **kwargs)
+
+
+def traced_result(future: Future):
+    """Get the result of a future from submit_traced and export the spans of the worker."""
+    value = future.result()
+    if not isinstance(value, _Collected):
+        return value
+
+    parent = _CURRENT_SPAN.get()
+    session = _SESSION.get()
+    for record in value.records:
+        if record['parent_id'] is None and parent:
+            record['parent_id'] = parent.span_id
+        record['session'] = record['session'] or session
+        TRACER.finish(record)
+    if value.error is not None:
+        raise value.error
+    return value.result
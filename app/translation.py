@@ -0,0 +1,216 @@
+"""Translate a Rhino file to a Honeybee model with layers split across processes."""
+from __future__ import annotations
+
+import os
+
+from concurrent.futures import Executor, ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
+
+if TYPE_CHECKING:
+    from honeybee.model import Model
+
+
+# Honeybee objects of a partition as faces, shades, apertures, doors and grids
+Objects = Tuple[list, list, list, list, list]
+# units, tolerance and angle tolerance of a Rhino file
+Settings = Tuple[str, float, float]
+# name of each translated layer with its number of faces, shades, apertures and doors
+LayerCounts = List[Tuple[str, Tuple[int, int, int, int]]]
+# keys of the faces, shades, apertures and doors in a Honeybee model dictionary
+MODEL_KEYS = ('orphaned_faces', 'orphaned_shades', 'orphaned_apertures',
+              'orphaned_doors')
+
+
+def partition_layers(layer_indices: List[int], weights: List[int],
+                     count: int) -> List[List[int]]:
+    """Split layers into groups of contiguous layers with a similar total weight.
+
+    Groups are contiguous so concatenating the objects of the groups in order gives
+    the same order as translating the layers one after another.
+
+    args:
+        layer_indices: Layer indices in the order of the layer table.
+        weights: Weight of each layer. Usually the number of objects on the layer.
+        count: Maximum number of groups.
+
+    returns:
+        A list of groups of layer indices without empty groups.
+    """
+    total = sum(weights)
+    if count <= 1 or total == 0:
+        return [list(layer_indices)] if layer_indices else []
+
+    step = total / count
+    partitions, current, cumulative = [], [], 0
+    for index, weight in zip(layer_indices, weights):
+        target = step * (len(partitions) + 1)
+        # close the group before this layer if that is closer to the target
+        if current and len(partitions) < count - 1 and \
+                cumulative + weight - target > target - cumulative:
+            partitions.append(current)
+            current = []
+        current.append(index)
+        cumulative += weight
+        if len(partitions) < count - 1 and \
+                cumulative >= step * (len(partitions) + 1):
+            partitions.append(current)
+            current = []
+    if current:
+        partitions.append(current)
+    return partitions
+
+
+def import_layers(rhino_file: str, config_path: str,
+                  layer_indices: List[int]) -> Tuple[Settings, Objects, LayerCounts]:
+    """Translate the objects of some layers in the same way as import_3dm.
+
+    The layers are translated with the same rules and in the same order as the
+    layer loop of honeybee-3dm with a config file. The objects are not changed. The
+    number of objects from each layer is returned instead so the viewer can split the
+    model by layer. This function runs in a worker process.
+
+    args:
+        rhino_file: Path to the Rhino file.
+        config_path: Path to the honeybee-3dm config file.
+        layer_indices: Indices of the layers to translate in the order of the layer
+            table.
+
+    returns:
+        A tuple with the unit system, tolerance and angle tolerance of the Rhino file,
+        a tuple of Honeybee faces, shades, apertures, doors and grids and the number
+        of faces, shades, apertures and doors of each translated layer.
+    """
+    from rhino3dm import File3dm
+    from honeybee_3dm.config import check_config
+    from honeybee_3dm.face import import_objects, import_objects_with_config
+    from honeybee_3dm.helper import get_unit_system, check_parent_in_config
+    from honeybee_3dm.layer import child_parent_dict, visible_layers
+
+    rh = File3dm.Read(rhino_file)
+    if not rh:
+        raise ValueError(f'Input Rhino file: {rhino_file} returns None object.')
+
+    config = check_config(rh, config_path)
+    tolerance = rh.Settings.ModelAbsoluteTolerance
+    settings = (get_unit_system(rh), tolerance, rh.Settings.ModelAngleToleranceDegrees)
+
+    child_to_parent = child_parent_dict(rh)
+    visible = {layer.Name for layer in visible_layers(rh)}
+
+    objects = ([], [], [], [], [])
+    counts = []
+    for index in layer_indices:
+        layer = rh.Layers[index]
+        if layer.Name in config['layers']:
+            hb_objs = import_objects_with_config(rh, layer, tolerance, config=config)
+        elif check_parent_in_config(rh, config, layer.Name,
+                                    child_to_parent[layer.Name]):
+            continue
+        elif layer.Name in visible:
+            hb_objs = (import_objects(rh, layer, tolerance=tolerance),)
+        else:
+            continue
+        for hb_list, hb_new in zip(objects, hb_objs):
+            hb_list.extend(hb_new)
+        # grids are not split by layer
+        counts.append((layer.Name, tuple(len(hb_new) for hb_new in hb_objs[:4])))
+
+    return settings, objects, counts
+
+
+def model_layers(counts: LayerCounts) -> Dict[str, List[Tuple[str, int]]]:
+    """Get the layers of the objects of a model from the counts of import_layers.
+
+    args:
+        counts: Number of objects of each layer in the order of the model.
+
+    returns:
+        A dictionary of model dictionary key, such as orphaned_faces, to a list of
+        layer name and number of consecutive objects of the layer. Layers without
+        objects of a type are left out.
+    """
+    layers = {key: [] for key in MODEL_KEYS}
+    for name, layer_counts in counts:
+        for key, count in zip(MODEL_KEYS, layer_counts):
+            if count:
+                layers[key].append((name, count))
+    return layers
+
+
+def import_3dm_parallel(rhino_file: Path, config_path: Path,
+                        partitions: List[List[int]], name: str = None,
+                        max_workers: int = None, executor: Executor = None,
+                        progress: Callable[[int, int], None] = None
+                        ) -> Tuple[Model, Dict[str, List[Tuple[str, int]]]]:
+    """Translate a Rhino file to a Honeybee model with a process for each partition.
+
+    The objects of the partitions are merged in the order of the partitions so the
+    model is the same as the model from import_3dm. Views are not added.
+
+    args:
+        rhino_file: Path to the Rhino file.
+        config_path: Path to the honeybee-3dm config file.
+        partitions: Groups of contiguous layer indices from partition_layers.
+        name: Identifier of the model. Defaults to the name of the Rhino file.
+        max_workers: Maximum number of worker processes. Defaults to the number of
+            partitions. It is not used if an executor is provided.
+        executor: Optional process Executor to run the partitions on. Usually the
+            executor of a session on the shared task pool. A single partition is
+            translated in this process and a new process pool is used for more
+            partitions if not provided.
+        progress: Optional function that is called with the number of finished
+            partitions and the total number of partitions every time one finishes.
+
+    returns:
+        A tuple with a Honeybee model and the layers of its objects from
+        model_layers.
+    """
+    if not partitions:
+        raise ValueError('At least one partition of layers is required.')
+
+    if executor is None and len(partitions) == 1:
+        # a single partition is not worth starting a process for
+        results = [import_layers(rhino_file.as_posix(), Path(config_path).as_posix(),
+                                 partitions[0])]
+        if progress:
+            progress(1, 1)
+    elif executor is None:
+        with ProcessPoolExecutor(max_workers=max_workers or len(partitions)) as pool:
+            return import_3dm_parallel(rhino_file, config_path, partitions, name,
+                                       executor=pool, progress=progress)
+    else:
+        futures = [
+            executor.submit(import_layers, rhino_file.as_posix(),
+                            Path(config_path).as_posix(), partition)
+            for partition in partitions
+        ]
+        for done, _ in enumerate(as_completed(futures), 1):
+            if progress:
+                progress(done, len(futures))
+        results = [future.result() for future in futures]
+
+    hb_faces, hb_shades, hb_apertures, hb_doors, hb_grids = ([], [], [], [], [])
+    counts = []
+    for _, objects, layer_counts in results:
+        for hb_list, hb_new in zip(
+                (hb_faces, hb_shades, hb_apertures, hb_doors, hb_grids), objects):
+            hb_list.extend(hb_new)
+        counts.extend(layer_counts)
+
+    from honeybee.model import Model
+
+    units, tolerance, angle_tolerance = results[0][0]
+    hb_model = Model(
+        identifier=name or os.path.splitext(rhino_file.name)[0],
+        rooms=[],
+        orphaned_faces=hb_faces,
+        orphaned_shades=hb_shades,
+        orphaned_apertures=hb_apertures,
+        orphaned_doors=hb_doors,
+        units=units,
+        tolerance=tolerance,
+        angle_tolerance=angle_tolerance
+    )
+    hb_model.properties.radiance.sensor_grids = hb_grids
+    return hb_model, model_layers(counts)
@@ -1,36 +1,515 @@
 """Functions to help visualize HBJSON in a browser."""
 
 
+import json
+import tempfile
+import threading
+import zipfile
 import streamlit as st
+import vtk
 
+from collections import OrderedDict
+from concurrent.futures import Executor
+from io import BytesIO
+from itertools import chain, repeat
 from pathlib import Path
-from typing import Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from honeybee_vtk.model import Model as VTKModel
-from honeybee_vtk.vtkjs.schema import SensorGridOptions, DisplayMode
+from honeybee.model import Model as HBModel
+from honeybee_vtk.model import Model as VTKModel, DATA_SETS
+from honeybee_vtk.types import JoinedPolyData, ModelDataSet, PolyData
+from honeybee_vtk.vtkjs.schema import IndexJSON, SensorGridOptions, DisplayMode
 
 from pollination_streamlit_viewer import viewer
 
+from artifact import read_metadata
+from cache import DiskCache, hash_file, hash_parts
+from executor import TASKS
+from tracing import annotate, traced
 
-@st.cache
-def write_vtkjs(hbjson_path: Path, last_updated: float, target_folder: Path,
+
+# increase this when the vtkjs output changes to invalidate the cached files
+VTKJS_VERSION = '1'
+# number of triangles of the coarse model in the viewer
+LOD_TRIANGLE_BUDGET = 200000
+# keys of a Honeybee model with geometry and the chunk type for their objects
+GEOMETRY_KEYS = {
+    'rooms': 'Room',
+    'orphaned_faces': None,
+    'orphaned_apertures': 'Aperture',
+    'orphaned_doors': 'Door',
+    'orphaned_shades': 'Shade'
+}
+# radiance properties that are not needed to create the geometry of a chunk
+NON_GEOMETRY_PROPERTIES = ('sensor_grids', 'views')
+# keys that are left out of the key of a chunk. Their values are random for objects
+# that have no name in the Rhino file
+IDENTIFIER_KEYS = ('identifier', 'display_name')
+# keys of the objects of a chunk that refer to a modifier by identifier
+MODIFIER_KEYS = ('modifier', 'modifier_blk')
+# faces that meet at a larger angle in degrees are kept as edges when decimating
+LOD_FEATURE_ANGLE = 30
+# smallest number of triangles for a dataset in a coarse level of detail so small
+# datasets like apertures are not decimated away
+LOD_MIN_TRIANGLES = 500
+# maximum size of the vtkjs files that are kept in memory
+VTKJS_MEMORY_QUOTA = 256 * 1024 ** 2
+# maximum number of HBJSON hashes and face counts that are kept in memory
+MODEL_INFO_ENTRIES = 1024
+
+VTKJS_CACHE = DiskCache(suffix='.vtkjs')
+CHUNK_CACHE = DiskCache(suffix='.vtkchunk')
+
+
+class BytesCache:
+    """A process-wide LRU cache of bytes with a size quota.
+
+    args:
+        max_bytes: Maximum total size of the values in bytes.
+    """
+
+    def __init__(self, max_bytes: int = VTKJS_MEMORY_QUOTA) -> None:
+        self.max_bytes = max_bytes
+        self._values = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._values:
+                return None
+            self._values.move_to_end(key)
+            return self._values[key]
+
+    def put(self, key: str, value: bytes) -> None:
+        with self._lock:
+            if key in self._values:
+                self._size -= len(self._values.pop(key))
+            self._values[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes and len(self._values) > 1:
+                _, removed = self._values.popitem(last=False)
+                self._size -= len(removed)
+
+
+class LRUCache:
+    """A process-wide LRU cache of small values with a maximum number of entries.
+
+    args:
+        max_entries: Maximum number of values.
+    """
+
+    def __init__(self, max_entries: int = MODEL_INFO_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> Optional[object]:
+        with self._lock:
+            if key not in self._values:
+                return None
+            self._values.move_to_end(key)
+            return self._values[key]
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._values[key] = value
+            self._values.move_to_end(key)
+            while len(self._values) > self.max_entries:
+                self._values.popitem(last=False)
+
+
+VTKJS_BYTES = BytesCache()
+# content hash of HBJSON files by path, modified time and size
+_HBJSON_HASHES = LRUCache()
+# number of faces of HBJSON files by content hash
+_FACE_COUNTS = LRUCache()
+
+
+def _hbjson_hash(hbjson_path: Path) -> str:
+    stat = hbjson_path.stat()
+    key = (hbjson_path.as_posix(), stat.st_mtime_ns, stat.st_size)
+    hbjson_hash = _HBJSON_HASHES.get(key)
+    if hbjson_hash is None:
+        hbjson_hash = hash_file(hbjson_path)
+        _HBJSON_HASHES.put(key, hbjson_hash)
+    return hbjson_hash
+
+
+def split_model(model_data: dict,
                 grid_options: SensorGridOptions = SensorGridOptions.Ignore,
-                grid_display_model: DisplayMode = DisplayMode.SurfaceWithEdges) -> Union[
-                    Path, None]:
-    """Write a vtkjs file.
+                layers: Dict[str, List[Tuple[str, int]]] = None) -> Dict[
+                    Tuple[str, str], dict]:
+    """Split a Honeybee model dictionary into smaller models by layer and type.
+
+    Objects without a layer are grouped under an empty layer name. Each chunk is a
+    valid Honeybee model dictionary with the properties of the original model and the
+    objects of the chunk.
+
+    args:
+        model_data: A Honeybee model dictionary.
+        grid_options: A SensorGridOptions object. The sensor grids are added as a
+            separate chunk if they are not ignored.
+        layers: Optional layers of the objects from the metadata of the HBJSON. See
+            translation.model_layers. The objects of a model from import_3dm have no
+            layers.
+
+    returns:
+        A dictionary of (layer, type) to model dictionary in the order the objects
+        appear in the model.
+    """
+    base = {key: value for key, value in model_data.items() if key not in GEOMETRY_KEYS}
+    properties = dict(base.get('properties', {}))
+    radiance = properties.get('radiance', {})
+    properties['radiance'] = {key: value for key, value in radiance.items()
+                              if key not in NON_GEOMETRY_PROPERTIES}
+    base['properties'] = properties
+
+    chunks = OrderedDict()
+    layers = layers or {}
+    for key, chunk_type in GEOMETRY_KEYS.items():
+        names = chain.from_iterable(
+            repeat(name, count) for name, count in layers.get(key, []))
+        for obj in model_data.get(key) or []:
+            layer = next(names, '')
+            name = (layer, chunk_type or obj['face_type'])
+            if name not in chunks:
+                chunks[name] = dict(base)
+            chunks[name].setdefault(key, []).append(obj)
+
+    grids = radiance.get('sensor_grids')
+    if grid_options != SensorGridOptions.Ignore and grids:
+        grid_properties = dict(properties)
+        grid_properties['radiance'] = dict(properties['radiance'], sensor_grids=grids)
+        chunks[('', 'Grid')] = dict(base, properties=grid_properties)
+
+    return chunks
+
+
+def _canonical(value, modifiers: Dict[str, dict]):
+    """Remove identifiers and display names from a part of a model dictionary.
+
+    Honeybee-3dm gives objects without a name a random identifier so these change
+    every time a model is translated. References to modifiers are replaced by the
+    modifiers themselves.
+    """
+    if isinstance(value, dict):
+        return {
+            key: modifiers.get(item, item)
+            if key in MODIFIER_KEYS and isinstance(item, str)
+            else _canonical(item, modifiers)
+            for key, item in value.items() if key not in IDENTIFIER_KEYS
+        }
+    if isinstance(value, list):
+        return [_canonical(item, modifiers) for item in value]
+    return value
+
+
+def _chunk_key(chunk: dict, layer: str, grid_options: SensorGridOptions,
+               grid_display_mode: DisplayMode, triangle_budget: int = None) -> str:
+    """Get a key for the geometry and the modifiers of a chunk.
+
+    The key does not change when the objects of the chunk get new identifiers.
+    """
+    radiance = chunk['properties'].get('radiance', {})
+    modifiers = {modifier['identifier']: _canonical(modifier, {})
+                 for modifier in radiance.get('modifiers') or []}
+    content = {key: chunk[key] for key in GEOMETRY_KEYS if key in chunk}
+    content['sensor_grids'] = radiance.get('sensor_grids')
+    content['units'] = chunk.get('units')
+    return hash_parts([
+        VTKJS_VERSION, layer, str(grid_options.value), str(grid_display_mode.value),
+        str(triangle_budget), json.dumps(_canonical(content, modifiers), sort_keys=True)
+    ])
+
+
+def _face_count(chunk: dict) -> int:
+    """Number of faces in a chunk. Faces of rooms are counted separately."""
+    count = sum(len(room['faces']) for room in chunk.get('rooms') or [])
+    for key in GEOMETRY_KEYS:
+        if key != 'rooms':
+            count += len(chunk.get(key) or [])
+    return count
+
+
+def model_face_count(hbjson_path: Path, hbjson_hash: str = None) -> int:
+    """Get the number of faces of an HBJSON file.
+
+    The count is read from the metadata that write_model keeps next to the HBJSON.
+    The file is only parsed if there is no metadata. Either way the count is kept in
+    memory for each content hash.
+
+    args:
+        hbjson_path: Path to the HBJSON file.
+        hbjson_hash: Optional SHA-256 hash of the HBJSON file.
+
+    returns:
+        Number of faces as counted for the triangle budget of the chunks.
+    """
+    hbjson_hash = hbjson_hash or _hbjson_hash(hbjson_path)
+    count = _FACE_COUNTS.get(hbjson_hash)
+    if count is None:
+        metadata = read_metadata(hbjson_path)
+        count = metadata.get('faces') if metadata.get('sha256') == hbjson_hash \
+            else None
+        if count is None:
+            count = _face_count(json.loads(hbjson_path.read_text()))
+        _FACE_COUNTS.put(hbjson_hash, count)
+    return count
+
+
+def chunk_budgets(chunks: List[dict], triangle_budget: int = None) -> List[Optional[int]]:
+    """Split a triangle budget between chunks based on their number of faces.
+
+    args:
+        chunks: A list of Honeybee model dictionaries from split_model.
+        triangle_budget: Total number of triangles for the model. None means no limit.
+
+    returns:
+        A list with the number of triangles for each chunk or None if there is no
+        limit.
+    """
+    if not triangle_budget:
+        return [None] * len(chunks)
+    counts = [_face_count(chunk) for chunk in chunks]
+    total = max(sum(counts), 1)
+    return [max(LOD_MIN_TRIANGLES, int(triangle_budget * count / total))
+            for count in counts]
+
+
+def decimate(data_set: ModelDataSet, triangle_budget: int) -> None:
+    """Reduce the geometry of a dataset to a number of triangles in place.
 
-    The last_updated argument here is only used by Streamlit to decide whether to
-    run the function and serve its value or to serve the last cached value of the
-    function.
+    The polygons are triangulated and joined on their shared points before they are
+    decimated. Vertices that are inside flat regions are removed first, which merges
+    coplanar faces, and edges between faces at more than LOD_FEATURE_ANGLE are kept.
+    Point and cell data are not kept.
+
+    args:
+        data_set: A honeybee-vtk ModelDataSet.
+        triangle_budget: Target number of triangles.
+    """
+    joined = JoinedPolyData.from_polydata(data_set.data)
+    triangles = vtk.vtkTriangleFilter()
+    triangles.SetInputConnection(joined.GetOutputPort())
+    clean = vtk.vtkCleanPolyData()
+    clean.SetInputConnection(triangles.GetOutputPort())
+    clean.Update()
+    output = clean.GetOutput()
+
+    count = output.GetNumberOfPolys()
+    if count > triangle_budget:
+        decimation = vtk.vtkDecimatePro()
+        decimation.SetInputConnection(clean.GetOutputPort())
+        decimation.SetTargetReduction(1 - triangle_budget / count)
+        decimation.PreserveTopologyOff()
+        decimation.SetFeatureAngle(LOD_FEATURE_ANGLE)
+        decimation.BoundaryVertexDeletionOn()
+        decimation.Update()
+        output = decimation.GetOutput()
+
+    polydata = PolyData()
+    polydata.ShallowCopy(output)
+    data_set.data = [polydata]
+
+
+def write_chunk(chunk: dict, layer: str, target_file: Path, prefix: str,
+                grid_options: SensorGridOptions = SensorGridOptions.Ignore,
+                grid_display_mode: DisplayMode = DisplayMode.SurfaceWithEdges,
+                triangle_budget: int = None) -> Path:
+    """Convert a chunk of a model to vtkjs datasets and write them to a zip file.
+
+    The zip file has a folder for every dataset and a datasets.json file with the
+    vtkjs scene entries of the datasets.
+
+    args:
+        chunk: A Honeybee model dictionary from split_model.
+        layer: Layer name of the chunk. It is added to the names of the datasets.
+        target_file: Path to the zip file.
+        prefix: A prefix for the dataset folders that is unique to this chunk.
+        grid_options: A SensorGridOptions object.
+        grid_display_mode: Display mode for the Grids.
+        triangle_budget: Optional number of triangles for the geometry of the chunk.
+            The budget is split between the datasets based on their number of
+            polygons. Each dataset keeps its own color so apertures and shades stay
+            distinct. Sensor grids are not decimated.
+
+    returns:
+        Path to the zip file.
+    """
+    model = VTKModel(HBModel.from_dict(chunk), grid_options)
+    model.update_display_mode(DisplayMode.Shaded)
+    model.sensor_grids.display_mode = grid_display_mode
+
+    data_sets = [getattr(model, data_set) for data_set in DATA_SETS.values()]
+    if triangle_budget:
+        counts = [sum(data.GetNumberOfPolys() for data in data_set.data)
+                  for data_set in data_sets]
+        total = max(sum(counts), 1)
+        for data_set, count in zip(data_sets, counts):
+            if count:
+                decimate(data_set, max(LOD_MIN_TRIANGLES,
+                                       int(triangle_budget * count / total)))
+    data_sets.append(model.sensor_grids)
+
+    scene = []
+    with tempfile.TemporaryDirectory() as temp_folder, \
+            zipfile.ZipFile(target_file, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for data_set in data_sets:
+            if not data_set.data:
+                continue
+            sub_folder = f'{prefix}_{data_set.name}'
+            data_set.to_folder(temp_folder, sub_folder)
+            entry = data_set.as_data_set(url=sub_folder).dict()
+            if layer:
+                entry['name'] = f'{layer}::{data_set.name}'
+            scene.append(entry)
+
+        for file_path in sorted(Path(temp_folder).rglob('*')):
+            if file_path.is_file():
+                zip_file.write(file_path, file_path.relative_to(temp_folder).as_posix())
+        zip_file.writestr('datasets.json', json.dumps(scene))
+
+    return target_file
+
+
+def _get_chunk(chunk: dict, layer: str, key: str, grid_options: SensorGridOptions,
+               grid_display_mode: DisplayMode, triangle_budget: int = None) -> Path:
+    cached = CHUNK_CACHE.get(key)
+    if cached:
+        return cached
+
+    with tempfile.TemporaryDirectory() as temp_folder:
+        chunk_file = write_chunk(chunk, layer, Path(temp_folder, 'chunk.zip'), key[:16],
+                                 grid_options, grid_display_mode, triangle_budget)
+        return CHUNK_CACHE.put(key, chunk_file)
+
+
+def merge_chunks(chunk_files: List[Path]) -> bytes:
+    """Merge chunk zip files from write_chunk into a single vtkjs file.
+
+    args:
+        chunk_files: A list of paths to chunk zip files.
+
+    returns:
+        The vtkjs file as bytes.
+    """
+    index_json = IndexJSON().dict()
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as vtkjs_file:
+        for chunk_file in chunk_files:
+            with zipfile.ZipFile(chunk_file) as zip_file:
+                for info in zip_file.infolist():
+                    if info.filename == 'datasets.json':
+                        index_json['scene'].extend(json.loads(zip_file.read(info)))
+                    else:
+                        vtkjs_file.writestr(info.filename, zip_file.read(info))
+        vtkjs_file.writestr('index.json', json.dumps(index_json))
+    return buffer.getvalue()
+
+
+@traced('vtkjs')
+def vtkjs_bytes(hbjson_path: Path,
+                grid_options: SensorGridOptions = SensorGridOptions.Ignore,
+                grid_display_mode: DisplayMode = DisplayMode.SurfaceWithEdges,
+                hbjson_hash: str = None, triangle_budget: int = None,
+                executor: Executor = None) -> bytes:
+    """Get the vtkjs file of an HBJSON as bytes.
+
+    The vtkjs file is keyed on the content of the HBJSON. It is served from memory if
+    possible and from the on-disk cache otherwise. When the HBJSON changes the model
+    is split by layer and type and only the chunks that changed are converted again.
+    With an executor, the conversion runs in a worker process and sessions that need
+    the same vtkjs file at the same time wait for a single conversion.
+
+    args:
+        hbjson_path: Path to the HBJSON file to be converted to vtkjs.
+        grid_options: a SensorGridOptions object to indicate what to do with the grids
+            found in HBJSON. Defaults to ignoring the grids in the model.
+        grid_display_mode: Display mode for the Grids. Defaults to SurfaceWithEdges.
+        hbjson_hash: Optional SHA-256 hash of the HBJSON file. It is calculated from
+            the file if not provided.
+        triangle_budget: Optional number of triangles for a coarse level of detail.
+            The full model is converted if not provided.
+        executor: Optional process Executor to convert the model on. Usually the
+            executor of a session on the shared task pool.
+
+    returns:
+        The vtkjs file as bytes.
+    """
+    key = hash_parts([
+        VTKJS_VERSION, hbjson_hash or _hbjson_hash(hbjson_path),
+        str(grid_options.value), str(grid_display_mode.value), str(triangle_budget)
+    ])
+
+    content = VTKJS_BYTES.get(key)
+    if content is not None:
+        annotate(cache='hit', tier='memory', bytes_out=len(content))
+        return content
+
+    cached = VTKJS_CACHE.get(key)
+    if cached:
+        content = cached.read_bytes()
+        annotate(cache='hit', tier='disk')
+    else:
+        annotate(cache='miss', bytes_in=hbjson_path)
+        args = (key, hbjson_path, grid_options, grid_display_mode, triangle_budget)
+        if executor is None:
+            content = convert_vtkjs(*args)
+        else:
+            content, _ = TASKS.shared(
+                key, lambda: executor.submit(convert_vtkjs, *args).result())
+
+    VTKJS_BYTES.put(key, content)
+    annotate(bytes_out=len(content))
+    return content
+
+
+def convert_vtkjs(key: str, hbjson_path: Path, grid_options: SensorGridOptions,
+                  grid_display_mode: DisplayMode, triangle_budget: int = None) -> bytes:
+    """Convert an HBJSON to vtkjs and add it to the on-disk cache under a key.
+
+    This function does not use the in-memory cache so it can run in a worker process.
+    See vtkjs_bytes for the arguments.
+
+    returns:
+        The vtkjs file as bytes.
+    """
+    model_data = json.loads(hbjson_path.read_text())
+    chunks = split_model(model_data, grid_options,
+                         read_metadata(hbjson_path).get('layers'))
+    budgets = chunk_budgets(list(chunks.values()), triangle_budget)
+    chunk_files = [
+        _get_chunk(chunk, layer,
+                   _chunk_key(chunk, layer, grid_options, grid_display_mode, budget),
+                   grid_options, grid_display_mode, budget)
+        for ((layer, _), chunk), budget in zip(chunks.items(), budgets)
+    ]
+    content = merge_chunks(chunk_files)
+    with tempfile.TemporaryDirectory() as temp_folder:
+        vtkjs_file = Path(temp_folder, 'model.vtkjs')
+        vtkjs_file.write_bytes(content)
+        VTKJS_CACHE.put(key, vtkjs_file)
+    return content
+
+
+def write_vtkjs(hbjson_path: Path, target_folder: Path,
+                grid_options: SensorGridOptions = SensorGridOptions.Ignore,
+                grid_display_model: DisplayMode = DisplayMode.SurfaceWithEdges,
+                hbjson_hash: str = None,
+                triangle_budget: int = None) -> Union[Path, None]:
+    """Write a vtkjs file.
 
     args:
         hbjson_path: Path to the HBJSON file to be converted to vtkjs.
-        last_updated: Last updated time of the HBJSON file as a float.
         target_folder: Path to the folder where the vtkjs file will be written.
         grid_options: a SensorGridOptions object to indicate what to do with the grids
             found in HBJSON. Defaults to ignoring the grids in the model.
         grid_display_mode: Display mode for the Grids. Defaults to SurfaceWithEdges.
             Other options are shaded, surface, wireframe, and points.
+        hbjson_hash: Optional SHA-256 hash of the HBJSON file.
+        triangle_budget: Optional number of triangles for a coarse level of detail.
+            The file name ends with _lod if it is provided.
 
     returns:
         Path to the written vtkjs file.
@@ -38,19 +517,13 @@ def write_vtkjs(hbjson_path: Path, last_updated: float, target_folder: Path,
     if not hbjson_path:
         return
 
-    model = VTKModel.from_hbjson(hbjson_path.as_posix(), load_grids=grid_options)
-
     vtkjs_folder = target_folder.joinpath('vtkjs')
+    vtkjs_folder.mkdir(parents=True, exist_ok=True)
 
-    if not vtkjs_folder.exists():
-        vtkjs_folder.mkdir(parents=True, exist_ok=True)
-
-    vtkjs_file = vtkjs_folder.joinpath(f'{hbjson_path.stem}.vtkjs')
-    model.to_vtkjs(
-        folder=vtkjs_folder.as_posix(),
-        name=hbjson_path.stem,
-        grid_display_mode=grid_display_model
-    )
+    name = f'{hbjson_path.stem}_lod' if triangle_budget else hbjson_path.stem
+    vtkjs_file = vtkjs_folder.joinpath(f'{name}.vtkjs')
+    vtkjs_file.write_bytes(vtkjs_bytes(hbjson_path, grid_options, grid_display_model,
+                                       hbjson_hash, triangle_budget))
 
     return vtkjs_file
 
@@ -58,18 +531,18 @@ def write_vtkjs(hbjson_path: Path, last_updated: float, target_folder: Path,
 def show_model(hbjson_path: Path, target_folder: Path,
                key: str = '3d_viewer',
                grid_options: SensorGridOptions = SensorGridOptions.Ignore,
-               subscribe: bool = False) -> None:
+               subscribe: bool = False, hbjson_hash: str = None,
+               triangle_budget: int = None, executor: Executor = None) -> None:
     """Show HBJSON in a browser.
 
-    If not done already, this function will convert the HBJSON to vtkjs and write to
-    a folder first. This is done so that the next time a call is made to visualize the
-    same HBJSON, the function will simply visualize the already created vtkjs file 
-    rather than creating it again.
+    The HBJSON is converted to vtkjs only if the same content has not been converted
+    before in any session. The vtkjs file is kept in memory so reruns send it to the
+    viewer without reading it from the disk.
 
     args:
         hbjson_path: Path to the HBJSON file you'd like to visualize in the browser.
-        last_updated_time: Last updated time of the HBJSON file.
-        target_folder: Path to the folder where the vtkjs file will be written.
+        target_folder: Path to the folder where the vtkjs file will be written. It is
+            kept for compatibility. The vtkjs file is kept in the shared cache.
         key: A unique string for this instance of the viewer.
         grid_options: A SensorGridOptions object to indicate what to do with the grids
             found in HBJSON. Defaults to ignoring the grids found in the model.
@@ -77,18 +550,24 @@ def show_model(hbjson_path: Path, target_folder: Path,
         subscribe: A boolean to subscribe or unsubscribe the VTKJS camera
              and renderer content. If you don't know what you're doing, it's best to
              keep this to False.
+        hbjson_hash: Optional SHA-256 hash of the HBJSON file. It is calculated from
+            the file once for every modified time if not provided.
+        triangle_budget: Optional number of triangles for a coarse level of detail.
+            The coarse model is shown first and the full model is only converted and
+            sent to the viewer when the user asks for it. Models with fewer faces
+            than the budget are shown in full detail right away.
+        executor: Optional process Executor to convert the model on. Usually the
+            executor of the session on the shared task pool.
     """
+    if triangle_budget and \
+            model_face_count(hbjson_path, hbjson_hash) <= triangle_budget:
+        triangle_budget = None
+    if triangle_budget and not st.checkbox('Show full detail', key=f'{key}_detail'):
+        budget = triangle_budget
+    else:
+        budget = None
+    with st.spinner('Preparing the 3D model...'):
+        content = vtkjs_bytes(hbjson_path, grid_options, hbjson_hash=hbjson_hash,
+                              triangle_budget=budget, executor=executor)
 
-    vtkjs_name = f'{hbjson_path.stem}_vtkjs'
-
-    vtkjs = write_vtkjs(hbjson_path, hbjson_path.stat().st_mtime, target_folder,
-                        grid_options)
-
-    # if vtkjs_name not in st.session_state:
-    #     vtkjs = write_vtkjs(hbjson_path, hbjson_path.stat().st_mtime, target_folder,
-    #                         grid_options)
-    #     st.session_state[vtkjs_name] = vtkjs
-    # else:
-    #     vtkjs = st.session_state[vtkjs_name]
-
-    viewer(content=vtkjs.read_bytes(), key=key, subscribe=subscribe)
+    viewer(content=content, key=key, subscribe=subscribe)
@@ -0,0 +1,156 @@
+"""Import the heavy dependencies of the app in the background and report import times.
+
+The app imports rhino3dm, ladybug, honeybee, honeybee-vtk and the Pollination clients
+in the stage that first needs them so a new server draws its first page quickly.
+warm_up imports them on a background thread once the first page is drawn so they are
+usually loaded before a user gets to those stages. Set VIZAN_WARMUP=0 to turn it off.
+
+The report imports each module in a fresh interpreter and prints its cold import time.
+
+usage:
+    python warmup.py --output import_times.json
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+from tracing import span
+
+
+APP_FOLDER = Path(__file__).parent
+# modules of the first page of the app
+FIRST_PAGE_MODULES = ('app',)
+# heavy modules in the order that the stages of the app need them
+WARMUP_MODULES = (
+    'rhino3dm',
+    'honeybee_radiance.view',
+    'honeybee_3dm.config',
+    'honeybee_3dm.model',
+    'ladybug.dt',
+    'honeybee_radiance.lightsource.sky',
+    'viewer',
+    'simulation',
+    'backend',
+    'PIL.Image',
+)
+
+# seconds that the warm-up took to import each module in this process
+IMPORT_TIMES: Dict[str, float] = {}
+_WARMUP_THREAD = None
+_WARMUP_LOCK = threading.Lock()
+
+
+def warmup_enabled() -> bool:
+    """Check if the warm-up is on. It is on unless VIZAN_WARMUP is set to 0."""
+    return os.environ.get('VIZAN_WARMUP', '1').lower() not in ('0', 'false', 'no')
+
+
+def preload(modules: Iterable[str] = WARMUP_MODULES) -> Dict[str, float]:
+    """Import modules and record how long each took.
+
+    Modules that fail to import are skipped. The stage that needs them raises the
+    error again.
+
+    returns:
+        A dictionary of module name to seconds. Modules that were already imported
+        take close to zero seconds.
+    """
+    times = {}
+    for module in modules:
+        start = time.perf_counter()
+        with span('warmup', module=module):
+            try:
+                importlib.import_module(module)
+            except Exception:
+                continue
+        times[module] = IMPORT_TIMES[module] = time.perf_counter() - start
+    return times
+
+
+def warm_up(modules: Iterable[str] = WARMUP_MODULES) -> threading.Thread:
+    """Start importing modules on a daemon thread once per process.
+
+    Call this after the first page is drawn. The thread competes with the script for
+    the interpreter so calling it earlier delays the first page.
+
+    returns:
+        The warm-up thread or None if the warm-up is off.
+    """
+    global _WARMUP_THREAD
+    if not warmup_enabled():
+        return None
+    with _WARMUP_LOCK:
+        if _WARMUP_THREAD is None:
+            _WARMUP_THREAD = threading.Thread(
+                target=preload, args=(tuple(modules),), name='vizan-warmup',
+                daemon=True)
+            _WARMUP_THREAD.start()
+        return _WARMUP_THREAD
+
+
+def import_time(module: str, python: str = sys.executable) -> float:
+    """Import a module in a fresh interpreter and get its cold import time in seconds.
+
+    The interpreter starts in the folder of the app so the modules of the app can be
+    imported by name.
+    """
+    code = (f'import time; start = time.perf_counter(); import {module}; '
+            f'print(time.perf_counter() - start)')
+    process = subprocess.run([python, '-c', code], cwd=APP_FOLDER,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    if process.returncode != 0:
+        raise ImportError(f'Failed to import {module}: '
+                          f'{process.stderr.strip().splitlines()[-1:]}')
+    return float(process.stdout.strip().splitlines()[-1])
+
+
+def import_report(modules: Iterable[str], repeat: int = 3) -> Dict[str, float]:
+    """Get the fastest cold import time of each module out of several runs.
+
+    returns:
+        A dictionary of module name to seconds. Modules that failed to import are
+        not included.
+    """
+    report = {}
+    for module in modules:
+        try:
+            report[module] = min(import_time(module) for _ in range(repeat))
+        except ImportError as error:
+            print(error, file=sys.stderr)
+    return report
+
+
+def main(args: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Report cold import times.')
+    parser.add_argument('--modules', nargs='+',
+                        default=list(FIRST_PAGE_MODULES + WARMUP_MODULES),
+                        help='Modules to import. Defaults to the first page and the '
+                        'modules of the warm-up.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of fresh imports of each module.')
+    parser.add_argument('--output', type=Path, default=None,
+                        help='Optional path to write the report as JSON.')
+    options = parser.parse_args(args)
+
+    report = import_report(options.modules, options.repeat)
+    width = max(len(module) for module in options.modules)
+    for module, seconds in report.items():
+        print(f'{module:<{width}} {seconds * 1000:>9.1f} ms')
+
+    if options.output:
+        options.output.write_text(json.dumps(
+            {'python': sys.version.split()[0], 'import_seconds': report}, indent=2))
+    return 0 if len(report) == len(options.modules) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+"""Folders of the sessions with a shared disk quota.
+
+Each session writes its uploads, models and results to its own folder under a single
+root. Folders of sessions that were not used for a while are removed and when all the
+folders together grow beyond the quota the least recently used sessions are removed
+first. Large files that several sessions upload, such as the same Rhino file or EPW,
+are stored once and hard linked into each folder.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List
+
+from cache import link_file
+
+
+WORKSPACE_FOLDER = Path(os.environ.get(
+    'VIZAN_WORKSPACE_FOLDER', Path(tempfile.gettempdir(), 'vizan_workspaces')))
+# maximum size of all the workspaces in bytes
+WORKSPACE_QUOTA = int(os.environ.get('VIZAN_WORKSPACE_QUOTA', 5 * 1024 ** 3))
+# seconds after which the folder of an unused session is removed
+WORKSPACE_IDLE = float(os.environ.get('VIZAN_WORKSPACE_IDLE', 2 * 60 * 60))
+# sessions that were used within this many seconds are never removed for the quota
+MIN_IDLE = 5 * 60
+# seconds between two scans of the workspaces on the background thread
+SCAN_INTERVAL = 30
+# folders of the root that are not sessions
+BLOB_FOLDER = '.blobs'
+TRASH_FOLDER = '.trash'
+
+
+@dataclass
+class WorkspaceStats:
+    """Disk usage of the workspaces.
+
+    args:
+        sessions: Number of session folders.
+        bytes: Size of all the files. Hard linked files are counted once.
+        files: Number of files. Hard linked files are counted once.
+        quota: Maximum size of all the files in bytes.
+        evicted: Number of sessions that were removed to stay within the quota.
+        expired: Number of sessions that were removed because they were not used.
+        deduplicated: Bytes that were saved by linking identical files.
+    """
+    sessions: int = 0
+    bytes: int = 0
+    files: int = 0
+    quota: int = 0
+    evicted: int = 0
+    expired: int = 0
+    deduplicated: int = 0
+
+
+@dataclass
+class _Inode:
+    size: int
+    links: int
+    seen: int = 0
+    owners: set = None
+
+
+class WorkspaceManager:
+    """Create, expire and evict the folders of the sessions.
+
+    The last use of a session is kept in memory and in the modified time of its folder
+    so the folders of an earlier process are managed after a restart. The folders are
+    scanned on a background thread so the scripts of the sessions never wait for it,
+    and sessions that are busy with a long stage are never removed.
+
+    args:
+        root: Path to the folder of all the workspaces.
+        quota: Maximum size of all the workspaces in bytes.
+        idle_timeout: Seconds after which the folder of an unused session is removed.
+        min_idle: Sessions that were used within this many seconds are never removed
+            to stay within the quota.
+        scan_interval: Seconds between two scans of the folders.
+    """
+
+    def __init__(self, root: Path = WORKSPACE_FOLDER, quota: int = WORKSPACE_QUOTA,
+                 idle_timeout: float = WORKSPACE_IDLE, min_idle: float = MIN_IDLE,
+                 scan_interval: float = SCAN_INTERVAL) -> None:
+        self.root = Path(root)
+        self.quota = quota
+        self.idle_timeout = idle_timeout
+        self.min_idle = min_idle
+        self.scan_interval = scan_interval
+        self._last_used: Dict[str, float] = OrderedDict()
+        self._busy: Dict[str, int] = {}
+        self._recovered = False
+        self._scanner = None
+        self._stats = WorkspaceStats(quota=quota)
+        self._lock = threading.Lock()
+
+    def path(self, session_id: str) -> Path:
+        """Path to the folder of a session."""
+        return self.root.joinpath(session_id)
+
+    def acquire(self, session_id: str) -> Path:
+        """Get the folder of a session and mark it as used.
+
+        The folder is created if it does not exist, for instance because it expired
+        or was evicted. The first call starts the background thread that checks the
+        files of the sessions against the quota every scan_interval seconds.
+
+        args:
+            session_id: ID of the session.
+
+        returns:
+            Path to the folder of the session.
+        """
+        with self._lock:
+            self._recover()
+            folder = self.path(session_id)
+            folder.mkdir(parents=True, exist_ok=True)
+            self._touch(session_id)
+            if self._scanner is None or not self._scanner.is_alive():
+                self._scanner = threading.Thread(
+                    target=self._run, name='workspace-scan', daemon=True)
+                self._scanner.start()
+        return folder
+
+    @contextmanager
+    def busy(self, session_id: str):
+        """Keep the folder of a session while a stage writes to it.
+
+        Use it as a context manager around stages that can run for longer than
+        min_idle, such as a translation or a download. The session is marked as used
+        when the stage starts and when it ends.
+
+        args:
+            session_id: ID of the session.
+        """
+        with self._lock:
+            self._busy[session_id] = self._busy.get(session_id, 0) + 1
+            self._touch(session_id)
+        try:
+            yield self.path(session_id)
+        finally:
+            with self._lock:
+                self._busy[session_id] -= 1
+                if not self._busy[session_id]:
+                    del self._busy[session_id]
+                self._touch(session_id)
+
+    def touch(self, session_id: str) -> None:
+        """Mark a session as used."""
+        with self._lock:
+            self._touch(session_id)
+
+    def _touch(self, session_id: str) -> None:
+        self._last_used[session_id] = time.time()
+        self._last_used.move_to_end(session_id)
+        try:
+            os.utime(self.path(session_id))
+        except FileNotFoundError:
+            pass
+
+    def _recover(self) -> None:
+        """Read the last use of the folders of an earlier process from their mtime."""
+        if self._recovered:
+            return
+        self._recovered = True
+        if not self.root.exists():
+            return
+        folders = [
+            (folder.stat().st_mtime, folder.name) for folder in self.root.iterdir()
+            if folder.is_dir() and not folder.name.startswith('.')
+        ]
+        for last_used, session_id in sorted(folders):
+            self._last_used.setdefault(session_id, last_used)
+        # an earlier process can have stopped before it emptied the trash
+        self._empty_trash()
+
+    def dedupe(self, file_path: Path, content_hash: str) -> Path:
+        """Share a file with the identical files of the other sessions.
+
+        The first file with a hash is kept as a blob and the next files with the same
+        hash are replaced with a hard link to it. The file must never be modified in
+        place afterwards. Replace it with a new file instead.
+
+        args:
+            file_path: Path to a file in the folder of a session.
+            content_hash: SHA-256 hash of the content of the file.
+
+        returns:
+            Path to the file.
+        """
+        blob = self.root.joinpath(BLOB_FOLDER, content_hash[:2], content_hash)
+        with self._lock:
+            if not blob.exists():
+                link_file(file_path, blob)
+            elif not os.path.samefile(blob, file_path):
+                size = file_path.stat().st_size
+                link_file(blob, file_path)
+                if os.path.samefile(blob, file_path):
+                    self._stats.deduplicated += size
+        return file_path
+
+    def enforce(self, keep: str = None) -> WorkspaceStats:
+        """Remove expired sessions and evict sessions until the quota is met.
+
+        Sessions that are busy are never removed.
+
+        args:
+            keep: Optional ID of a session that is never removed. Usually the session
+                that is using its folder right now.
+
+        returns:
+            WorkspaceStats after the removals.
+        """
+        inodes, sessions = self._scan()
+        now = time.time()
+        removed: List[Path] = []
+        with self._lock:
+            self._recover()
+            for session_id in list(self._last_used):
+                if session_id != keep and session_id not in self._busy and \
+                        now - self._last_used[session_id] > self.idle_timeout:
+                    removed.append(self._remove(session_id))
+                    self._stats.expired += 1
+                    self._release(inodes, session_id)
+
+            usage = sum(inode.size for inode in inodes.values())
+            for session_id in list(self._last_used):
+                if usage <= self.quota:
+                    break
+                if session_id == keep or session_id in self._busy or \
+                        now - self._last_used[session_id] < self.min_idle:
+                    continue
+                usage -= self._release(inodes, session_id)
+                removed.append(self._remove(session_id))
+                self._stats.evicted += 1
+
+            remaining = sessions - {folder.name.split('.')[0] for folder in removed}
+            self._stats.sessions = len(remaining)
+            self._stats.bytes = sum(inode.size for inode in inodes.values())
+            self._stats.files = len(inodes)
+        for folder in removed:
+            shutil.rmtree(folder, ignore_errors=True)
+        with self._lock:
+            self._collect_blobs()
+        return self.stats()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.scan_interval)
+            try:
+                self.enforce()
+            except OSError:
+                # files that change while they are scanned. The next scan retries
+                pass
+
+    def _scan(self) -> tuple:
+        """Get the unique files of the root and the sessions that link to each."""
+        inodes: Dict[tuple, _Inode] = {}
+        sessions = set()
+        if not self.root.exists():
+            return inodes, sessions
+        for folder in self.root.iterdir():
+            if folder.name == TRASH_FOLDER or not folder.is_dir():
+                continue
+            owner = folder.name
+            if owner != BLOB_FOLDER:
+                sessions.add(owner)
+            for parent, _, files in os.walk(folder):
+                for name in files:
+                    try:
+                        stat = os.lstat(os.path.join(parent, name))
+                    except FileNotFoundError:
+                        continue
+                    key = (stat.st_dev, stat.st_ino)
+                    inode = inodes.get(key)
+                    if inode is None:
+                        inode = inodes[key] = _Inode(stat.st_size, stat.st_nlink,
+                                                     owners=set())
+                    inode.seen += 1
+                    inode.owners.add(owner)
+        return inodes, sessions
+
+    @staticmethod
+    def _release(inodes: Dict[tuple, _Inode], session_id: str) -> int:
+        """Forget the files of a session and get the bytes that removing it frees.
+
+        A file is freed if no other session links to it and it has no links outside
+        of the workspaces. A blob that only this session used is freed with it.
+        """
+        freed = 0
+        for key, inode in list(inodes.items()):
+            if session_id not in inode.owners:
+                continue
+            inode.owners.discard(session_id)
+            if inode.owners <= {BLOB_FOLDER} and inode.seen == inode.links:
+                freed += inode.size
+                del inodes[key]
+        return freed
+
+    def _remove(self, session_id: str) -> Path:
+        """Move the folder of a session to the trash so it can be deleted without
+        the lock. A session that comes back gets a new empty folder."""
+        del self._last_used[session_id]
+        folder = self.path(session_id)
+        trash = self.root.joinpath(TRASH_FOLDER, f'{session_id}.{uuid.uuid4().hex}')
+        trash.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(folder, trash)
+        except FileNotFoundError:
+            pass
+        return trash
+
+    def _collect_blobs(self) -> None:
+        """Delete the blobs that are not linked to any session anymore."""
+        blob_folder = self.root.joinpath(BLOB_FOLDER)
+        if not blob_folder.exists():
+            return
+        for blob in blob_folder.glob('*/*'):
+            try:
+                if blob.stat().st_nlink == 1:
+                    blob.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _empty_trash(self) -> None:
+        shutil.rmtree(self.root.joinpath(TRASH_FOLDER), ignore_errors=True)
+
+    def stats(self) -> WorkspaceStats:
+        """Get the disk usage of the workspaces from the last scan."""
+        with self._lock:
+            stats = self._stats
+            return WorkspaceStats(stats.sessions, stats.bytes, stats.files, self.quota,
+                                  stats.evicted, stats.expired, stats.deduplicated)
+
+
+def format_size(size: float) -> str:
+    """Format a number of bytes for humans. Example is 1.5 GB."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{int(size)} B'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+
+WORKSPACES = WorkspaceManager()